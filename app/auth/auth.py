@@ -1,11 +1,15 @@
 from passlib.context import CryptContext
+from concurrent.futures import ThreadPoolExecutor
 from jose import jwt, JWTError
 from datetime import datetime, timedelta
-from typing import Dict, Optional
+from typing import Dict, Optional, Tuple
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 from bson import ObjectId
+from cachetools import TTLCache
+import asyncio
 import os
+import time
 from dotenv import load_dotenv
 
 from app.db.mongo_db_connection import get_database
@@ -19,11 +23,61 @@ SECRET_KEY = os.getenv("SECRET_KEY", "your_super_secret_key")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", "30"))
 
+# Authenticated-user cache settings
+USER_CACHE_TTL_SECONDS = int(os.getenv("USER_CACHE_TTL_SECONDS", "60"))
+USER_CACHE_MAX_SIZE = int(os.getenv("USER_CACHE_MAX_SIZE", "10000"))
+# Put the user's profile in the token so authenticated requests skip MongoDB entirely.
+# The claims are a snapshot: profile changes show up once the user logs in again.
+TOKEN_EMBED_USER_CLAIMS = os.getenv("TOKEN_EMBED_USER_CLAIMS", "false").lower() == "true"
+
+# Password hashing settings
+# bcrypt work factor; stored hashes with a different factor are rehashed on login
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+# Threads doing bcrypt work (bcrypt releases the GIL, so these run in parallel)
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(min(4, os.cpu_count() or 1))))
+# Hash/verify calls allowed to be queued or running before callers wait
+PASSWORD_HASH_MAX_PENDING = int(os.getenv("PASSWORD_HASH_MAX_PENDING", "64"))
+
 # Password handling
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+pwd_context = CryptContext(
+    schemes=["bcrypt"],
+    deprecated="auto",
+    bcrypt__default_rounds=BCRYPT_ROUNDS,
+    bcrypt__min_rounds=BCRYPT_ROUNDS,
+    bcrypt__max_rounds=BCRYPT_ROUNDS,
+)
+
+# bcrypt is deliberately slow, so it runs off the event loop in a bounded pool
+_hash_executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="password-hash")
+_hash_slots = asyncio.Semaphore(PASSWORD_HASH_MAX_PENDING)
+_hash_stats = {"calls": 0, "queue_seconds_total": 0.0, "queue_seconds_max": 0.0}
 
 # OAuth2 setup
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="user/login")
+# Same scheme for endpoints that also accept anonymous requests
+optional_oauth2_scheme = OAuth2PasswordBearer(tokenUrl="user/login", auto_error=False)
+
+# User id -> UserResponse, per process; entries expire after USER_CACHE_TTL_SECONDS
+_user_cache = TTLCache(maxsize=USER_CACHE_MAX_SIZE, ttl=USER_CACHE_TTL_SECONDS)
+
+def cache_user(user: UserResponse):
+    """Store a user in the authenticated-user cache"""
+    _user_cache[str(user.id)] = user
+
+def invalidate_cached_user(user_id) -> None:
+    """Drop a user from the authenticated-user cache after their document changes"""
+    _user_cache.pop(str(user_id), None)
+
+def user_token_claims(user: UserResponse) -> Dict:
+    """Claims for a user's access token (profile included if TOKEN_EMBED_USER_CLAIMS is set)"""
+    claims = {"sub": str(user.id)}
+    if TOKEN_EMBED_USER_CLAIMS:
+        claims.update({
+            "username": user.username,
+            "email": user.email,
+            "created_at": user.created_at.isoformat(),
+        })
+    return claims
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     """Verify password against hash"""
@@ -33,6 +87,45 @@ def get_password_hash(password: str) -> str:
     """Hash password"""
     return pwd_context.hash(password)
 
+async def _run_password_work(func, *args):
+    """Run a hashing function in the password pool and record how long it queued"""
+    async with _hash_slots:
+        submitted = time.perf_counter()
+
+        def timed():
+            queue_seconds = time.perf_counter() - submitted
+            _hash_stats["calls"] += 1
+            _hash_stats["queue_seconds_total"] += queue_seconds
+            _hash_stats["queue_seconds_max"] = max(_hash_stats["queue_seconds_max"], queue_seconds)
+            return func(*args)
+
+        return await asyncio.get_running_loop().run_in_executor(_hash_executor, timed)
+
+async def hash_password(password: str) -> str:
+    """Hash password without blocking the event loop"""
+    return await _run_password_work(pwd_context.hash, password)
+
+async def verify_and_update_password(plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    """
+    Verify password without blocking the event loop
+
+    Returns:
+        tuple: (whether the password matches, new hash to store if the old
+        one used a different work factor or scheme, else None)
+    """
+    return await _run_password_work(pwd_context.verify_and_update, plain_password, hashed_password)
+
+def password_hashing_stats() -> Dict:
+    """Pool size and queue-time metrics for password hashing"""
+    calls = _hash_stats["calls"]
+    return {
+        "workers": PASSWORD_HASH_WORKERS,
+        "rounds": BCRYPT_ROUNDS,
+        "calls": calls,
+        "queue_seconds_avg": _hash_stats["queue_seconds_total"] / calls if calls else 0.0,
+        "queue_seconds_max": _hash_stats["queue_seconds_max"],
+    }
+
 def create_access_token(data: Dict, expires_delta: Optional[timedelta] = None) -> str:
     """Create JWT access token"""
     to_encode = data.copy()
@@ -58,14 +151,41 @@ async def get_current_user(token: str = Depends(oauth2_scheme)) -> UserResponse:
     except JWTError:
         raise credentials_exception
         
+    # Profile carried in the token: no lookup needed
+    if "username" in payload and "email" in payload and "created_at" in payload:
+        return UserResponse(
+            _id=user_id,
+            username=payload["username"],
+            email=payload["email"],
+            created_at=payload["created_at"]
+        )
+
+    cached_user = _user_cache.get(user_id)
+    if cached_user is not None:
+        return cached_user
+
     # Get database
     db = get_database()
-    if not db:
+    if db is None:
         raise HTTPException(status_code=500, detail="Database connection not available")
     
     # Get user from database
-    user = await db.users.find_one({"_id": ObjectId(user_id)})
+    user = await db.users.find_one(
+        {"_id": ObjectId(user_id)},
+        {"username": 1, "email": 1, "created_at": 1}
+    )
     if user is None:
         raise credentials_exception
-        
-    return UserResponse(**user)
\ No newline at end of file
+
+    current_user = UserResponse(**user)
+    cache_user(current_user)
+    return current_user
+
+async def get_optional_current_user(token: Optional[str] = Depends(optional_oauth2_scheme)) -> Optional[UserResponse]:
+    """Current user if a valid token was sent, else None"""
+    if not token:
+        return None
+    try:
+        return await get_current_user(token)
+    except HTTPException:
+        return None
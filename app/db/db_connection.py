@@ -43,43 +43,34 @@
 
 
 
-import psycopg2
-from psycopg2 import Error
-import os
-from dotenv import load_dotenv
+from app.db.targets import get_target
 
-# Load environment variables from .env file (optional but recommended)
-load_dotenv()
-
-def get_connection():
+def get_connection(target=None, read_only=False):
     """
-    Creates and returns a connection to PostgreSQL database using environment variables.
+    Borrows a connection to a database target from its pool.
+    
+    Args:
+        target: Target name (defaults to the DB_NAME database)
+        read_only: Only reads will be run, so a healthy replica may be used instead of the primary
     
     Returns:
         connection: PostgreSQL database connection object if successful, None otherwise
+    
+    Raises:
+        UnknownTargetError: If the target is not configured
     """
-    try:
-        connection = psycopg2.connect(
-            host=os.getenv("DB_HOST", "localhost"),
-            user=os.getenv("DB_USER", "postgres"),
-            password=os.getenv("DB_PASSWORD", "admin"),
-            dbname=os.getenv("DB_NAME", "clinical_study_db"),
-            port=os.getenv("DB_PORT", "5432")
-        )
-        
-        print("Database connected Successfully !!!!")
-        return connection
-            
-    except Error as e:
-        print(f"Error connecting to PostgreSQL database: {e}")
-        return None
+    return get_target(target).get_connection(read_only)
 
 def close_connection(connection):
     """
-    Safely closes a database connection.
+    Returns a connection to its target's pool (closes it if it was not pooled).
     
     Args:
         connection: PostgreSQL connection object to close
     """
     if connection:
-        connection.close()
\ No newline at end of file
+        owner = getattr(connection, "target", None)
+        if owner is not None:
+            owner.release(connection)
+        else:
+            connection.close()
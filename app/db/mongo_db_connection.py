@@ -1,4 +1,5 @@
 from motor.motor_asyncio import AsyncIOMotorClient
+import logging
 import os
 from dotenv import load_dotenv
 
@@ -9,6 +10,8 @@ load_dotenv()
 MONGODB_URL = os.getenv("MONGODB_URL", "mongodb://localhost:27017")
 DATABASE_NAME = os.getenv("DATABASE_NAME", "fastapi_auth")
 
+logger = logging.getLogger(__name__)
+
 # MongoDB client instance
 client = None
 db = None
@@ -18,14 +21,29 @@ async def connect_to_mongodb():
     global client, db
     client = AsyncIOMotorClient(MONGODB_URL)
     db = client[DATABASE_NAME]
-    print(f"Connected to MongoDB at {MONGODB_URL}")
+    logger.info("Connected to MongoDB at %s", MONGODB_URL)
+    await ensure_indexes()
+
+async def ensure_indexes():
+    """Create the indexes the application relies on (no-op if they already exist)"""
+    # Unique indexes make lookups by username/email index scans and let
+    # registration rely on duplicate-key errors instead of pre-checks
+    await db.users.create_index("username", unique=True, name="username_unique")
+    await db.users.create_index("email", unique=True, name="email_unique")
+    # Keyset pagination order for the user listing
+    await db.users.create_index([("created_at", 1), ("_id", 1)], name="created_at_id")
+    # Query history lookups, all per user: recent, slowest, most frequent SQL; and by age
+    await db.query_history.create_index([("user_id", 1), ("created_at", -1)], name="user_created_at")
+    await db.query_history.create_index([("user_id", 1), ("timings.total_ms", -1)], name="user_total_ms")
+    await db.query_history.create_index([("user_id", 1), ("sql_hash", 1)], name="user_sql_hash")
+    await db.query_history.create_index([("created_at", -1)], name="created_at")
 
 async def close_mongodb_connection():
     """Close MongoDB connection at application shutdown"""
     global client
     if client:
         client.close()
-        print("MongoDB connection closed")
+        logger.info("MongoDB connection closed")
 
 def get_database():
     """Get database instance"""
@@ -0,0 +1,655 @@
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional
+from urllib.parse import quote_plus
+
+import psycopg2
+from psycopg2 import Error
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE
+from psycopg2.pool import ThreadedConnectionPool
+from dotenv import load_dotenv
+
+from app.services.provider_gateway import parse_env_mapping
+from app.services.schema_metadata import DEFAULT_DATABASE, read_metadata_file, render_schema_prompt
+from app.services.schema_profiler import metadata_path
+
+# Load environment variables
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Primary server shared by all targets (one database per study); anything that writes runs here
+DB_HOST = os.getenv("DB_HOST", "localhost")
+DB_USER = os.getenv("DB_USER", "postgres")
+DB_PASSWORD = os.getenv("DB_PASSWORD", "admin")
+DB_PORT = os.getenv("DB_PORT", "5432")
+DB_CONNECT_TIMEOUT_SECONDS = int(os.getenv("DB_CONNECT_TIMEOUT_SECONDS", "5"))
+
+# Streaming replicas of the primary as "host[:port],host[:port]"; read-only statements go here
+DB_REPLICA_HOSTS = [host.strip() for host in os.getenv("DB_REPLICA_HOSTS", "").split(",") if host.strip()]
+# "round_robin" or "least_connections"
+DB_REPLICA_STRATEGY = os.getenv("DB_REPLICA_STRATEGY", "round_robin")
+# Replicas replaying further behind the primary than this are skipped
+DB_REPLICA_MAX_LAG_SECONDS = float(os.getenv("DB_REPLICA_MAX_LAG_SECONDS", "30"))
+# How often a replica's reachability and lag are re-checked
+DB_REPLICA_CHECK_SECONDS = float(os.getenv("DB_REPLICA_CHECK_SECONDS", "10"))
+
+# Target name -> database name, e.g. "study_101=study_101_db,study_102=study_102_db"
+DB_TARGETS = parse_env_mapping(os.getenv("DB_TARGETS"), str)
+# Target used when a request does not name one
+DEFAULT_TARGET = os.getenv("DB_DEFAULT_TARGET", DEFAULT_DATABASE)
+
+# Connections per server per target
+DB_POOL_MIN_CONNECTIONS = int(os.getenv("DB_POOL_MIN_CONNECTIONS", "1"))
+DB_POOL_MAX_CONNECTIONS = int(os.getenv("DB_POOL_MAX_CONNECTIONS", "5"))
+# Seconds to wait for a free connection when a pool is fully borrowed
+DB_POOL_TIMEOUT_SECONDS = float(os.getenv("DB_POOL_TIMEOUT_SECONDS", "10"))
+
+# Estimated memory all targets may hold before idle ones are closed, least recently used first
+DB_TARGETS_MEMORY_BUDGET_MB = float(os.getenv("DB_TARGETS_MEMORY_BUDGET_MB", "512"))
+# Estimate for one open connection (client buffers plus the server backend it keeps)
+DB_CONNECTION_MEMORY_MB = float(os.getenv("DB_CONNECTION_MEMORY_MB", "8"))
+
+# Optional <target>.txt files whose text is put before the target's schema in prompts
+DB_TARGET_PROMPT_DIR = os.getenv("DB_TARGET_PROMPT_DIR", "app/constant/target_prompts")
+
+# Seconds a replica's replay is behind; 0 when it has replayed everything it received
+REPLICA_LAG_SQL = """
+SELECT CASE
+    WHEN NOT pg_is_in_recovery() THEN 0
+    WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+    ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+END
+"""
+
+_MB = 1024 * 1024
+
+
+def _parse_host(value):
+    """"host[:port]" (host may be a Unix socket directory) -> (host, port)"""
+    host, separator, port = value.rpartition(":")
+    if separator and port.isdigit():
+        return host, port
+    return value, DB_PORT
+
+
+class UnknownTargetError(Exception):
+    """Raised when a request names a database target that is not configured"""
+
+
+class PooledConnection(psycopg2.extensions.connection):
+    """psycopg2 connection that remembers the target and server pool it was borrowed from"""
+
+    target = None
+    server = None
+    # The ThreadedConnectionPool it came from, so it never goes back into a reopened pool
+    pool = None
+
+
+class ServerPool:
+    """
+    Connection pool to one server (the primary or a replica) for one database
+
+    The pool is created on first use. Replicas also track whether they are
+    reachable and how far their replay lags the primary, refreshed at most
+    every DB_REPLICA_CHECK_SECONDS by whichever request needs it next.
+    """
+
+    def __init__(self, database: str, host: str, port: str, role: str):
+        self.database = database
+        self.host = host
+        self.port = port
+        self.role = role
+        self.in_use = 0
+        self.routed = 0
+        self.healthy = True
+        self.lag_seconds = None
+        self.checked_at = None
+        self._pool: Optional[ThreadedConnectionPool] = None
+        # Set when the target is evicted; borrows then fail instead of reopening the pool
+        self.closed = False
+        self._slots = threading.BoundedSemaphore(DB_POOL_MAX_CONNECTIONS)
+        self._lock = threading.Lock()
+        self._check_lock = threading.Lock()
+
+    @property
+    def address(self):
+        return f"{self.host}:{self.port}"
+
+    def open_connections(self) -> int:
+        """Idle and borrowed connections the pool has open"""
+        with self._lock:
+            return len(self._pool._pool) + len(self._pool._used) if self._pool else 0
+
+    def get_connection(self, timeout: float):
+        """
+        Borrow a connection, waiting up to timeout seconds when all are borrowed
+
+        Returns:
+            connection: PostgreSQL connection, or None if the pool stayed fully
+            borrowed or has been closed
+
+        Raises:
+            psycopg2.Error: If a connection could not be opened
+        """
+        if not self._slots.acquire(timeout=timeout):
+            return None
+        try:
+            with self._lock:
+                if self.closed:
+                    self._slots.release()
+                    return None
+                if self._pool is None:
+                    self._pool = ThreadedConnectionPool(
+                        DB_POOL_MIN_CONNECTIONS,
+                        DB_POOL_MAX_CONNECTIONS,
+                        host=self.host,
+                        user=DB_USER,
+                        password=DB_PASSWORD,
+                        dbname=self.database,
+                        port=self.port,
+                        connect_timeout=DB_CONNECT_TIMEOUT_SECONDS,
+                        connection_factory=PooledConnection,
+                    )
+                pool = self._pool
+                self.in_use += 1
+                self.routed += 1
+            try:
+                connection = pool.getconn()
+                if connection.closed:
+                    # Dropped by the server while idle in the pool
+                    pool.putconn(connection, close=True)
+                    connection = pool.getconn()
+            except Error:
+                with self._lock:
+                    self.in_use -= 1
+                    self.routed -= 1
+                raise
+        except Error:
+            self._slots.release()
+            raise
+        connection.server = self
+        connection.pool = pool
+        return connection
+
+    def release(self, connection):
+        """
+        Return a borrowed connection, rolling back any open transaction first
+        and clearing a read-only session so the next borrower may write
+        """
+        try:
+            broken = bool(connection.closed)
+            if not broken and connection.info.transaction_status != TRANSACTION_STATUS_IDLE:
+                try:
+                    connection.rollback()
+                except Error:
+                    broken = True
+            if not broken and connection.readonly is not None:
+                try:
+                    connection.readonly = None
+                except Error:
+                    broken = True
+            with self._lock:
+                pool = self._pool
+                self.in_use -= 1
+            if pool is not None and connection.pool is pool:
+                pool.putconn(connection, close=broken)
+            else:
+                connection.close()
+            if broken and self.role == "replica":
+                self.mark_unhealthy("connection lost")
+        finally:
+            self._slots.release()
+
+    def mark_unhealthy(self, reason):
+        if self.healthy:
+            logger.warning("Replica %s marked unhealthy: %s", self.address, reason,
+                           extra={"database": self.database})
+        self.healthy = False
+        self.checked_at = time.monotonic()
+
+    def refresh(self):
+        """Re-check reachability and replication lag if the last check is stale"""
+        if self.checked_at is not None and time.monotonic() - self.checked_at < DB_REPLICA_CHECK_SECONDS:
+            return
+        # One request checks; the others use the last known state meanwhile
+        if not self._check_lock.acquire(blocking=False):
+            return
+        try:
+            self.checked_at = time.monotonic()
+            try:
+                connection = self.get_connection(timeout=0)
+            except Error as e:
+                self.mark_unhealthy(e)
+                return
+            if connection is None:
+                # Every connection is busy, so the server is answering
+                return
+            try:
+                with connection.cursor() as cursor:
+                    cursor.execute(REPLICA_LAG_SQL)
+                    self.lag_seconds = float(cursor.fetchone()[0])
+                if not self.healthy:
+                    logger.info("Replica %s is healthy again", self.address, extra={"database": self.database})
+                self.healthy = True
+            except Error as e:
+                self.mark_unhealthy(e)
+            finally:
+                self.release(connection)
+        finally:
+            self._check_lock.release()
+
+    def usable(self) -> bool:
+        """Reachable and within DB_REPLICA_MAX_LAG_SECONDS of the primary"""
+        self.refresh()
+        return self.healthy and (self.lag_seconds is None or self.lag_seconds <= DB_REPLICA_MAX_LAG_SECONDS)
+
+    def stats(self) -> Dict:
+        return {
+            "host": self.address,
+            "role": self.role,
+            "healthy": self.healthy,
+            "lag_seconds": self.lag_seconds,
+            "connections": self.open_connections(),
+            "in_use": self.in_use,
+            "routed": self.routed,
+        }
+
+    def close(self):
+        """
+        Close the idle connections; borrowed ones are closed when they are released
+
+        (closeall() would also close connections in-flight callers are using.)
+        The pool is not reopened: later borrows return None.
+        """
+        with self._lock:
+            self.closed = True
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            with pool._lock:
+                idle, pool._pool = pool._pool, []
+            for connection in idle:
+                connection.close()
+
+
+class DatabaseTarget:
+    """
+    One study database: its connection pools and everything cached about it
+
+    Statements that may write use the primary. Read-only statements are
+    spread over the healthy replicas that are within the lag limit (round
+    robin or least connections) and fall back to the primary when there is
+    none. Schema metadata is re-read when the profiler rewrites the
+    artifact, and objects derived from it (schema prompt, value index,
+    validator catalog, RAG generator, ...) are cached per metadata version
+    with cached(), so closing the target frees all of them at once.
+    """
+
+    def __init__(self, name: str, database: str):
+        self.name = name
+        self.database = database
+        self.last_used = time.monotonic()
+        self.primary = ServerPool(database, DB_HOST, DB_PORT, "primary")
+        self.replicas = [ServerPool(database, *_parse_host(host), "replica") for host in DB_REPLICA_HOSTS]
+        self.fallbacks = 0
+        # Set when the registry evicts the target; callers still holding it are sent to its replacement
+        self.closed = False
+        self._next_replica = 0
+        self._lock = threading.Lock()
+        # Guards the cache entries, never held while a value is built
+        self._cache_lock = threading.Lock()
+        # (mtime, file size, metadata) of the last artifact read
+        self._metadata = None
+        # Kind -> (key, value, estimated bytes, close callback)
+        self._cache: Dict[str, tuple] = {}
+        # Kind -> (key, event set when the build ends) of values being built
+        self._building: Dict[str, tuple] = {}
+        # Sum of the cached values' estimated bytes, so memory_bytes() never waits for a build
+        self._cached_bytes = 0
+        self._prompt_prefix = None
+
+    @property
+    def uri(self) -> str:
+        """SQLAlchemy URI of the primary for the LangChain pipelines"""
+        return f"postgresql://{quote_plus(DB_USER)}:{quote_plus(DB_PASSWORD)}@{DB_HOST}:{DB_PORT}/{self.database}"
+
+    @property
+    def in_use(self) -> int:
+        return self.primary.in_use + sum(replica.in_use for replica in self.replicas)
+
+    def _replica_candidates(self):
+        """Usable replicas in the order they should be tried"""
+        usable = [replica for replica in self.replicas if replica.usable()]
+        if not usable:
+            return []
+        with self._lock:
+            start = self._next_replica % len(usable)
+            self._next_replica += 1
+        # Rotating first spreads ties (and is the whole of round robin)
+        ordered = usable[start:] + usable[:start]
+        if DB_REPLICA_STRATEGY == "least_connections":
+            ordered.sort(key=lambda replica: replica.in_use)
+        return ordered
+
+    def _replica_connection(self):
+        candidates = self._replica_candidates()
+        for replica in candidates:
+            try:
+                connection = replica.get_connection(timeout=0)
+            except Error as e:
+                replica.mark_unhealthy(e)
+                continue
+            if connection is not None:
+                return connection
+        # Healthy replicas that are just busy: wait for one rather than loading the primary
+        for replica in candidates:
+            if replica.healthy:
+                try:
+                    return replica.get_connection(DB_POOL_TIMEOUT_SECONDS)
+                except Error as e:
+                    replica.mark_unhealthy(e)
+                    return None
+        return None
+
+    def get_connection(self, read_only: bool = False):
+        """
+        Borrow a connection for this target
+
+        Waits up to DB_POOL_TIMEOUT_SECONDS when every pooled connection is
+        borrowed. Hand the connection back with release().
+
+        Args:
+            read_only: The caller only reads, so a replica may serve it; the
+                session is made read-only, so a borrow that falls back to the
+                primary cannot write either
+
+        A target evicted while the caller held it hands out connections of
+        the registry's current target of the same name instead.
+
+        Returns:
+            connection: PostgreSQL connection, or None if none could be opened
+        """
+        if self.closed:
+            return get_target(self.name).get_connection(read_only)
+        connection = None
+        if read_only and self.replicas:
+            connection = self._replica_connection()
+            if connection is None:
+                self.fallbacks += 1
+                logger.debug("No usable replica for %s, using the primary", self.database,
+                             extra={"target": self.name})
+        if connection is None:
+            try:
+                connection = self.primary.get_connection(DB_POOL_TIMEOUT_SECONDS)
+            except Error as e:
+                logger.error("Error connecting to PostgreSQL database %s: %s", self.database, e,
+                             extra={"target": self.name})
+                return None
+            if connection is None and self.closed:
+                # Evicted while this borrow waited
+                return get_target(self.name).get_connection(read_only)
+            if connection is None:
+                logger.error("No free connection to %s after %ss", self.database, DB_POOL_TIMEOUT_SECONDS,
+                             extra={"target": self.name})
+                return None
+        if read_only:
+            # Transactions start as BEGIN READ ONLY until release() resets it
+            connection.readonly = True
+        connection.target = self
+        return connection
+
+    def release(self, connection):
+        """Return a borrowed connection to the pool it came from"""
+        connection.server.release(connection)
+
+    def metadata(self) -> Optional[Dict]:
+        """The profiled metadata artifact for this database, or None before the first profile"""
+        path = metadata_path(self.database)
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return None
+        with self._lock:
+            cached = self._metadata
+        if cached is None or cached[0] != stat.st_mtime_ns:
+            cached = (stat.st_mtime_ns, stat.st_size, read_metadata_file(path))
+            with self._lock:
+                self._metadata = cached
+        return cached[2]
+
+    def cached(self, kind: str, key: Any, build: Callable[[], Any],
+               size: Optional[Callable[[Any], int]] = None, close: Optional[Callable[[Any], None]] = None):
+        """
+        A value derived from this target, rebuilt when its key changes
+
+        Args:
+            kind: Name of the cached object, e.g. "value_index"
+            key: Identity of the inputs, e.g. the metadata version
+            build: Creates the value
+            size: Estimated bytes of a value; defaults to the metadata artifact's size
+            close: Releases a value's resources when it is replaced or the target is closed
+
+        The value is built without holding the cache lock, so a slow build
+        (the RAG generator, the value index, ...) never blocks other kinds or
+        the registry; concurrent callers for the same kind and key wait for
+        the one build instead of starting their own.
+
+        Returns:
+            The cached or newly built value
+        """
+        while True:
+            with self._cache_lock:
+                entry = self._cache.get(kind)
+                if entry is not None and entry[0] == key:
+                    return entry[1]
+                pending = self._building.get(kind)
+                if pending is None or pending[0] != key:
+                    done = threading.Event()
+                    self._building[kind] = (key, done)
+                    break
+            # Another caller is building it; if that build fails, the next waiter builds
+            pending[1].wait()
+
+        try:
+            value = build()
+            if size is not None:
+                estimate = size(value)
+            else:
+                estimate = self._metadata[1] if self._metadata else 0
+        except BaseException:
+            with self._cache_lock:
+                if self._building.get(kind, (None, None))[1] is done:
+                    del self._building[kind]
+            done.set()
+            raise
+
+        with self._cache_lock:
+            if self._building.get(kind, (None, None))[1] is done:
+                del self._building[kind]
+            replaced = None
+            kept = not self.closed
+            if kept:
+                replaced = self._cache.get(kind)
+                self._cache[kind] = (key, value, estimate, close)
+                self._cached_bytes += estimate - (replaced[2] if replaced else 0)
+        done.set()
+        if not kept and close is not None:
+            # Evicted during the build: the caller gets the value, nothing keeps it
+            close(value)
+        if replaced is not None and replaced[3] is not None:
+            replaced[3](replaced[1])
+        return value
+
+    @property
+    def building(self) -> bool:
+        """Whether a cached value is being built (the target must not be evicted meanwhile)"""
+        return bool(self._building)
+
+    def prompt_prefix(self) -> str:
+        """Text put before this target's schema in prompts (empty if there is no prefix file)"""
+        if self._prompt_prefix is None:
+            try:
+                with open(os.path.join(DB_TARGET_PROMPT_DIR, f"{self.name}.txt"), "r", encoding="utf-8") as f:
+                    self._prompt_prefix = f.read().strip()
+            except FileNotFoundError:
+                self._prompt_prefix = ""
+        return self._prompt_prefix
+
+    def schema_prompt(self, fallback: Optional[str] = None, tables=None) -> Optional[str]:
+        """
+        Schema description for prompt builders: the prompt prefix followed by
+        the rendered metadata, or by fallback before the first profile
+
+        With tables, only those tables are described (the fallback text is
+        used whole, as it cannot be split).
+        """
+        metadata = self.metadata()
+        if metadata is None:
+            schema = fallback
+        elif tables is not None:
+            # One entry per table set: sessions over the same tables share it
+            tables = sorted(tables)
+            schema = self.cached(
+                "schema_prompt:" + ",".join(tables), metadata["version"],
+                lambda: render_schema_prompt(metadata, set(tables)), size=len,
+            )
+        else:
+            schema = self.cached("schema_prompt", metadata["version"], lambda: render_schema_prompt(metadata), size=len)
+        if schema is None:
+            return None
+        prefix = self.prompt_prefix()
+        return f"{prefix}\n\n{schema}" if prefix else schema
+
+    def servers(self):
+        return [self.primary] + self.replicas
+
+    def memory_bytes(self) -> int:
+        """Estimated memory held by the pools and the cached values"""
+        connections = sum(server.open_connections() for server in self.servers())
+        with self._lock:
+            metadata_bytes = self._metadata[1] if self._metadata else 0
+        return int(connections * DB_CONNECTION_MEMORY_MB * _MB) + metadata_bytes + self._cached_bytes
+
+    def stats(self) -> Dict:
+        return {
+            "database": self.database,
+            "in_use": self.in_use,
+            "servers": [server.stats() for server in self.servers()],
+            "replica_fallbacks": self.fallbacks,
+            "cached": sorted(self._cache),
+            "memory_mb": round(self.memory_bytes() / _MB, 2),
+            "idle_seconds": round(time.monotonic() - self.last_used, 1),
+        }
+
+    def close(self):
+        """Close the pools and drop everything cached for this target"""
+        self.closed = True
+        for server in self.servers():
+            server.close()
+        with self._lock:
+            self._metadata = None
+        with self._cache_lock:
+            entries, self._cache = list(self._cache.values()), {}
+            self._cached_bytes = 0
+        for _, value, _, close in entries:
+            if close is not None:
+                try:
+                    close(value)
+                except Exception as e:
+                    logger.warning("Error releasing %s resources: %s", self.name, e, extra={"target": self.name})
+
+
+class TargetRegistry:
+    """
+    Lazily opened database targets, evicted under a memory budget
+
+    Targets are created on first request and kept in least-recently-used
+    order. When the estimated memory of all open targets exceeds the budget,
+    the least recently used targets with no borrowed connections and no
+    value being built are closed until it fits again; the next request for
+    an evicted target reopens it.
+    A caller still holding an evicted target is redirected to the reopened
+    one, and connections it had borrowed are closed when released.
+    """
+
+    def __init__(self, databases: Dict[str, str], default: str = DEFAULT_TARGET,
+                 memory_budget_mb: float = DB_TARGETS_MEMORY_BUDGET_MB):
+        self.databases = dict(databases)
+        self.databases.setdefault(default, DEFAULT_DATABASE)
+        self.default = default
+        self.memory_budget = int(memory_budget_mb * _MB)
+        self._targets: "OrderedDict[str, DatabaseTarget]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def names(self):
+        return sorted(self.databases)
+
+    def get(self, name: Optional[str] = None) -> DatabaseTarget:
+        """
+        The target with this name (the default target if None), opening it if needed
+
+        Raises:
+            UnknownTargetError: If the name is not a configured target
+        """
+        name = name or self.default
+        if name not in self.databases:
+            raise UnknownTargetError(f"Unknown database target '{name}'")
+        with self._lock:
+            target = self._targets.get(name)
+            if target is None:
+                target = DatabaseTarget(name, self.databases[name])
+                self._targets[name] = target
+            self._targets.move_to_end(name)
+            target.last_used = time.monotonic()
+            evicted = self._select_evictions(keep=target)
+        for old in evicted:
+            logger.info("Closing idle database target %s", old.name, extra={"target": old.name})
+            old.close()
+        return target
+
+    def _select_evictions(self, keep):
+        total = sum(target.memory_bytes() for target in self._targets.values())
+        evicted = []
+        for name, target in list(self._targets.items()):
+            if total <= self.memory_budget:
+                break
+            if target is keep or target.in_use or target.building:
+                continue
+            total -= target.memory_bytes()
+            del self._targets[name]
+            evicted.append(target)
+        self.evictions += len(evicted)
+        return evicted
+
+    def stats(self) -> Dict:
+        with self._lock:
+            open_targets = list(self._targets.values())
+        targets = {target.name: target.stats() for target in open_targets}
+        return {
+            "default": self.default,
+            "configured": self.names(),
+            "memory_budget_mb": round(self.memory_budget / _MB, 2),
+            "memory_mb": round(sum(stats["memory_mb"] for stats in targets.values()), 2),
+            "evictions": self.evictions,
+            "open": targets,
+        }
+
+    def close_all(self):
+        with self._lock:
+            open_targets = list(self._targets.values())
+            self._targets.clear()
+        for target in open_targets:
+            target.close()
+
+
+# Process-wide registry
+targets = TargetRegistry(DB_TARGETS)
+
+
+def get_target(name: Optional[str] = None) -> DatabaseTarget:
+    """The registry's target with this name; see TargetRegistry.get()"""
+    return targets.get(name)
@@ -210,28 +210,29 @@ import json
 import re
 from typing import Dict, List, Any, Optional, Union
 from dotenv import load_dotenv
-from sqlalchemy import text
 load_dotenv()
 
-# Database connection parameters
-host = os.getenv("DB_HOST")
-user = os.getenv("DB_USER")
-password = os.getenv("DB_PASSWORD")
-dbname = os.getenv("DB_NAME")
-port = os.getenv("DB_PORT")
+from app.db.targets import get_target
+from app.services.execute_query import READ_ONLY_SESSION_OPTIONS, execute_query
+from app.services.sql_validator import format_errors, get_catalog, validate_sql
+
+# Runs of the agent go through the provider gateway as one "openai" call of this model
+AGENT_MODEL = "gpt-4o-mini"
 
 def execute_sql_query_with_llm_summary(
     question: str,
-    db_uri: str = f"postgresql://{user}:{password}@{host}:{port}/{dbname}",
-    api_key: Optional[str] = None
+    db_uri: Optional[str] = None,
+    api_key: Optional[str] = None,
+    target: Optional[str] = None
 ) -> Dict[str, Any]:
     """
     Execute an SQL query based on a natural language question and return structured results.
     
     Args:
         question: Natural language question to be converted to SQL query
-        db_uri: Database connection URI
+        db_uri: Database connection URI (defaults to the default database target)
         api_key: OpenAI API key (optional if already set in environment)
+        target: Database target the final query is validated against and run on
     
     Returns:
         Dictionary containing:
@@ -248,9 +249,12 @@ def execute_sql_query_with_llm_summary(
     elif not os.environ.get("OPENAI_API_KEY"):
         raise ValueError("OpenAI API key must be provided either directly or through environment variables")
     
-    # Initialize database connection
+    # Initialize database connection; read-only sessions, as the agent's tools run LLM-written SQL
     try:
-        db = SQLDatabase.from_uri(db_uri)
+        db = SQLDatabase.from_uri(
+            db_uri or get_target(target).uri,
+            engine_args={"connect_args": {"options": READ_ONLY_SESSION_OPTIONS}},
+        )
     except Exception as e:
         return {
             'success': False,
@@ -263,7 +267,7 @@ def execute_sql_query_with_llm_summary(
     
     # Initialize the language model
     try:
-        llm = init_chat_model("gpt-4o-mini", model_provider="openai")
+        llm = init_chat_model(AGENT_MODEL, model_provider="openai")
         
         # Create SQL tools and agent
         toolkit = SQLDatabaseToolkit(db=db, llm=llm)
@@ -324,39 +328,37 @@ def execute_sql_query_with_llm_summary(
         # Extract the final answer from the last message
         final_answer = response_steps[-1].content if response_steps else ""
         
-        # Execute the extracted SQL query directly to get structured results
+        # Execute the extracted SQL query to get structured results, through the
+        # validator and a read-only transaction like every other generator's SQL
         if sql_query:
-            try:
-                # Create a connection using the db's engine
-                engine = db._engine
-                with engine.connect() as connection:
-                    # Execute the query
-                    result = connection.execute(text(sql_query))
-                    
-                    # Get column names
-                    columns = result.keys()
-                    
-                    # Convert rows to list of dictionaries
-                    structured_data = [dict(zip(columns, row)) for row in result]
-                    
-                    return {
-                        'success': True,
-                        'data': structured_data,  # This will be a list of dictionaries
-                        'sql_query': sql_query,
-                        'answer': final_answer,
-                        'message': 'Query executed successfully',
-                        'rowcount': len(structured_data)
-                    }
-                    
-            except Exception as e:
+            validation = validate_sql(sql_query, get_catalog(target))
+            if not validation["valid"]:
+                return {
+                    'success': False,
+                    'data': [],
+                    'sql_query': sql_query,
+                    'answer': final_answer,
+                    'message': "Generated SQL failed validation:\n" + format_errors(validation["errors"]),
+                    'rowcount': 0
+                }
+            executed = execute_query(validation["sql"], target, read_only=True)
+            if not executed['success']:
                 return {
                     'success': False,
                     'data': [],
                     'sql_query': sql_query,
                     'answer': final_answer,
-                    'message': f"Error executing SQL query: {str(e)}",
+                    'message': executed['message'],
                     'rowcount': 0
                 }
+            return {
+                'success': True,
+                'data': executed['data'],  # This will be a list of dictionaries
+                'sql_query': sql_query,
+                'answer': final_answer,
+                'message': 'Query executed successfully',
+                'rowcount': executed['rowcount']
+            }
         
         # If we couldn't extract or execute a SQL query
         return {
@@ -378,12 +380,13 @@ def execute_sql_query_with_llm_summary(
             'rowcount': 0
         }
 
-def generate_sql_query_and_execute_by_agent(prompt):
+def generate_sql_query_and_execute_by_agent(prompt, target=None):
     """
     Generate and execute an SQL query based on a natural language prompt.
     
     Args:
         prompt: The natural language question to convert to SQL
+        target: Database target to query (defaults to the DB_NAME database)
         
     Returns:
         Dictionary with structured query results
@@ -391,7 +394,9 @@ def generate_sql_query_and_execute_by_agent(prompt):
     OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
     result = execute_sql_query_with_llm_summary(
         question=prompt,
-        api_key=OPENAI_API_KEY
+        db_uri=get_target(target).uri,
+        api_key=OPENAI_API_KEY,
+        target=target
     )
     
     return result
\ No newline at end of file
@@ -1,3 +1,4 @@
+import logging
 import os
 import getpass
 from langchain_community.utilities import SQLDatabase
@@ -7,26 +8,41 @@ from langchain import hub
 from langchain_community.tools.sql_database.tool import QuerySQLDatabaseTool
 from langgraph.graph import START, StateGraph
 from dotenv import load_dotenv
-from sqlalchemy import create_engine, text
+from sqlalchemy import create_engine
 load_dotenv()
 
+from app.db.targets import DB_CONNECTION_MEMORY_MB, get_target
+from app.services.execute_query import READ_ONLY_SESSION_OPTIONS, execute_query as execute_validated_sql
+from app.services.sql_validator import format_errors, get_catalog, validate_sql
 
-host=os.getenv("DB_HOST", "localhost")
-user=os.getenv("DB_USER", "postgres")
-password=os.getenv("DB_PASSWORD", "admin")
-dbname=os.getenv("DB_NAME", "clinical_study_db")
-port=os.getenv("DB_PORT", "5432")
+logger = logging.getLogger(__name__)
 
 
 # Define the State type for the graph
 class State(TypedDict):
     question: str
+    target: str
     query: str
     result: str
     answer: str
-
-# Connect to PostgreSQL database
-db = SQLDatabase.from_uri(f"postgresql://{user}:{password}@{host}:{port}/{dbname}")
+    # Why the query was not run or failed (validation errors or the database error)
+    error: str
+
+
+def get_database(target=None):
+    """SQLDatabase for a database target, created once and disposed of with the target"""
+    target = get_target(target)
+    return target.cached(
+        "langchain_db",
+        target.uri,
+        # Read-only sessions: the SQL this database is used with is written by the LLM
+        lambda: SQLDatabase.from_uri(target.uri, engine_args={
+            "pool_size": 2, "max_overflow": 3, "connect_args": {"options": READ_ONLY_SESSION_OPTIONS},
+        }),
+        # The engine keeps up to pool_size connections open
+        size=lambda db: int(2 * DB_CONNECTION_MEMORY_MB * 1024 * 1024),
+        close=lambda db: db._engine.dispose(),
+    )
 
 # Set up OpenAI API key
 # OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
@@ -42,7 +58,10 @@ db = SQLDatabase.from_uri(f"postgresql://{user}:{password}@{host}:{port}/{dbname
 if not os.environ.get("GOOGLE_API_KEY"):
   os.environ["GOOGLE_API_KEY"] = getpass.getpass("Enter API key for Google Gemini: ")
 
-llm = init_chat_model("gemini-2.0-flash", model_provider="google_genai")
+# Runs of this pipeline go through the provider gateway as one "gemini" call of this model
+LANGCHAIN_MODEL = "gemini-2.0-flash"
+
+llm = init_chat_model(LANGCHAIN_MODEL, model_provider="google_genai")
 
 # Pull the SQL query system prompt from the hub
 query_prompt_template = hub.pull("langchain-ai/sql-query-system-prompt")
@@ -54,11 +73,14 @@ class QueryOutput(TypedDict):
 
 def write_query(state: State):
     """Generate SQL query to fetch information."""
+    target = get_target(state["target"])
+    db = get_database(state["target"])
     prompt = query_prompt_template.invoke(
         {
             "dialect": db.dialect,
             "top_k": 50,
-            "table_info": db.get_table_info(),
+            # Profiled at load time, so the database is not introspected per request
+            "table_info": target.schema_prompt() or db.get_table_info(),
             "input": state["question"],
         }
     )
@@ -67,32 +89,27 @@ def write_query(state: State):
     return {"query": result["query"]}
 
 def execute_query(state: State):
-    """Execute SQL query and return structured results."""
-    # Instead of using the QuerySQLDatabaseTool directly, we'll handle the execution ourselves
-    # to ensure consistent formatting of results
-    
-    try:
-        # Create a connection using the db's engine
-        engine = db._engine
-        with engine.connect() as connection:
-            # Execute the query
-            result = connection.execute(text(state["query"]))
-            
-            # Get column names
-            columns = result.keys()
-            
-            # Convert rows to list of dictionaries (same format as first file)
-            structured_result = [dict(zip(columns, row)) for row in result]
-            
-    except Exception as e:
+    """Validate the SQL query and execute it read-only, returning structured results."""
+    # Same path as the other generators: only validated SELECTs reach the database,
+    # in a read-only transaction with the statement timeout
+    validation = validate_sql(state["query"], get_catalog(state["target"]))
+    if not validation["valid"]:
+        logger.info("LangChain SQL failed validation",
+                    extra={"sql_query": state["query"], "validation_errors": validation["errors"]})
+        return {"result": [], "error": "Generated SQL failed validation:\n" + format_errors(validation["errors"])}
+
+    executed = execute_validated_sql(validation["sql"], state["target"], read_only=True)
+    if not executed["success"]:
         # If there's an error, return empty list and log the error
-        print(f"Error executing SQL query: {e}")
-        structured_result = []
-    
-    return {"result": structured_result}
+        logger.error("Error executing SQL query: %s", executed["message"], extra={"sql_query": state["query"]})
+        return {"result": [], "error": executed["message"]}
+    return {"result": executed["data"]}
 
 def generate_answer(state: State):
     """Answer question using retrieved information as context."""
+    if state.get("error"):
+        # Nothing was run, so there is nothing to summarize
+        return {"answer": ""}
     prompt = (
         "Given the following user question, corresponding SQL query, "
         "and SQL result, answer the user question.\n\n"
@@ -111,17 +128,26 @@ graph_builder.add_edge(START, "write_query")
 graph = graph_builder.compile()
 
 
-def generate_and_execute_sql_query_by_langchain(prompt):
+def generate_and_execute_sql_query_by_langchain(prompt, target=None):
     """
     Generates and executes SQL query using LangChain and returns results in a format 
     matching the first file's structure.
     """
     try:
         # Invoke the graph with the user prompt
-        result = graph.invoke({"question": prompt})
+        result = graph.invoke({"question": prompt, "target": get_target(target).name})
         
         # Get the result (which should now be properly structured as a list of dictionaries)
         structured_data = result.get('result', [])
+        if result.get('error'):
+            return {
+                'success': False,
+                'data': None,
+                'sql_query': result.get('query', ''),
+                'message': result['error'],
+                'rowcount': 0,
+                'answer': ''
+            }
         
         return {
             'success': True,
@@ -0,0 +1,203 @@
+import gzip
+import os
+import zlib
+
+import anyio
+from dotenv import load_dotenv
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Load environment variables
+load_dotenv()
+
+# Complete responses smaller than this are sent uncompressed
+COMPRESSION_MIN_SIZE = int(os.getenv("COMPRESSION_MIN_SIZE", "1024"))
+GZIP_LEVEL = int(os.getenv("GZIP_LEVEL", "6"))
+ZSTD_LEVEL = int(os.getenv("ZSTD_LEVEL", "3"))
+# Bodies (or streamed chunks) at least this large are compressed in a worker thread
+COMPRESSION_THREAD_MIN_SIZE = int(os.getenv("COMPRESSION_THREAD_MIN_SIZE", str(256 * 1024)))
+# Content types that are already compressed, or must reach the client unbuffered
+COMPRESSION_EXCLUDED_TYPES = tuple(
+    content_type.strip()
+    for content_type in os.getenv(
+        "COMPRESSION_EXCLUDED_TYPES",
+        "text/event-stream,application/vnd.apache.parquet,application/zip,application/gzip,image/",
+    ).split(",")
+    if content_type.strip()
+)
+
+
+def _supported_encodings():
+    return ("zstd", "gzip") if zstandard is not None else ("gzip",)
+
+
+def choose_encoding(accept_encoding):
+    """
+    Pick the response encoding from an Accept-Encoding header
+
+    The client's q-values decide; on a tie zstd is preferred over gzip.
+    Returns None if the client accepts neither.
+    """
+    weights = {}
+    for item in accept_encoding.split(","):
+        name, _, params = item.strip().partition(";")
+        name = name.strip().lower()
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        weights[name] = quality
+
+    best, best_quality = None, 0.0
+    for encoding in _supported_encodings():
+        quality = weights.get(encoding, weights.get("*", 0.0))
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+class _Compressor:
+    """Incremental gzip/zstd compressor that flushes after every chunk"""
+
+    def __init__(self, encoding):
+        if encoding == "zstd":
+            self._compressor = zstandard.ZstdCompressor(level=ZSTD_LEVEL).compressobj()
+            self._block_flush = zstandard.COMPRESSOBJ_FLUSH_BLOCK
+        else:
+            # wbits=31 writes a gzip header and trailer around the deflate stream
+            self._compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+            self._block_flush = zlib.Z_SYNC_FLUSH
+
+    def compress(self, chunk):
+        """Compress a chunk and flush it so the client can decode it right away"""
+        return self._compressor.compress(chunk) + self._compressor.flush(self._block_flush)
+
+    def finish(self):
+        return self._compressor.flush()
+
+
+def compress_body(body, encoding):
+    """Compress a complete body in one go"""
+    if encoding == "zstd":
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(body)
+    return gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0)
+
+
+async def _run(func, *args, size):
+    """Run compression inline for small inputs, in a worker thread for large ones"""
+    if size >= COMPRESSION_THREAD_MIN_SIZE:
+        return await anyio.to_thread.run_sync(func, *args)
+    return func(*args)
+
+
+class CompressionMiddleware:
+    """
+    ASGI middleware compressing responses with gzip or zstd
+
+    The encoding is negotiated from Accept-Encoding. A response sent as a
+    single body is compressed only if it is at least COMPRESSION_MIN_SIZE
+    bytes; a streaming response is compressed chunk by chunk as it is sent,
+    so nothing is buffered. Responses that already have a Content-Encoding,
+    or whose type is in COMPRESSION_EXCLUDED_TYPES, pass through untouched.
+    """
+
+    def __init__(self, app, minimum_size=COMPRESSION_MIN_SIZE):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        accept_encoding = ""
+        for name, value in scope["headers"]:
+            if name == b"accept-encoding":
+                accept_encoding = value.decode("latin-1")
+                break
+        encoding = choose_encoding(accept_encoding)
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        responder = _CompressingResponder(send, encoding, self.minimum_size)
+        await self.app(scope, receive, responder.send)
+
+
+class _CompressingResponder:
+    """Per-response state: holds the start message until the first body chunk decides the mode"""
+
+    def __init__(self, send, encoding, minimum_size):
+        self._send = send
+        self._encoding = encoding
+        self._minimum_size = minimum_size
+        self._start_message = None
+        self._compressor = None
+        self._passthrough = False
+
+    def _should_compress(self, headers):
+        for name, value in headers:
+            if name.lower() == b"content-encoding":
+                return False
+            if name.lower() == b"content-type":
+                content_type = value.decode("latin-1").lower()
+                if content_type.startswith(COMPRESSION_EXCLUDED_TYPES):
+                    return False
+        return True
+
+    def _compressed_start(self, start, content_length=None):
+        """The held start message with encoding headers, and Content-Length only if known"""
+        headers = [
+            (name, value) for name, value in start.get("headers", [])
+            if name.lower() != b"content-length"
+        ]
+        headers.append((b"content-encoding", self._encoding.encode("latin-1")))
+        headers.append((b"vary", b"Accept-Encoding"))
+        if content_length is not None:
+            headers.append((b"content-length", str(content_length).encode("latin-1")))
+        return {**start, "headers": headers}
+
+    async def send(self, message):
+        message_type = message["type"]
+
+        if message_type == "http.response.start":
+            self._start_message = message
+            self._passthrough = not self._should_compress(message.get("headers", []))
+            if self._passthrough:
+                await self._send(message)
+            return
+
+        if message_type != "http.response.body" or self._passthrough:
+            await self._send(message)
+            return
+
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+
+        if self._start_message is not None:
+            start, self._start_message = self._start_message, None
+            if not more_body:
+                # Whole body in one message: compress it only if it is worth it
+                if len(body) < self._minimum_size:
+                    await self._send(start)
+                    await self._send(message)
+                    return
+                compressed = await _run(compress_body, body, self._encoding, size=len(body))
+                await self._send(self._compressed_start(start, len(compressed)))
+                await self._send({"type": "http.response.body", "body": compressed, "more_body": False})
+                return
+
+            # Streaming: the total size is unknown, so compress as chunks arrive
+            self._compressor = _Compressor(self._encoding)
+            await self._send(self._compressed_start(start))
+
+        chunk = await _run(self._compressor.compress, body, size=len(body)) if body else b""
+        if not more_body:
+            chunk += self._compressor.finish()
+        await self._send({"type": "http.response.body", "body": chunk, "more_body": more_body})
@@ -0,0 +1,412 @@
+import glob
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Dict, List, Optional
+
+import numpy as np
+from dotenv import load_dotenv
+from langchain_core.embeddings import Embeddings
+
+# Load environment variables
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Backend used when a caller does not ask for one: "openai" or "huggingface"
+EMBEDDING_PROVIDER = os.getenv("EMBEDDING_PROVIDER", "openai")
+HUGGINGFACE_EMBEDDING_MODEL = os.getenv("HUGGINGFACE_EMBEDDING_MODEL", "sentence-transformers/all-mpnet-base-v2")
+OPENAI_EMBEDDING_MODEL = os.getenv("OPENAI_EMBEDDING_MODEL", "text-embedding-ada-002")
+# Texts embedded per backend call, and how long a batch waits for more texts
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "64"))
+EMBEDDING_BATCH_WAIT_MS = float(os.getenv("EMBEDDING_BATCH_WAIT_MS", "5"))
+# Where vectors are cached, one sub-directory per model
+EMBEDDING_CACHE_DIR = os.getenv("EMBEDDING_CACHE_DIR", "app/constant/embedding_cache")
+# Segment files are merged into one when there are more than this many
+EMBEDDING_CACHE_MAX_SEGMENTS = int(os.getenv("EMBEDDING_CACHE_MAX_SEGMENTS", "32"))
+# Vectors kept on disk per model; the least recently used go at the next compaction
+EMBEDDING_CACHE_MAX_VECTORS = int(os.getenv("EMBEDDING_CACHE_MAX_VECTORS", "200000"))
+# Question vectors are only kept in memory, this many per model
+EMBEDDING_QUERY_CACHE_SIZE = int(os.getenv("EMBEDDING_QUERY_CACHE_SIZE", "1024"))
+
+
+def content_hash(model_id, text):
+    """Cache key of a text: the same text embedded by another model is a different entry"""
+    return hashlib.sha256(f"{model_id}\0{text}".encode("utf-8")).hexdigest()
+
+
+class VectorCache:
+    """
+    Persistent content-hash -> vector cache backed by memory-mapped .npy files
+
+    Vectors are written in segments: a `<name>.npy` matrix plus a
+    `<name>.keys.json` list of the hashes of its rows, both replaced
+    atomically. Segments are opened with mmap, so a large cache costs page
+    cache rather than process memory, and processes sharing the directory
+    pick up each other's segments on the next refresh().
+
+    Segments are merged, and the cache trimmed to EMBEDDING_CACHE_MAX_VECTORS
+    least recently used first, by a background thread so that writers never
+    pay for a compaction.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._lock = threading.Lock()
+        # Held by a compaction from its snapshot to its swap, so two never interleave
+        self._compact_lock = threading.Lock()
+        self._compacting = False
+        # Segments this process is still writing, which refresh() must leave to put_many
+        self._writing = set()
+        self._segments: Dict[str, np.ndarray] = {}
+        self._index: Dict[str, tuple] = {}
+        self._directory_mtime = None
+        os.makedirs(directory, exist_ok=True)
+        self.refresh()
+
+    def refresh(self):
+        """Open segments written since the last refresh (cheap if none were)"""
+        try:
+            mtime = os.stat(self.directory).st_mtime_ns
+        except FileNotFoundError:
+            return
+        if mtime == self._directory_mtime:
+            return
+        with self._lock:
+            present = set()
+            for keys_path in glob.glob(os.path.join(self.directory, "*.keys.json")):
+                name = os.path.basename(keys_path)[:-len(".keys.json")]
+                present.add(name)
+                if name in self._segments or name in self._writing:
+                    continue
+                try:
+                    with open(keys_path, "r", encoding="utf-8") as f:
+                        keys = json.load(f)
+                    vectors = np.load(os.path.join(self.directory, f"{name}.npy"), mmap_mode="r")
+                except (OSError, ValueError) as e:
+                    # Partially compacted or being written by another process
+                    logger.debug("Skipping embedding cache segment %s: %s", name, e)
+                    continue
+                self._segments[name] = vectors
+                for row, key in enumerate(keys):
+                    self._index[key] = (name, row)
+            # Segments merged away by another process
+            for name in set(self._segments) - present:
+                del self._segments[name]
+                self._index = {key: location for key, location in self._index.items() if location[0] != name}
+            self._directory_mtime = mtime
+
+    def __len__(self):
+        return len(self._index)
+
+    def get_many(self, keys) -> Dict[str, np.ndarray]:
+        """Cached vectors for the given hashes (missing hashes are left out)"""
+        found = {}
+        with self._lock:
+            for key in keys:
+                location = self._index.pop(key, None)
+                if location is not None:
+                    # Re-inserted so the index stays in least recently used order
+                    self._index[key] = location
+                    segment, row = location
+                    found[key] = np.array(self._segments[segment][row])
+        return found
+
+    def _write_segment(self, name, keys, vectors):
+        npy_path = os.path.join(self.directory, f"{name}.npy")
+        keys_path = os.path.join(self.directory, f"{name}.keys.json")
+        # np.save appends .npy to names without it, so the temp name keeps the suffix
+        tmp_npy = os.path.join(self.directory, f".{name}.tmp.npy")
+        np.save(tmp_npy, vectors)
+        os.replace(tmp_npy, npy_path)
+        tmp_keys = f"{keys_path}.tmp"
+        with open(tmp_keys, "w", encoding="utf-8") as f:
+            json.dump(keys, f)
+        # The keys file is what readers look for, so it goes last
+        os.replace(tmp_keys, keys_path)
+
+    def put_many(self, vectors_by_key: Dict[str, np.ndarray]):
+        """Persist new vectors as a segment and make them visible immediately"""
+        with self._lock:
+            new = {key: vector for key, vector in vectors_by_key.items() if key not in self._index}
+        if not new:
+            return
+        keys = list(new)
+        matrix = np.asarray([new[key] for key in keys], dtype=np.float32)
+        name = f"{int(time.time() * 1000)}-{uuid.uuid4().hex[:8]}"
+        with self._lock:
+            self._writing.add(name)
+        try:
+            self._write_segment(name, keys, matrix)
+            vectors = np.load(os.path.join(self.directory, f"{name}.npy"), mmap_mode="r")
+        except BaseException:
+            with self._lock:
+                self._writing.discard(name)
+            raise
+        with self._lock:
+            self._writing.discard(name)
+            self._segments[name] = vectors
+            for row, key in enumerate(keys):
+                self._index[key] = (name, row)
+            if self._needs_compaction() and not self._compacting:
+                self._compacting = True
+                threading.Thread(target=self._compact_in_background, name="embedding-cache-compaction", daemon=True).start()
+
+    def _needs_compaction(self):
+        return len(self._segments) > EMBEDDING_CACHE_MAX_SEGMENTS or len(self._index) > EMBEDDING_CACHE_MAX_VECTORS
+
+    def _compact_in_background(self):
+        try:
+            self.compact()
+        except Exception:
+            logger.exception("Embedding cache compaction failed in %s", self.directory)
+        finally:
+            with self._lock:
+                self._compacting = False
+
+    def compact(self):
+        """Merge all segments into one, dropping the least recently used vectors over the cap"""
+        with self._compact_lock:
+            with self._lock:
+                if not self._needs_compaction() and len(self._segments) <= 1:
+                    return
+                keys = list(self._index)[-EMBEDDING_CACHE_MAX_VECTORS:]
+                matrix = np.asarray([self._segments[s][r] for s, r in (self._index[k] for k in keys)], dtype=np.float32)
+                old_segments = set(self._segments)
+            name = f"{int(time.time() * 1000)}-{uuid.uuid4().hex[:8]}"
+            self._write_segment(name, keys, matrix)
+            merged = np.load(os.path.join(self.directory, f"{name}.npy"), mmap_mode="r")
+            with self._lock:
+                # Segments written by put_many since the snapshot stay as they are
+                index = {key: (name, row) for row, key in enumerate(keys)}
+                for key, location in self._index.items():
+                    if location[0] not in old_segments:
+                        index.pop(key, None)
+                        index[key] = location
+                self._index = index
+                self._segments = {
+                    name: merged,
+                    **{segment: vectors for segment, vectors in self._segments.items() if segment not in old_segments},
+                }
+                # Removed under the lock, so refresh() cannot pick the old files up again
+                for old in old_segments:
+                    for suffix in (".keys.json", ".npy"):
+                        try:
+                            os.remove(os.path.join(self.directory, old + suffix))
+                        except OSError:
+                            # Still mapped by another process (Windows) or already removed
+                            pass
+
+
+class _MicroBatcher:
+    """
+    Collects texts from concurrent callers into batched backend calls
+
+    A caller's texts are queued with a future; a worker thread waits up to
+    EMBEDDING_BATCH_WAIT_MS for more work, then embeds up to
+    EMBEDDING_BATCH_SIZE texts in one call and resolves the futures.
+    """
+
+    def __init__(self, embed_batch):
+        self._embed_batch = embed_batch
+        self._pending = []
+        self._condition = threading.Condition()
+        self._thread = None
+        self.batches = 0
+        self.texts = 0
+
+    def submit(self, texts) -> List[Future]:
+        futures = [Future() for _ in texts]
+        with self._condition:
+            self._pending.extend(zip(texts, futures))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="embedding-batcher", daemon=True)
+                self._thread.start()
+            self._condition.notify()
+        return futures
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._pending:
+                    self._condition.wait()
+                # Give concurrent callers a moment to add their texts
+                deadline = time.monotonic() + EMBEDDING_BATCH_WAIT_MS / 1000
+                while len(self._pending) < EMBEDDING_BATCH_SIZE:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._condition.wait(remaining)
+                batch = self._pending[:EMBEDDING_BATCH_SIZE]
+                del self._pending[:EMBEDDING_BATCH_SIZE]
+
+            # Callers asking for the same text share one embedding
+            futures_by_text = {}
+            for text, future in batch:
+                futures_by_text.setdefault(text, []).append(future)
+            texts = list(futures_by_text)
+            try:
+                vectors = self._embed_batch(texts)
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            self.batches += 1
+            self.texts += len(texts)
+            for text, vector in zip(texts, vectors):
+                for future in futures_by_text[text]:
+                    future.set_result(vector)
+
+
+class EmbeddingService:
+    """
+    One embedding model per process, with a persistent vector cache
+
+    Known texts are answered from the cache; the rest are de-duplicated,
+    micro-batched with other callers' texts, embedded and cached. Only
+    document texts are persisted: questions are one-off, so their vectors
+    go to a bounded in-memory LRU instead.
+    """
+
+    def __init__(self, provider, model_name):
+        self.provider = provider
+        self.model_name = model_name
+        self.model_id = f"{provider}:{model_name}"
+        self._model = None
+        self._model_lock = threading.Lock()
+        safe_name = re.sub(r"[^A-Za-z0-9._-]+", "_", self.model_id)
+        self.cache = VectorCache(os.path.join(EMBEDDING_CACHE_DIR, safe_name))
+        self._batcher = _MicroBatcher(self._embed_batch)
+        self._query_cache: OrderedDict = OrderedDict()
+        self._query_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def model(self):
+        """The backend model, created on first use"""
+        if self._model is None:
+            with self._model_lock:
+                if self._model is None:
+                    self._model = self._create_model()
+        return self._model
+
+    def _create_model(self):
+        if self.provider == "huggingface":
+            from langchain_community.embeddings import HuggingFaceEmbeddings
+            return HuggingFaceEmbeddings(model_name=self.model_name)
+        from langchain_openai import OpenAIEmbeddings
+        # The RAG generator embeds inside gateway.call, which retries
+        return OpenAIEmbeddings(model=self.model_name, max_retries=0)
+
+    def _embed_batch(self, texts):
+        return self.model.embed_documents(texts)
+
+    def embed(self, texts) -> np.ndarray:
+        """
+        Embed texts, using cached vectors where available
+
+        Returns:
+            np.ndarray: float32 matrix with one row per text
+        """
+        if not texts:
+            return np.zeros((0, 0), dtype=np.float32)
+        self.cache.refresh()
+        keys = [content_hash(self.model_id, text) for text in texts]
+        found = self.cache.get_many(keys)
+
+        missing = {}
+        for text, key in zip(texts, keys):
+            if key not in found and key not in missing:
+                missing[key] = text
+        self.hits += len(texts) - len(missing)
+        self.misses += len(missing)
+
+        if missing:
+            futures = self._batcher.submit(list(missing.values()))
+            for key, future in zip(missing, futures):
+                found[key] = np.asarray(future.result(), dtype=np.float32)
+            self.cache.put_many({key: found[key] for key in missing})
+        return np.vstack([found[key] for key in keys])
+
+    def embed_query(self, text) -> np.ndarray:
+        """Embed a question, caching its vector in memory only"""
+        key = content_hash(self.model_id, text)
+        with self._query_lock:
+            vector = self._query_cache.get(key)
+            if vector is not None:
+                self._query_cache.move_to_end(key)
+                self.hits += 1
+                return vector
+            self.misses += 1
+        vector = np.asarray(self._batcher.submit([text])[0].result(), dtype=np.float32)
+        with self._query_lock:
+            self._query_cache[key] = vector
+            self._query_cache.move_to_end(key)
+            while len(self._query_cache) > EMBEDDING_QUERY_CACHE_SIZE:
+                self._query_cache.popitem(last=False)
+        return vector
+
+    def preload(self, texts):
+        """Embed and cache texts ahead of time (e.g. the schema chunks at startup)"""
+        self.embed(list(texts))
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "model": self.model_id,
+            "cached_vectors": len(self.cache),
+            "cached_queries": len(self._query_cache),
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "hits": self.hits,
+            "misses": self.misses,
+            "batches": self._batcher.batches,
+            "avg_batch_size": self._batcher.texts / self._batcher.batches if self._batcher.batches else 0.0,
+        }
+
+
+class CachedEmbeddings(Embeddings):
+    """LangChain Embeddings backed by the process-wide EmbeddingService"""
+
+    def __init__(self, service: EmbeddingService):
+        self.service = service
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.service.embed(texts).tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.service.embed_query(text).tolist()
+
+
+_services: Dict[str, EmbeddingService] = {}
+_services_lock = threading.Lock()
+
+
+def get_embedding_service(provider: Optional[str] = None) -> EmbeddingService:
+    """The process-wide EmbeddingService for a provider ("openai" or "huggingface")"""
+    provider = provider or EMBEDDING_PROVIDER
+    if provider not in ("openai", "huggingface"):
+        logger.warning("Unknown embedding type: %s. Using OpenAI embeddings.", provider)
+        provider = "openai"
+    with _services_lock:
+        if provider not in _services:
+            model_name = HUGGINGFACE_EMBEDDING_MODEL if provider == "huggingface" else OPENAI_EMBEDDING_MODEL
+            _services[provider] = EmbeddingService(provider, model_name)
+        return _services[provider]
+
+
+def get_embeddings(provider: Optional[str] = None) -> CachedEmbeddings:
+    """LangChain Embeddings for vector stores, sharing the process-wide model and cache"""
+    return CachedEmbeddings(get_embedding_service(provider))
+
+
+def embedding_stats():
+    """Cache and batching metrics of every embedding service created so far"""
+    return {provider: service.stats() for provider, service in _services.items()}
@@ -1,9 +1,9 @@
+import hashlib
+import logging
 import os
 from typing import List, Dict, Any
 
 
-from langchain_community.embeddings import HuggingFaceEmbeddings
-from langchain_openai import OpenAIEmbeddings
 from langchain_community.vectorstores import Chroma
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain_community.document_loaders import TextLoader, PyPDFLoader
@@ -13,6 +13,23 @@ from langchain.schema.runnable import RunnablePassthrough
 from langchain.schema.output_parser import StrOutputParser
 from langchain.schema.document import Document
 
+from app.db.targets import get_target
+from app.rag.embedding_service import get_embeddings
+from app.rag.numpy_vector_store import NumpyVectorStore
+from app.rag.hybrid_retriever import HybridRetriever
+from app.services.sql_validator import get_catalog, validate_sql
+
+logger = logging.getLogger(__name__)
+
+# Vector store for the schema chunks: "numpy" (in-process matrix) or "chroma"
+RAG_VECTOR_STORE = os.getenv("RAG_VECTOR_STORE", "numpy")
+# Schema context retrieval: "hybrid" (BM25 + vectors) or "mmr" (vectors only)
+RAG_RETRIEVER = os.getenv("RAG_RETRIEVER", "hybrid")
+# Chunks put into the prompt by the hybrid retriever
+RAG_RETRIEVAL_K = int(os.getenv("RAG_RETRIEVAL_K", "6"))
+# Chat model of the SQL chain; generations go through the provider gateway as "openai" calls of it
+RAG_MODEL = "gpt-4o"
+
 # 1. Set up environment
 def setup_environment():
     """Set up environment variables for API keys."""
@@ -41,12 +58,11 @@ def load_schema_metadata(schema_file: str):
                 schema_metadata = f.read()
         
             
-        print(f"Loaded schema metadata from {schema_file} ({len(schema_metadata)} characters)")
+        logger.debug("Loaded schema metadata from %s (%d characters)", schema_file, len(schema_metadata))
         return schema_metadata
     except Exception as e:
-        print(f"Error loading schema metadata: {e}")
         # Fallback to default metadata if file not found or error occurs
-        print("Using default schema metadata.")
+        logger.warning("Error loading schema metadata, using default schema metadata: %s", e)
 
 # 3. Split schema metadata into chunks for embedding
 def prepare_schema_chunks(schema_metadata, chunk_size=1500, chunk_overlap=300):
@@ -62,29 +78,37 @@ def prepare_schema_chunks(schema_metadata, chunk_size=1500, chunk_overlap=300):
     doc = Document(page_content=schema_metadata, metadata={"source": "schema_metadata"})
     chunks = text_splitter.split_documents([doc])
     
-    print(f"Split schema metadata into {len(chunks)} chunks")
+    logger.debug("Split schema metadata into %d chunks", len(chunks))
     return chunks
 
 # 4. Create vector embeddings
-def create_embeddings(chunks, embedding_type="openai", persist_directory="sql_db"):
+def create_embeddings(chunks, embedding_type="openai", persist_directory="sql_db", vector_store=RAG_VECTOR_STORE):
     """Create and store vector embeddings."""
     
-    # Choose embedding model
-    if embedding_type == "openai":
-        embeddings = OpenAIEmbeddings()
-    elif embedding_type == "huggingface":
-        # Use a free, locally-runnable model
-        model_name = "sentence-transformers/all-mpnet-base-v2"
-        embeddings = HuggingFaceEmbeddings(model_name=model_name)
-    else:
-        print(f"Unknown embedding type: {embedding_type}. Using OpenAI embeddings.")
-        embeddings = OpenAIEmbeddings()
+    # Process-wide model with a persistent vector cache, so chunks that were
+    # embedded before (by this or another process) are not sent again
+    embeddings = get_embeddings(embedding_type)
+    ids = [hashlib.sha256(chunk.page_content.encode("utf-8")).hexdigest() for chunk in chunks]
+
+    if vector_store == "numpy":
+        # Reuse the saved index if it was built from the same chunks and model
+        index_path = os.path.join(persist_directory, "schema_index")
+        fingerprint = hashlib.sha256(
+            "\n".join([embeddings.service.model_id] + ids).encode("utf-8")
+        ).hexdigest()
+        vectordb = NumpyVectorStore.load(index_path, embeddings)
+        if vectordb is None or vectordb.fingerprint != fingerprint:
+            vectordb = NumpyVectorStore.from_documents(chunks, embeddings, ids=ids, fingerprint=fingerprint)
+            vectordb.save(index_path)
+        return vectordb
         
-    # Create vector store
+    # Create vector store; content-derived ids make a rebuild overwrite the
+    # persisted chunks instead of adding duplicates
     vectordb = Chroma.from_documents(
         documents=chunks,
         embedding=embeddings,
-        persist_directory=persist_directory
+        persist_directory=persist_directory,
+        ids=ids
     )
     
     # Persist the database
@@ -93,11 +117,20 @@ def create_embeddings(chunks, embedding_type="openai", persist_directory="sql_db
     return vectordb
 
 # 5. Create SQL generation chain
-def create_sql_chain(vectordb, model_name="gpt-4o-mini", temperature=0):
-    """Create the SQL generation chain."""
+def create_sql_chain(vectordb, model_name="gpt-4o-mini", temperature=0, chunks=None, retriever_type=RAG_RETRIEVER):
+    """
+    Create the SQL generation chain.
+
+    vectordb can be any LangChain vector store; create_embeddings() builds a
+    NumpyVectorStore or a Chroma collection depending on RAG_VECTOR_STORE.
+    With chunks given and the hybrid retriever selected, context comes from
+    BM25 over the chunks fused with vector search, which finds exact codes
+    and column names with a small k.
+    """
     
     # Initialize LLM
-    llm = ChatOpenAI(model_name=model_name, temperature=temperature)
+    # Generations run inside gateway.call, which retries (honouring Retry-After)
+    llm = ChatOpenAI(model_name=model_name, temperature=temperature, max_retries=0)
     
     # Create a custom prompt template for SQL generation
     # This is specifically designed to output ONLY the SQL query
@@ -149,8 +182,11 @@ def create_sql_chain(vectordb, model_name="gpt-4o-mini", temperature=0):
     
     prompt = PromptTemplate.from_template(template)
     
-    # Set up the retriever with increased K to get more context
-    retriever = vectordb.as_retriever(search_type="mmr", search_kwargs={"k": 40})
+    if chunks and retriever_type == "hybrid":
+        retriever = HybridRetriever.from_documents(chunks, vectordb, k=RAG_RETRIEVAL_K)
+    else:
+        # Set up the retriever with increased K to get more context
+        retriever = vectordb.as_retriever(search_type="mmr", search_kwargs={"k": 40})
     
     # Create the RAG chain
     def format_docs(docs):
@@ -168,13 +204,14 @@ def create_sql_chain(vectordb, model_name="gpt-4o-mini", temperature=0):
 
 # 6. Main SQL RAG system
 class SQLQueryGenerator:
-    def __init__(self, schema_file=None, embedding_type="openai", model_name="gpt-4o"):
+    def __init__(self, schema_file=None, embedding_type="openai", model_name=RAG_MODEL, schema_metadata=None,
+                 vector_store=RAG_VECTOR_STORE, persist_directory="sql_db"):
         """Initialize the SQL Query Generator."""
         # Setup
         setup_environment()
         
-        # Load schema metadata (from file or use default)
-        if schema_file:
+        # Load schema metadata (profiled text if given, otherwise from file)
+        if schema_metadata is None and schema_file:
             schema_metadata = load_schema_metadata(schema_file)
 
         
@@ -182,10 +219,10 @@ class SQLQueryGenerator:
         chunks = prepare_schema_chunks(schema_metadata)
         
         # Create vector store
-        self.vectordb = create_embeddings(chunks, embedding_type)
+        self.vectordb = create_embeddings(chunks, embedding_type, persist_directory, vector_store)
         
         # Create SQL chain
-        self.sql_chain = create_sql_chain(self.vectordb, model_name, temperature=0)
+        self.sql_chain = create_sql_chain(self.vectordb, model_name, temperature=0, chunks=chunks)
     
     def generate_query(self, natural_language_request: str) -> str:
         """Generate SQL query from natural language."""
@@ -206,25 +243,12 @@ class SQLQueryGenerator:
             
         return sql_query
     
-    def validate_sql(self, sql_query: str) -> bool:
+    def validate_sql(self, sql_query: str, target=None) -> bool:
         """
-        Basic validation of SQL query syntax.
-        Could be extended in the future to connect to a database for full validation.
+        Check the query against the target's cached schema catalog without touching the database:
+        a single read-only SELECT whose tables and columns all exist.
         """
-        # Basic validation checks
-        sql_lower = sql_query.lower()
-        
-        # Check for basic SQL structure
-        has_select = "select" in sql_lower
-        has_from = "from" in sql_lower
-        
-        # Check balance of parentheses
-        balanced_parens = sql_query.count('(') == sql_query.count(')')
-        
-        # Check for common syntax errors
-        no_double_commas = ",," not in sql_query
-        
-        return has_select and has_from and balanced_parens and no_double_commas
+        return validate_sql(sql_query, get_catalog(target))["valid"]
 
 # Constants from the provided data
 
@@ -235,21 +259,59 @@ class SQLQueryGenerator:
 
 
 
-def generate_sql_query_by_rag(prompt):
-    # Use correct relative path to the constant directory
-    schema_file_path = "app/constant/file.txt" 
+# Use correct relative path to the constant directory
+SCHEMA_FILE_PATH = "app/constant/file.txt"
+
+# Saved vector indexes, one directory per database target
+RAG_INDEX_DIRECTORY = "sql_db"
+
 
-    sql_generator = SQLQueryGenerator(schema_file=schema_file_path)
+def _generator_size(sql_generator):
+    """Estimated bytes held by a generator's vector store"""
+    vectors = getattr(sql_generator.vectordb, "vectors", None)
+    documents = getattr(sql_generator.vectordb, "documents", [])
+    return (vectors.nbytes if vectors is not None else 0) + sum(len(d.page_content) for d in documents)
+
+
+def get_sql_generator(target=None):
+    """
+    The SQLQueryGenerator for a database target's current schema
+
+    Building one splits and embeds the schema and creates the chain, so it
+    is done once per target and schema version instead of on every request,
+    and is dropped with the target's other cached objects when the target
+    is evicted.
+    """
+    target = get_target(target)
+    # Prefer the metadata profiled after the last load over the hand-written file
+    schema_metadata = target.schema_prompt() or load_schema_metadata(SCHEMA_FILE_PATH)
+    return target.cached(
+        "rag_generator",
+        schema_metadata,
+        lambda: SQLQueryGenerator(
+            schema_metadata=schema_metadata,
+            persist_directory=os.path.join(RAG_INDEX_DIRECTORY, target.name),
+        ),
+        size=_generator_size,
+    )
+
+
+def preload_sql_generator():
+    """Build the generator (embedding the schema into the cache) before the first request"""
+    try:
+        get_sql_generator()
+    except Exception as e:
+        logger.warning("Could not preload the RAG SQL generator: %s", e)
+
+
+def generate_sql_query_by_rag(prompt, target=None):
+    sql_generator = get_sql_generator(target)
     
-    print(f"\nNatural language request: {prompt}")
     sql = sql_generator.generate_query(prompt)
-    print(f"SQL query: {sql}")
         
     # Validate the SQL query
-    if sql_generator.validate_sql(sql):
-        print("✓ SQL syntax validation passed")
-    else:
-        print("✗ SQL syntax validation failed")
+    valid = sql_generator.validate_sql(sql, target)
+    logger.debug("RAG generated SQL", extra={"prompt": prompt, "sql_query": sql, "valid": valid})
 
     return sql
     
@@ -0,0 +1,121 @@
+import math
+import re
+from collections import Counter
+from typing import Dict, List, Tuple
+
+import numpy as np
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+from langchain_core.vectorstores import VectorStore
+
+# Words, numbers and joined codes such as "15-3", "assessed_by" or "g/dl"
+_TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:[-_./][a-z0-9]+)*")
+
+
+def tokenize(text):
+    """
+    Lower-cased tokens for BM25
+
+    Joined codes are kept whole and also split into their parts, so
+    "assessed_by" matches both "assessed_by" and "assessed by", and
+    "CA 15-3" matches "ca" and "15-3".
+    """
+    tokens = []
+    for token in _TOKEN_PATTERN.findall(text.lower()):
+        tokens.append(token)
+        parts = re.split(r"[-_./]", token)
+        if len(parts) > 1:
+            tokens.extend(part for part in parts if part)
+    return tokens
+
+
+class BM25Index:
+    """
+    Inverted index with precomputed BM25 weights
+
+    Each term maps to the documents containing it and the term's BM25
+    weight in each of them, so scoring a query is one scatter-add per
+    query term.
+    """
+
+    def __init__(self, texts: List[str], k1: float = 1.5, b: float = 0.75):
+        self.size = len(texts)
+        tokenized = [tokenize(text) for text in texts]
+        lengths = np.array([len(tokens) for tokens in tokenized], dtype=np.float32)
+        average_length = float(lengths.mean()) if self.size else 0.0
+
+        postings: Dict[str, List[Tuple[int, int]]] = {}
+        for doc_id, tokens in enumerate(tokenized):
+            for term, frequency in Counter(tokens).items():
+                postings.setdefault(term, []).append((doc_id, frequency))
+
+        self._postings: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}
+        for term, entries in postings.items():
+            doc_ids = np.array([doc_id for doc_id, _ in entries], dtype=np.int32)
+            frequencies = np.array([frequency for _, frequency in entries], dtype=np.float32)
+            idf = math.log(1 + (self.size - len(entries) + 0.5) / (len(entries) + 0.5))
+            norm = k1 * (1 - b + b * lengths[doc_ids] / (average_length or 1.0))
+            self._postings[term] = (doc_ids, idf * frequencies * (k1 + 1) / (frequencies + norm))
+
+    def scores(self, query: str) -> np.ndarray:
+        """BM25 score of every document for a query"""
+        scores = np.zeros(self.size, dtype=np.float32)
+        for term in tokenize(query):
+            posting = self._postings.get(term)
+            if posting is not None:
+                np.add.at(scores, posting[0], posting[1])
+        return scores
+
+    def search(self, query: str, k: int) -> List[int]:
+        """Indexes of the k best-matching documents (only those matching at least one term)"""
+        scores = self.scores(query)
+        matching = np.flatnonzero(scores > 0)
+        return matching[np.argsort(-scores[matching])][:k].tolist()
+
+
+class HybridRetriever(BaseRetriever):
+    """
+    BM25 + dense retrieval fused with reciprocal rank fusion
+
+    Exact identifiers (lab test codes, visit names, column names) are found
+    by BM25 even when the embedding does not rank them highly, and
+    paraphrased questions are found by the vector store. A document's fused
+    score is sum(weight / (rrf_k + rank)) over the two rankings.
+    """
+
+    vectorstore: VectorStore
+    index: BM25Index
+    documents: List[Document]
+    k: int = 6
+    fetch_k: int = 20
+    rrf_k: int = 60
+    dense_weight: float = 1.0
+    sparse_weight: float = 1.0
+
+    @classmethod
+    def from_documents(cls, documents: List[Document], vectorstore: VectorStore, **kwargs) -> "HybridRetriever":
+        """Build the BM25 index over the same documents that are in the vector store"""
+        return cls(
+            vectorstore=vectorstore,
+            index=BM25Index([document.page_content for document in documents]),
+            documents=list(documents),
+            **kwargs,
+        )
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        fused: Dict[str, float] = {}
+        by_content: Dict[str, Document] = {}
+
+        for rank, doc_id in enumerate(self.index.search(query, self.fetch_k)):
+            document = self.documents[doc_id]
+            by_content[document.page_content] = document
+            fused[document.page_content] = self.sparse_weight / (self.rrf_k + rank + 1)
+
+        for rank, document in enumerate(self.vectorstore.similarity_search(query, k=self.fetch_k)):
+            by_content.setdefault(document.page_content, document)
+            fused[document.page_content] = fused.get(document.page_content, 0.0) + \
+                self.dense_weight / (self.rrf_k + rank + 1)
+
+        ranked = sorted(fused, key=fused.get, reverse=True)[:self.k]
+        return [by_content[content] for content in ranked]
@@ -0,0 +1,200 @@
+import json
+import os
+import uuid
+from typing import Any, Iterable, List, Optional, Tuple
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.vectorstores import VectorStore
+
+
+def _normalize(matrix):
+    """Scale rows to unit length so cosine similarity is a dot product"""
+    matrix = np.asarray(matrix, dtype=np.float32)
+    if matrix.ndim == 1:
+        matrix = matrix[np.newaxis, :]
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def mmr_select(query_vector, candidates, k, lambda_mult=0.5):
+    """
+    Maximal marginal relevance over unit-length vectors
+
+    Each step picks the candidate maximising
+    lambda * sim(query) - (1 - lambda) * max sim(already selected), keeping a
+    running max so a step is one matrix-vector product, not a loop over the
+    selection.
+
+    Args:
+        query_vector: Unit-length query vector
+        candidates: Unit-length candidate matrix (rows)
+        k: Number of rows to select
+        lambda_mult: 1 for pure relevance, 0 for maximum diversity
+
+    Returns:
+        list: Selected row indexes, in selection order
+    """
+    count = candidates.shape[0]
+    k = min(k, count)
+    if k <= 0:
+        return []
+    relevance = candidates @ query_vector
+    redundancy = np.full(count, -np.inf, dtype=np.float32)
+    available = np.ones(count, dtype=bool)
+    selected = []
+    for _ in range(k):
+        scores = lambda_mult * relevance - (1 - lambda_mult) * np.where(np.isinf(redundancy), 0.0, redundancy)
+        scores[~available] = -np.inf
+        best = int(np.argmax(scores))
+        selected.append(best)
+        available[best] = False
+        redundancy = np.maximum(redundancy, candidates @ candidates[best])
+    return selected
+
+
+class NumpyVectorStore(VectorStore):
+    """
+    In-process vector store over one contiguous float32 matrix
+
+    Meant for small corpora such as the schema chunks, where Chroma's client,
+    SQLite persistence and HNSW index cost far more than a brute-force
+    search. Rows are stored normalized, so similarity search is a single
+    matrix-vector product. save() writes the matrix as one .npy file (loaded
+    back memory-mapped) with the documents in a JSON sidecar.
+    """
+
+    def __init__(self, embedding: Embeddings, vectors=None, documents: Optional[List[Document]] = None,
+                 ids: Optional[List[str]] = None, fingerprint: Optional[str] = None):
+        self._embedding = embedding
+        self.documents = list(documents or [])
+        self.ids = list(ids or [str(uuid.uuid4()) for _ in self.documents])
+        self.vectors = vectors if vectors is not None else np.zeros((0, 0), dtype=np.float32)
+        # Caller-defined identity of the indexed content (e.g. a hash of the chunks)
+        self.fingerprint = fingerprint
+
+    @property
+    def embeddings(self) -> Embeddings:
+        return self._embedding
+
+    def add_texts(self, texts: Iterable[str], metadatas: Optional[List[dict]] = None,
+                  ids: Optional[List[str]] = None, **kwargs: Any) -> List[str]:
+        texts = list(texts)
+        if not texts:
+            return []
+        metadatas = metadatas or [{} for _ in texts]
+        ids = list(ids) if ids else [str(uuid.uuid4()) for _ in texts]
+        new_vectors = _normalize(self._embedding.embed_documents(texts))
+
+        # Re-adding an id replaces its row, like Chroma's upsert
+        positions = {doc_id: row for row, doc_id in enumerate(self.ids)}
+        if self.vectors.size:
+            vectors = np.array(self.vectors, dtype=np.float32)
+        else:
+            vectors = np.zeros((0, new_vectors.shape[1]), dtype=np.float32)
+        appended = []
+        for text, metadata, doc_id, vector in zip(texts, metadatas, ids, new_vectors):
+            document = Document(page_content=text, metadata=metadata)
+            if doc_id in positions:
+                vectors[positions[doc_id]] = vector
+                self.documents[positions[doc_id]] = document
+            else:
+                positions[doc_id] = len(self.ids)
+                self.ids.append(doc_id)
+                self.documents.append(document)
+                appended.append(vector)
+        if appended:
+            vectors = np.vstack([vectors, np.asarray(appended, dtype=np.float32)])
+        self.vectors = np.ascontiguousarray(vectors)
+        return ids
+
+    @classmethod
+    def from_texts(cls, texts: List[str], embedding: Embeddings, metadatas: Optional[List[dict]] = None,
+                   ids: Optional[List[str]] = None, **kwargs: Any) -> "NumpyVectorStore":
+        store = cls(embedding, fingerprint=kwargs.get("fingerprint"))
+        store.add_texts(texts, metadatas, ids)
+        return store
+
+    def _query_vector(self, query: str):
+        return _normalize(self._embedding.embed_query(query))[0]
+
+    def similarity_search_with_score_by_vector(self, embedding, k: int = 4) -> List[Tuple[Document, float]]:
+        if not self.documents:
+            return []
+        scores = self.vectors @ _normalize(embedding)[0]
+        k = min(k, len(scores))
+        # argpartition finds the top k without sorting everything
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(self.documents[i], float(scores[i])) for i in top]
+
+    def similarity_search_with_score(self, query: str, k: int = 4, **kwargs: Any) -> List[Tuple[Document, float]]:
+        return self.similarity_search_with_score_by_vector(self._query_vector(query), k)
+
+    def similarity_search_by_vector(self, embedding: List[float], k: int = 4, **kwargs: Any) -> List[Document]:
+        return [document for document, _ in self.similarity_search_with_score_by_vector(embedding, k)]
+
+    def similarity_search(self, query: str, k: int = 4, **kwargs: Any) -> List[Document]:
+        return self.similarity_search_by_vector(self._query_vector(query), k)
+
+    def _similarity_search_with_relevance_scores(self, query: str, k: int = 4,
+                                                 **kwargs: Any) -> List[Tuple[Document, float]]:
+        # Cosine similarity in [-1, 1] mapped to a relevance score in [0, 1]
+        return [(document, (score + 1) / 2) for document, score in self.similarity_search_with_score(query, k)]
+
+    def max_marginal_relevance_search_by_vector(self, embedding: List[float], k: int = 4, fetch_k: int = 20,
+                                                lambda_mult: float = 0.5, **kwargs: Any) -> List[Document]:
+        if not self.documents:
+            return []
+        query_vector = _normalize(embedding)[0]
+        scores = self.vectors @ query_vector
+        fetch_k = min(max(fetch_k, k), len(scores))
+        candidates = np.argpartition(-scores, fetch_k - 1)[:fetch_k]
+        selected = mmr_select(query_vector, self.vectors[candidates], k, lambda_mult)
+        return [self.documents[candidates[i]] for i in selected]
+
+    def max_marginal_relevance_search(self, query: str, k: int = 4, fetch_k: int = 20,
+                                      lambda_mult: float = 0.5, **kwargs: Any) -> List[Document]:
+        return self.max_marginal_relevance_search_by_vector(self._query_vector(query), k, fetch_k, lambda_mult)
+
+    def delete(self, ids: Optional[List[str]] = None, **kwargs: Any) -> Optional[bool]:
+        if not ids:
+            return False
+        drop = set(ids)
+        keep = [row for row, doc_id in enumerate(self.ids) if doc_id not in drop]
+        self.vectors = np.ascontiguousarray(self.vectors[keep])
+        self.documents = [self.documents[row] for row in keep]
+        self.ids = [self.ids[row] for row in keep]
+        return True
+
+    def save(self, path: str):
+        """Write `<path>.npy` (vectors) and `<path>.json` (documents), each replaced atomically"""
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp_npy = f"{path}.tmp.npy"
+        np.save(tmp_npy, np.ascontiguousarray(self.vectors, dtype=np.float32))
+        os.replace(tmp_npy, f"{path}.npy")
+        sidecar = {
+            "fingerprint": self.fingerprint,
+            "ids": self.ids,
+            "documents": [{"page_content": d.page_content, "metadata": d.metadata} for d in self.documents],
+        }
+        tmp_json = f"{path}.json.tmp"
+        with open(tmp_json, "w", encoding="utf-8") as f:
+            json.dump(sidecar, f)
+        os.replace(tmp_json, f"{path}.json")
+
+    @classmethod
+    def load(cls, path: str, embedding: Embeddings) -> Optional["NumpyVectorStore"]:
+        """Open a saved store with its vectors memory-mapped, or None if it does not exist"""
+        try:
+            with open(f"{path}.json", "r", encoding="utf-8") as f:
+                sidecar = json.load(f)
+            vectors = np.load(f"{path}.npy", mmap_mode="r")
+        except (OSError, ValueError):
+            return None
+        documents = [Document(**document) for document in sidecar["documents"]]
+        if len(documents) != vectors.shape[0]:
+            return None
+        return cls(embedding, vectors, documents, sidecar["ids"], sidecar.get("fingerprint"))
@@ -0,0 +1,52 @@
+from typing import Literal, Optional
+
+from fastapi import APIRouter, Depends, HTTPException
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel
+
+from app.auth.auth import get_current_user
+from app.db.targets import UnknownTargetError
+from app.model.user import UserResponse
+from app.services.export_query import (
+    EXPORT_FORMATS,
+    ExportError,
+    check_read_only_select,
+    describe_query,
+    stream_csv,
+    stream_parquet
+)
+
+router = APIRouter()
+
+
+class ExportRequest(BaseModel):
+    sql_query: str
+    format: Literal["csv", "parquet"] = "csv"
+    target: Optional[str] = None
+
+
+@router.post("/")
+async def export_query(request: ExportRequest, current_user: UserResponse = Depends(get_current_user)):
+    """
+    Stream the full result of a generated SQL query as CSV or Parquet
+
+    The query runs in a read-only transaction and is streamed with
+    COPY ... TO STDOUT, so the result is never held in memory as rows.
+    """
+    try:
+        sql_query = check_read_only_select(request.sql_query, request.target)
+        # Reject SQL that does not plan before any of the download is sent
+        columns = await run_in_threadpool(describe_query, sql_query, request.target)
+    except (ExportError, UnknownTargetError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    if request.format == "parquet":
+        body = stream_parquet(sql_query, columns, request.target)
+    else:
+        body = stream_csv(sql_query, request.target)
+    return StreamingResponse(
+        body,
+        media_type=EXPORT_FORMATS[request.format],
+        headers={"Content-Disposition": f'attachment; filename="export.{request.format}"'},
+    )
@@ -0,0 +1,43 @@
+from datetime import datetime, timedelta
+from typing import Optional
+
+from fastapi import APIRouter, Depends, Query
+
+from app.auth.auth import get_current_user
+from app.model.user import UserResponse
+from app.services.query_history import most_frequent_sql, slowest_queries, user_history
+
+router = APIRouter()
+
+
+def _since(hours: Optional[int]) -> Optional[datetime]:
+    return datetime.utcnow() - timedelta(hours=hours) if hours else None
+
+
+@router.get("/me")
+async def get_my_history(
+    limit: int = Query(20, ge=1, le=100),
+    current_user: UserResponse = Depends(get_current_user)
+):
+    """Most recent queries of the current user"""
+    return await user_history(str(current_user.id), limit)
+
+
+@router.get("/slowest")
+async def get_slowest_queries(
+    limit: int = Query(10, ge=1, le=100),
+    since_hours: Optional[int] = Query(None, ge=1, description="Only consider queries from the last N hours"),
+    current_user: UserResponse = Depends(get_current_user)
+):
+    """The current user's queries with the highest end-to-end time"""
+    return await slowest_queries(str(current_user.id), limit, _since(since_hours))
+
+
+@router.get("/frequent-sql")
+async def get_most_frequent_sql(
+    limit: int = Query(10, ge=1, le=100),
+    since_hours: Optional[int] = Query(None, ge=1, description="Only consider queries from the last N hours"),
+    current_user: UserResponse = Depends(get_current_user)
+):
+    """The current user's generated SQL grouped by statement, most frequent first, with timing and failure counts"""
+    return await most_frequent_sql(str(current_user.id), limit, _since(since_hours))
@@ -0,0 +1,94 @@
+import json
+from typing import Optional
+
+from fastapi import APIRouter, Depends, HTTPException
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel
+
+from app.auth.auth import get_optional_current_user
+from app.db.targets import get_target
+from app.model.user import UserResponse
+from app.services.query_jobs import FINISHED, QUERY_JOB_SSE_KEEPALIVE_SECONDS, public_view, query_jobs
+
+router = APIRouter()
+
+
+class JobRequest(BaseModel):
+    prompt: str
+    model: str
+    # Study database to query (see DB_TARGETS); None for the default database
+    target: Optional[str] = None
+
+
+def _get_job(job_id: str, current_user: Optional[UserResponse]):
+    """The job, if it exists and belongs to the caller (anonymous jobs are readable by id)"""
+    job = query_jobs.get(job_id)
+    user_id = str(current_user.id) if current_user else None
+    if job is None or (job["user_id"] is not None and job["user_id"] != user_id):
+        raise HTTPException(status_code=404, detail="Job not found or expired")
+    return job
+
+
+@router.post("", status_code=202)
+async def submit_job(request: JobRequest, current_user: Optional[UserResponse] = Depends(get_optional_current_user)):
+    """
+    Queue a query and return its job id at once
+
+    Poll GET /query/jobs/{id} or subscribe to GET /query/jobs/{id}/events
+    for the result.
+    """
+    # Unknown targets fail the submission rather than the job
+    target = get_target(request.target).name
+    user_id = str(current_user.id) if current_user else None
+    job = query_jobs.submit(request.prompt, request.model, target, user_id)
+    return {
+        "job_id": job["id"],
+        "status": job["status"],
+        "status_url": f"/query/jobs/{job['id']}",
+        "events_url": f"/query/jobs/{job['id']}/events",
+    }
+
+
+@router.get("/{job_id}")
+async def get_job(job_id: str, current_user: Optional[UserResponse] = Depends(get_optional_current_user)):
+    """Status of a job, with the query result once it has finished"""
+    return public_view(_get_job(job_id, current_user))
+
+
+def _event(name, data):
+    return f"event: {name}\ndata: {json.dumps(jsonable_encoder(data))}\n\n"
+
+
+@router.get("/{job_id}/events")
+async def stream_job_events(job_id: str, current_user: Optional[UserResponse] = Depends(get_optional_current_user)):
+    """
+    Server-sent events for a job
+
+    A 'status' event is sent for the current state and each change, and a
+    final 'result' event with the finished job, after which the stream ends.
+    """
+    job = _get_job(job_id, current_user)
+
+    async def events():
+        current = job
+        while True:
+            if current is None:
+                yield _event("error", {"detail": "Job expired"})
+                return
+            if current["status"] in FINISHED:
+                yield _event("result", public_view(current))
+                return
+            yield _event("status", {"job_id": job_id, "status": current["status"]})
+            status = current["status"]
+            while current is not None and current["status"] == status:
+                current = await query_jobs.wait_for_change(job_id, status, QUERY_JOB_SSE_KEEPALIVE_SECONDS)
+                if current is not None and current["status"] == status:
+                    yield ": keep-alive\n\n"
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        # Proxies must not buffer the stream
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
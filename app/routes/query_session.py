@@ -0,0 +1,76 @@
+import time
+from typing import Optional
+
+from fastapi import APIRouter, WebSocket, WebSocketDisconnect
+from fastapi.encoders import jsonable_encoder
+
+from app.auth.auth import get_optional_current_user
+from app.db.targets import UnknownTargetError
+from app.services.provider_gateway import ProviderOverloadedError
+from app.services.query_history import build_history_record, query_history
+from app.services.query_session import UnknownSessionError, query_sessions
+
+router = APIRouter()
+
+
+@router.websocket("/session")
+async def query_session(websocket: WebSocket, session_id: Optional[str] = None, token: Optional[str] = None):
+    """
+    Conversational querying over a WebSocket
+
+    Connect with an optional ?token=<access token> (browsers cannot send an
+    Authorization header on WebSockets) and ?session_id= to resume a
+    session. The server first sends {"type": "session", "session_id": ...}.
+    Each client message {"question", "model", "target"?, "new_topic"?} is
+    answered with {"type": "result", "data": ...} or {"type": "error",
+    "detail": ...}; unless new_topic is true, follow-ups filter, sort or
+    aggregate the previous result in memory when they can, and refine the
+    previous SQL otherwise. {"type": "history"} returns the session's
+    recent turns.
+    """
+    current_user = await get_optional_current_user(token)
+    user_id = str(current_user.id) if current_user else None
+    await websocket.accept()
+    opened = query_sessions.open(session_id, user_id)
+    if opened is None:
+        await websocket.send_json({"type": "error", "detail": "Session not found or expired"})
+        await websocket.close(code=4404)
+        return
+    session_id = opened
+    await websocket.send_json({"type": "session", "session_id": session_id})
+
+    try:
+        while True:
+            message = await websocket.receive_json()
+            if message.get("type") == "history":
+                await websocket.send_json({"type": "history", "turns": query_sessions.history(session_id)})
+                continue
+            if not message.get("question") or not message.get("model"):
+                await websocket.send_json({"type": "error", "detail": "question and model are required"})
+                continue
+
+            start = time.monotonic()
+            try:
+                result = await query_sessions.ask(
+                    session_id, message["question"], message["model"], message.get("target"),
+                    bool(message.get("new_topic")),
+                )
+            except (ProviderOverloadedError, UnknownTargetError) as e:
+                query_history.record(build_history_record(
+                    message["question"], message["model"], None, user_id, (time.monotonic() - start) * 1000,
+                    error=str(e),
+                ))
+                await websocket.send_json({"type": "error", "detail": str(e)})
+                continue
+            except UnknownSessionError:
+                # Idle past QUERY_SESSION_IDLE_SECONDS while connected
+                await websocket.send_json({"type": "error", "detail": "Session expired"})
+                await websocket.close(code=4404)
+                return
+            query_history.record(build_history_record(
+                message["question"], message["model"], result, user_id, (time.monotonic() - start) * 1000
+            ))
+            await websocket.send_json(jsonable_encoder({"type": "result", "data": result}))
+    except WebSocketDisconnect:
+        # The session stays resumable until it has been idle for QUERY_SESSION_IDLE_SECONDS
+        pass
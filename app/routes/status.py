@@ -0,0 +1,60 @@
+from fastapi import APIRouter
+
+from app.auth.auth import password_hashing_stats
+from app.db.targets import targets
+from app.rag.embedding_service import embedding_stats
+from app.services.circuit_breaker import breaker_states
+from app.services.provider_gateway import gateway
+from app.services.query_history import query_history
+from app.services.query_jobs import query_jobs
+from app.services.query_session import query_sessions
+from app.services.shared_cache import shared_cache
+
+router = APIRouter()
+
+@router.get("/breakers")
+async def get_breaker_status():
+    """Circuit breaker state for each SQL generator"""
+    return breaker_states()
+
+@router.get("/providers")
+async def get_provider_status():
+    """In-flight and queued LLM calls per provider and model"""
+    return gateway.stats()
+
+@router.get("/password-hashing")
+async def get_password_hashing_status():
+    """Password hashing pool size and queue times"""
+    return password_hashing_stats()
+
+@router.get("/query-history")
+async def get_query_history_status():
+    """Buffered, written and dropped query history records"""
+    return query_history.stats()
+
+@router.get("/query-jobs")
+async def get_query_job_status():
+    """Queue depth, running jobs and queue wait / run time percentiles of this worker"""
+    return query_jobs.stats()
+
+@router.get("/query-sessions")
+async def get_query_session_status():
+    """Open conversational sessions and how many turns were answered by refining the previous SQL"""
+    return query_sessions.stats()
+
+@router.get("/embeddings")
+async def get_embedding_status():
+    """Embedding cache hit rate and batching per embedding model"""
+    return embedding_stats()
+
+@router.get("/targets")
+async def get_target_status():
+    """Open database targets: pool connections, cached objects and estimated memory"""
+    return targets.stats()
+
+@router.get("/shared-cache")
+async def get_shared_cache_status():
+    """Entries and bytes in the cross-worker cache, and this worker's hit rate"""
+    if shared_cache is None:
+        return {"enabled": False}
+    return {"enabled": True, **shared_cache.stats()}
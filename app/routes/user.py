@@ -1,56 +1,67 @@
-from fastapi import APIRouter, HTTPException, Depends, status
+from fastapi import APIRouter, HTTPException, Depends, Query, Response, status
 from fastapi.security import OAuth2PasswordRequestForm
 from bson import ObjectId
+from cachetools import TTLCache
+from pymongo.errors import DuplicateKeyError
 from datetime import datetime
-from typing import List
+from typing import List, Optional
+import base64
+import json
+import os
 
 from app.db.mongo_db_connection import get_database
 from app.model.user import UserCreate, UserResponse, UserInDB, Token, UserUpdate, UserLogin, LoginResponse
 from app.auth.auth import (
-    get_password_hash, 
-    verify_password, 
+    hash_password,
+    verify_and_update_password,
     create_access_token,
-    get_current_user
+    get_current_user,
+    cache_user,
+    invalidate_cached_user,
+    user_token_claims
 )
 
 router = APIRouter()
 
+# Fields needed to build a UserResponse
+USER_RESPONSE_PROJECTION = {"username": 1, "email": 1, "created_at": 1}
+
+# Estimated user count, refreshed at most every USER_COUNT_CACHE_TTL_SECONDS
+USER_COUNT_CACHE_TTL_SECONDS = int(os.getenv("USER_COUNT_CACHE_TTL_SECONDS", "60"))
+_user_count_cache = TTLCache(maxsize=1, ttl=USER_COUNT_CACHE_TTL_SECONDS)
+
 @router.post("/register", response_model=UserResponse, status_code=status.HTTP_201_CREATED)
 async def register_user(user: UserCreate):
     """Register a new user"""
     # Get database
     db = get_database()
     
-    # Check if username already exists
-    if await db.users.find_one({"username": user.username}):
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="Username already registered"
-        )
-    
-    # Check if email already exists
-    if await db.users.find_one({"email": user.email}):
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="Email already registered"
-        )
-    
     # Create user document
     now = datetime.utcnow()
     user_dict = UserInDB(
         username=user.username,
         email=user.email,
-        hashed_password=get_password_hash(user.password),
+        hashed_password=await hash_password(user.password),
         created_at=now,
         updated_at=now
-    )
+    ).dict(by_alias=True)
+    # The id serializer turns _id into a string; store it as an ObjectId so
+    # lookups by ObjectId(user_id) find the document
+    user_dict["_id"] = ObjectId(user_dict["_id"])
     
-    # Insert user into database
-    result = await db.users.insert_one(user_dict.dict(by_alias=True))
+    # Insert user into database; unique indexes reject taken usernames/emails
+    try:
+        await db.users.insert_one(user_dict)
+    except DuplicateKeyError as e:
+        key_pattern = (e.details or {}).get("keyPattern", {})
+        detail = "Username already registered" if "username" in key_pattern else "Email already registered"
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=detail
+        )
     
-    # Get created user
-    created_user = await db.users.find_one({"_id": result.inserted_id})
-    return UserResponse(**created_user)
+    # The inserted document is already in memory, no need to read it back
+    return UserResponse(**user_dict)
 
 
 @router.post("/login", response_model=LoginResponse)
@@ -59,22 +70,25 @@ async def login_user(user_data: UserLogin):
     # Get database
     db = get_database()
     
-    # Find user by email
-    user = await db.users.find_one({"email": user_data.email})
+    # Find user by email, fetching only the fields needed to log in
+    user = await db.users.find_one(
+        {"email": user_data.email},
+        {"username": 1, "email": 1, "created_at": 1, "hashed_password": 1}
+    )
     
     # Check if user exists and password is correct
-    if not user or not verify_password(user_data.password, user["hashed_password"]):
+    if user:
+        valid_password, new_hash = await verify_and_update_password(user_data.password, user["hashed_password"])
+    if not user or not valid_password:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect email or password",
             headers={"WWW-Authenticate": "Bearer"},
         )
     
-    # Generate access token
-    access_token = create_access_token(data={"sub": str(user["_id"])})
-    
-    # Create token object
-    token = Token(access_token=access_token, token_type="bearer")
+    # Transparently upgrade hashes made with an old work factor
+    if new_hash:
+        await db.users.update_one({"_id": user["_id"]}, {"$set": {"hashed_password": new_hash}})
     
     # Create user response without the hashed password
     user_response = UserResponse(
@@ -84,6 +98,12 @@ async def login_user(user_data: UserLogin):
         created_at=user["created_at"]
     )
     
+    # Generate access token
+    access_token = create_access_token(data=user_token_claims(user_response))
+    
+    # Create token object
+    token = Token(access_token=access_token, token_type="bearer")
+    
     # Return combined response
     return LoginResponse(user=user_response, token=token)
 
@@ -158,34 +178,96 @@ async def update_user_info(
     
     # Handle password update
     if "password" in update_data:
-        update_data["hashed_password"] = get_password_hash(update_data.pop("password"))
+        update_data["hashed_password"] = await hash_password(update_data.pop("password"))
     
     # Add updated_at timestamp
     update_data["updated_at"] = datetime.utcnow()
     
-    # Update user in database
-    await db.users.update_one(
-        {"_id": ObjectId(current_user.id)},
-        {"$set": update_data}
-    )
+    # Update user in database; unique indexes reject taken usernames/emails
+    try:
+        await db.users.update_one(
+            {"_id": ObjectId(current_user.id)},
+            {"$set": update_data}
+        )
+    except DuplicateKeyError as e:
+        key_pattern = (e.details or {}).get("keyPattern", {})
+        detail = "Username already registered" if "username" in key_pattern else "Email already registered"
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=detail
+        )
+    
+    invalidate_cached_user(current_user.id)
     
     # Get updated user
     updated_user = await db.users.find_one({"_id": ObjectId(current_user.id)})
     
-    return UserResponse(**updated_user)
+    updated_response = UserResponse(**updated_user)
+    cache_user(updated_response)
+    return updated_response
+
+def encode_user_cursor(user) -> str:
+    """Opaque next-page token pointing just after this user in (created_at, _id) order"""
+    position = {"c": user["created_at"].isoformat(), "i": str(user["_id"])}
+    return base64.urlsafe_b64encode(json.dumps(position).encode()).decode().rstrip("=")
+
+def decode_user_cursor(cursor: str) -> dict:
+    """Turn a next-page token back into a Mongo filter for the rest of the listing"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        position = json.loads(base64.urlsafe_b64decode(padded))
+        created_at = datetime.fromisoformat(position["c"])
+        user_id = ObjectId(position["i"])
+    except Exception:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid cursor"
+        )
+    return {"$or": [
+        {"created_at": {"$gt": created_at}},
+        {"created_at": created_at, "_id": {"$gt": user_id}},
+    ]}
+
+async def estimated_user_count(db) -> int:
+    """Collection-metadata count of users, cached for USER_COUNT_CACHE_TTL_SECONDS"""
+    if "users" not in _user_count_cache:
+        _user_count_cache["users"] = await db.users.estimated_document_count()
+    return _user_count_cache["users"]
 
 @router.get("/", response_model=List[UserResponse])
 async def get_users(
-    skip: int = 0, 
-    limit: int = 10,
+    response: Response,
+    cursor: Optional[str] = None,
+    limit: int = Query(10, ge=1, le=100),
+    include_total: bool = False,
+    skip: int = Query(0, ge=0, deprecated=True),
     current_user: UserResponse = Depends(get_current_user)
 ):
-    """Get list of users (requires authentication)"""
+    """
+    Get list of users (requires authentication)
+
+    Pages are fetched by position (keyset pagination), so every page costs
+    the same. Pass the X-Next-Cursor response header back as `cursor` to get
+    the next page; it is absent on the last page. With include_total, an
+    estimated total is returned in X-Total-Count.
+    """
     # Get database
     db = get_database()
     
-    # Get users from database
-    users = await db.users.find().skip(skip).limit(limit).to_list(length=limit)
+    query = decode_user_cursor(cursor) if cursor else {}
+    
+    # Get users from database, fetching only the fields in the response
+    users_cursor = db.users.find(query, USER_RESPONSE_PROJECTION).sort([("created_at", 1), ("_id", 1)])
+    if skip and not cursor:
+        users_cursor = users_cursor.skip(skip)
+    # One extra document tells us whether there is a next page
+    users = await users_cursor.limit(limit + 1).to_list(length=limit + 1)
+    
+    if len(users) > limit:
+        users = users[:limit]
+        response.headers["X-Next-Cursor"] = encode_user_cursor(users[-1])
+    if include_total:
+        response.headers["X-Total-Count"] = str(await estimated_user_count(db))
     
     return [UserResponse(**user) for user in users]
 
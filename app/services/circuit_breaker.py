@@ -0,0 +1,138 @@
+import os
+import threading
+import time
+from collections import deque
+from typing import Any, Dict, Optional
+
+from dotenv import load_dotenv
+
+from app.services.provider_gateway import parse_env_mapping
+
+# Load environment variables
+load_dotenv()
+
+# Breaker settings (all overridable through the environment)
+WINDOW_SECONDS = float(os.getenv("BREAKER_WINDOW_SECONDS", "60"))
+MIN_CALLS = int(os.getenv("BREAKER_MIN_CALLS", "5"))
+ERROR_RATE_THRESHOLD = float(os.getenv("BREAKER_ERROR_RATE", "0.5"))
+SLOW_RATE_THRESHOLD = float(os.getenv("BREAKER_SLOW_RATE", "0.5"))
+DEFAULT_SLOW_CALL_SECONDS = float(os.getenv("BREAKER_SLOW_CALL_SECONDS_DEFAULT", "20"))
+SLOW_CALL_SECONDS = parse_env_mapping(os.getenv("BREAKER_SLOW_CALL_SECONDS", "langchain=40,agent=90"), float)
+OPEN_SECONDS = float(os.getenv("BREAKER_OPEN_SECONDS", "30"))
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    """
+    Rolling-window circuit breaker for one SQL generator.
+
+    The circuit opens when, over the last WINDOW_SECONDS and at least
+    MIN_CALLS calls, either the error rate or the slow-call rate crosses its
+    threshold. After OPEN_SECONDS a single probe call is let through
+    (half-open); its outcome closes or re-opens the circuit.
+    """
+
+    def __init__(self, name: str, slow_call_seconds: Optional[float] = None):
+        self.name = name
+        self.slow_call_seconds = slow_call_seconds or DEFAULT_SLOW_CALL_SECONDS
+        self.state = CLOSED
+        self.opened_at = None
+        self.probe_in_flight = False
+        # (timestamp, failed, slow) per call
+        self.calls = deque()
+        self._lock = threading.Lock()
+
+    def _trim(self, now: float):
+        while self.calls and self.calls[0][0] < now - WINDOW_SECONDS:
+            self.calls.popleft()
+
+    def _rates(self):
+        total = len(self.calls)
+        if not total:
+            return 0.0, 0.0
+        failed = sum(1 for _, is_failed, _ in self.calls if is_failed)
+        slow = sum(1 for _, _, is_slow in self.calls if is_slow)
+        return failed / total, slow / total
+
+    def allow_request(self) -> bool:
+        """Return True if a call may go to this generator right now"""
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN and time.monotonic() - self.opened_at >= OPEN_SECONDS:
+                self.state = HALF_OPEN
+            if self.state == HALF_OPEN and not self.probe_in_flight:
+                self.probe_in_flight = True
+                return True
+            return False
+
+    def record(self, failed: bool, latency: float):
+        """Record the outcome of a call that allow_request() admitted"""
+        now = time.monotonic()
+        slow = latency >= self.slow_call_seconds
+        with self._lock:
+            if self.state == HALF_OPEN:
+                self.probe_in_flight = False
+                if failed or slow:
+                    self._open(now)
+                else:
+                    self.state = CLOSED
+                    self.calls.clear()
+                return
+
+            self.calls.append((now, failed, slow))
+            self._trim(now)
+            if self.state == CLOSED and len(self.calls) >= MIN_CALLS:
+                error_rate, slow_rate = self._rates()
+                if error_rate >= ERROR_RATE_THRESHOLD or slow_rate >= SLOW_RATE_THRESHOLD:
+                    self._open(now)
+
+    def cancel(self):
+        """
+        Give back a call that allow_request() admitted but that never finished
+        (e.g. the request was cancelled): it is not counted, and a half-open
+        probe slot is freed for the next request
+        """
+        with self._lock:
+            if self.state == HALF_OPEN:
+                self.probe_in_flight = False
+
+    def _open(self, now: float):
+        self.state = OPEN
+        self.opened_at = now
+        self.calls.clear()
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Current state and rolling rates, for the status endpoint"""
+        with self._lock:
+            self._trim(time.monotonic())
+            error_rate, slow_rate = self._rates()
+            retry_in = None
+            if self.state == OPEN:
+                retry_in = max(OPEN_SECONDS - (time.monotonic() - self.opened_at), 0)
+            return {
+                "state": self.state,
+                "calls": len(self.calls),
+                "error_rate": round(error_rate, 3),
+                "slow_rate": round(slow_rate, 3),
+                "slow_call_seconds": self.slow_call_seconds,
+                "half_open_in_seconds": retry_in,
+            }
+
+
+_breakers: Dict[str, CircuitBreaker] = {}
+
+
+def get_breaker(name: str) -> CircuitBreaker:
+    """Get (or lazily create) the breaker for a generator"""
+    if name not in _breakers:
+        _breakers[name] = CircuitBreaker(name, SLOW_CALL_SECONDS.get(name))
+    return _breakers[name]
+
+
+def breaker_states() -> Dict[str, Dict[str, Any]]:
+    """Snapshot of every breaker"""
+    return {name: breaker.snapshot() for name, breaker in _breakers.items()}
@@ -1,22 +1,40 @@
-from psycopg2 import Error
+import os
+
+from dotenv import load_dotenv
+from psycopg2 import Error, OperationalError
 from ..db.db_connection import get_connection, close_connection
 
-def execute_query(validated_sql):
+# Load environment variables
+load_dotenv()
+
+# Longest a read-only (validated) query may run on the server
+QUERY_STATEMENT_TIMEOUT_MS = int(os.getenv("QUERY_STATEMENT_TIMEOUT_MS", "30000"))
+
+# libpq options for connections made outside the pools (SQLAlchemy engines of the
+# LangChain pipelines): every transaction is read-only and bounded like execute_query's
+READ_ONLY_SESSION_OPTIONS = f"-c default_transaction_read_only=on -c statement_timeout={QUERY_STATEMENT_TIMEOUT_MS}"
+
+def execute_query(validated_sql, target=None, read_only=False, retry=True):
     """
     Executes a validated SQL query and returns the result.
     
     Args:
         validated_sql (str): A validated SQL query to execute
+        target (str): Database target to run it on (defaults to the DB_NAME database)
+        read_only (bool): The statement is known not to write, so it may run on a replica;
+            it runs in a read-only transaction with QUERY_STATEMENT_TIMEOUT_MS
+        retry (bool): Re-run a read-only statement once if its connection drops
         
     Returns:
         dict: A dictionary containing:
             - 'success' (bool): Whether the query executed successfully
-            - 'data' (list): The result rows if applicable (for SELECT queries)
+            - 'data' (list): The result rows if the statement returns rows
             - 'message' (str): Success or error message
-            - 'rowcount' (int): Number of affected rows for non-SELECT queries
+            - 'rowcount' (int): Number of affected rows for statements without a result set
     """
     connection = None
     cursor = None
+    connection_lost = False
     result = {
         'success': False,
         'data': None,
@@ -27,16 +45,20 @@ def execute_query(validated_sql):
     }
     
     try:
-        connection = get_connection()
+        connection = get_connection(target, read_only)
         if not connection:
             result['message'] = "Failed to connect to database"
             return result
             
         cursor = connection.cursor()
+        if read_only:
+            # The server enforces what the validator checked, and bounds the run time
+            cursor.execute("SET TRANSACTION READ ONLY")
+            cursor.execute("SET LOCAL statement_timeout = %s", (QUERY_STATEMENT_TIMEOUT_MS,))
         cursor.execute(validated_sql)
         
-        # Check if query is a SELECT statement
-        if validated_sql.strip().upper().startswith("SELECT"):
+        # Statements that return rows (SELECT, WITH, parenthesised UNION, ...) have a description
+        if cursor.description is not None:
             rows = cursor.fetchall()
             
             # Convert rows to dictionaries
@@ -44,6 +66,9 @@ def execute_query(validated_sql):
             result['data'] = [dict(zip(columns, row)) for row in rows]
             result['message'] = f"Query executed successfully. Returned {len(result['data'])} rows."
             result['rowcount'] = len(result['data'])
+            if read_only:
+                # Ends the read-only transaction before the connection goes back to the pool
+                connection.rollback()
         else:
             connection.commit()
             result['rowcount'] = cursor.rowcount
@@ -54,8 +79,9 @@ def execute_query(validated_sql):
     except Error as e:
         result['message'] = f"Error executing query: {e}"
         # Rollback transaction if error occurred
-        if connection:
+        if connection and not connection.closed:
             connection.rollback()
+        connection_lost = isinstance(e, OperationalError) and connection is not None and connection.closed
     
     finally:
         # Close cursor
@@ -63,5 +89,10 @@ def execute_query(validated_sql):
             cursor.close()
         # Close connection
         close_connection(connection)
+
+    if connection_lost and read_only and retry:
+        # The server went away (e.g. a replica restarted) and was marked
+        # unhealthy when the connection was returned, so this runs elsewhere
+        return execute_query(validated_sql, target, read_only, retry=False)
         
-    return result
\ No newline at end of file
+    return result
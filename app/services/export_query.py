@@ -0,0 +1,280 @@
+import logging
+import os
+import queue
+import threading
+
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+import pyarrow.parquet as pq
+from dotenv import load_dotenv
+
+from app.db.db_connection import get_connection, close_connection
+from app.services.sql_validator import format_errors, get_catalog, validate_sql
+
+# Load environment variables
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Longest an export query may run on the server
+EXPORT_STATEMENT_TIMEOUT_MS = int(os.getenv("EXPORT_STATEMENT_TIMEOUT_MS", "600000"))
+# Rows per Parquet row group
+EXPORT_PARQUET_ROW_GROUP_ROWS = int(os.getenv("EXPORT_PARQUET_ROW_GROUP_ROWS", "128000"))
+EXPORT_PARQUET_COMPRESSION = os.getenv("EXPORT_PARQUET_COMPRESSION", "zstd")
+# Bytes per chunk sent to the client (COPY writes one row at a time)
+EXPORT_CHUNK_BYTES = int(os.getenv("EXPORT_CHUNK_BYTES", str(256 * 1024)))
+# Chunks buffered between the database and the client; COPY pauses when full
+EXPORT_QUEUE_CHUNKS = int(os.getenv("EXPORT_QUEUE_CHUNKS", "16"))
+
+EXPORT_FORMATS = {
+    "csv": "text/csv",
+    "parquet": "application/vnd.apache.parquet",
+}
+
+
+class ExportError(Exception):
+    """Raised when a statement cannot be exported (rejected or fails to plan)"""
+
+
+def check_read_only_select(sql_query, target=None):
+    """
+    Check that a statement is a single read-only query over known tables
+
+    Uses the local SQL validator, so rejected statements never reach the
+    database. The export itself also runs in a read-only transaction.
+
+    Args:
+        sql_query: Statement to check
+        target: Database target whose catalog it is checked against
+
+    Returns:
+        str: The statement without code fences or a trailing semicolon
+
+    Raises:
+        ExportError: If the statement fails validation
+    """
+    validation = validate_sql(sql_query, get_catalog(target))
+    if not validation["valid"]:
+        raise ExportError("Invalid SQL statement:\n" + format_errors(validation["errors"]))
+    return validation["sql"]
+
+
+def _open_read_only_connection(target=None):
+    connection = get_connection(target, read_only=True)
+    if not connection:
+        raise ExportError("Failed to connect to database")
+    # Transaction-scoped, so the pooled connection is back to defaults after the rollback
+    with connection.cursor() as cursor:
+        cursor.execute("SET TRANSACTION READ ONLY")
+        cursor.execute("SET LOCAL statement_timeout = %s", (EXPORT_STATEMENT_TIMEOUT_MS,))
+    return connection
+
+
+def describe_query(sql_query, target=None):
+    """
+    Plan a statement without running it and return its result columns
+
+    Called before streaming starts so invalid SQL is reported as an error
+    response rather than a truncated download.
+
+    Returns:
+        list: (column name, type OID) per result column
+    """
+    connection = _open_read_only_connection(target)
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(f"SELECT * FROM ({sql_query}) AS export LIMIT 0")
+            return [(column.name, column.type_code) for column in cursor.description]
+    except Exception as e:
+        raise ExportError(f"Error preparing export: {e}")
+    finally:
+        connection.rollback()
+        close_connection(connection)
+
+
+# Marks the end of a successful export in the chunk queue
+_DONE = object()
+
+
+class _QueueWriter:
+    """File-like object collecting writes into EXPORT_CHUNK_BYTES chunks for the response generator"""
+
+    def __init__(self, chunks, cancelled):
+        self._chunks = chunks
+        self._cancelled = cancelled
+        self._buffer = bytearray()
+        self.closed = False
+
+    def _put(self, item):
+        # Give up (which aborts the COPY) once the client has gone away
+        while True:
+            if self._cancelled.is_set():
+                raise ExportError("Export cancelled")
+            try:
+                self._chunks.put(item, timeout=1)
+                return
+            except queue.Full:
+                continue
+
+    def write(self, data):
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        self._buffer += data
+        if len(self._buffer) >= EXPORT_CHUNK_BYTES:
+            self._put(bytes(self._buffer))
+            self._buffer.clear()
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def finish(self, result):
+        """Send what is left in the buffer, then the end marker or error"""
+        if self._buffer and result is _DONE:
+            self._put(bytes(self._buffer))
+        self._buffer.clear()
+        self._put(result)
+
+
+def _stream_from_thread(produce):
+    """
+    Run produce(writer) in a background thread and yield what it writes
+
+    The queue is bounded, so a slow client slows the producer down instead
+    of the export piling up in memory.
+    """
+    chunks = queue.Queue(EXPORT_QUEUE_CHUNKS)
+    cancelled = threading.Event()
+
+    def run():
+        writer = _QueueWriter(chunks, cancelled)
+        try:
+            produce(writer)
+            result = _DONE
+        except Exception as e:
+            if not cancelled.is_set():
+                logger.error("Export failed: %s", e)
+            result = e
+        try:
+            writer.finish(result)
+        except ExportError:
+            pass
+
+    thread = threading.Thread(target=run, name="query-export", daemon=True)
+    thread.start()
+    try:
+        while True:
+            chunk = chunks.get()
+            if chunk is _DONE:
+                break
+            if isinstance(chunk, Exception):
+                raise chunk
+            yield chunk
+    finally:
+        # Also reached when the client disconnects and the generator is closed
+        cancelled.set()
+
+
+def _copy_to(sql_query, writer, options, target=None):
+    connection = _open_read_only_connection(target)
+    try:
+        with connection.cursor() as cursor:
+            cursor.copy_expert(f"COPY ({sql_query}) TO STDOUT WITH ({options})", writer)
+    finally:
+        connection.rollback()
+        close_connection(connection)
+
+
+def stream_csv(sql_query, target=None):
+    """Yield the result of a statement as CSV (with header) straight from COPY TO STDOUT"""
+    return _stream_from_thread(lambda writer: _copy_to(sql_query, writer, "FORMAT csv, HEADER true", target))
+
+
+def _arrow_type(type_oid):
+    return {
+        16: pa.bool_(),
+        20: pa.int64(),
+        21: pa.int16(),
+        23: pa.int32(),
+        700: pa.float32(),
+        701: pa.float64(),
+        1700: pa.float64(),
+        1082: pa.date32(),
+        1114: pa.timestamp("us"),
+    }.get(type_oid, pa.string())
+
+
+def _unique_names(names):
+    seen = {}
+    unique = []
+    for name in names:
+        seen[name] = seen.get(name, 0) + 1
+        unique.append(name if seen[name] == 1 else f"{name}_{seen[name]}")
+    return unique
+
+
+def stream_parquet(sql_query, columns, target=None):
+    """
+    Yield the result of a statement as a Parquet file
+
+    COPY writes CSV into a pipe, pyarrow parses it in blocks into columnar
+    batches typed from the query's result columns, and the batches are
+    written out in row groups of EXPORT_PARQUET_ROW_GROUP_ROWS. No Python
+    object is created per row.
+
+    Args:
+        sql_query: Read-only statement
+        columns: Result columns as returned by describe_query()
+        target: Database target to run it on
+    """
+    names = _unique_names([name for name, _ in columns])
+    schema = pa.schema([(name, _arrow_type(type_oid)) for name, (_, type_oid) in zip(names, columns)])
+
+    def produce(writer):
+        read_fd, write_fd = os.pipe()
+        copy_errors = []
+
+        def copy():
+            with os.fdopen(write_fd, "wb") as pipe:
+                try:
+                    _copy_to(sql_query, pipe, "FORMAT csv", target)
+                except Exception as e:
+                    copy_errors.append(e)
+
+        copy_thread = threading.Thread(target=copy, name="query-export-copy", daemon=True)
+        copy_thread.start()
+        with os.fdopen(read_fd, "rb") as pipe, \
+                pq.ParquetWriter(pa.PythonFile(writer, mode="w"), schema,
+                                 compression=EXPORT_PARQUET_COMPRESSION) as parquet:
+            # No rows: COPY writes nothing, which open_csv rejects; the file is just the schema
+            if not pipe.peek(1):
+                parquet.write_table(schema.empty_table())
+                reader = ()
+            else:
+                reader = pa_csv.open_csv(
+                    pipe,
+                    read_options=pa_csv.ReadOptions(column_names=names, block_size=1 << 20),
+                    convert_options=pa_csv.ConvertOptions(
+                        column_types=schema,
+                        true_values=["t"],
+                        false_values=["f"],
+                        # COPY writes NULL unquoted and empty strings quoted
+                        strings_can_be_null=True,
+                        quoted_strings_can_be_null=False,
+                    ),
+                )
+            pending, pending_rows = [], 0
+            for batch in reader:
+                pending.append(batch)
+                pending_rows += batch.num_rows
+                if pending_rows >= EXPORT_PARQUET_ROW_GROUP_ROWS:
+                    parquet.write_table(pa.Table.from_batches(pending, schema),
+                                        row_group_size=EXPORT_PARQUET_ROW_GROUP_ROWS)
+                    pending, pending_rows = [], 0
+            if pending:
+                parquet.write_table(pa.Table.from_batches(pending, schema))
+        copy_thread.join()
+        if copy_errors:
+            raise copy_errors[0]
+
+    return _stream_from_thread(produce)
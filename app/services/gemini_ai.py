@@ -2,18 +2,26 @@ from google import genai
 from google.genai import types
 
 from dotenv import load_dotenv
+import logging
 import os
 load_dotenv()
 
+from app.services.provider_gateway import gateway, ProviderOverloadedError
+
 api_key = os.getenv("GOOGLE_API_KEY")
 
 client = genai.Client(api_key=api_key)
 
+logger = logging.getLogger(__name__)
+
 async def generate_response(prompt):
 
     try:
-        response = client.models.generate_content(
-            model="models/gemini-2.5-flash-preview-04-17", 
+        response = await gateway.call(
+            "gemini",
+            "models/gemini-2.5-flash-preview-04-17",
+            client.models.generate_content,
+            model="models/gemini-2.5-flash-preview-04-17",
             contents=prompt,
             config=types.GenerateContentConfig(
                 # max_output_tokens=500,
@@ -22,9 +30,11 @@ async def generate_response(prompt):
             )
         )
         
-        print(response.text)     
+        logger.debug("Gemini response", extra={"response_text": response.text})
         return response.text
     
+    except ProviderOverloadedError:
+        raise
     except Exception as e:
         return {
             "error": str(e),
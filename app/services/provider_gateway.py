@@ -0,0 +1,293 @@
+import asyncio
+import email.utils
+import os
+import random
+import time
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, Optional
+
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+
+def parse_env_mapping(value: Optional[str], cast=int) -> Dict[str, Any]:
+    """
+    Parse a "key=value,key=value" environment setting into a dict.
+
+    Args:
+        value: Raw setting, e.g. "gemini=8,openai=4"
+        cast: Callable used to convert each value
+
+    Returns:
+        dict: Parsed mapping (empty if the setting is missing)
+    """
+    mapping = {}
+    for item in (value or "").split(","):
+        if "=" not in item:
+            continue
+        key, raw = item.split("=", 1)
+        mapping[key.strip()] = cast(raw.strip())
+    return mapping
+
+
+# Gateway settings (all overridable through the environment)
+DEFAULT_MAX_IN_FLIGHT = int(os.getenv("LLM_MAX_IN_FLIGHT_DEFAULT", "8"))
+PROVIDER_MAX_IN_FLIGHT = parse_env_mapping(os.getenv("LLM_MAX_IN_FLIGHT", "gemini=8,openai=8,replicate=4"))
+MODEL_MAX_IN_FLIGHT = parse_env_mapping(os.getenv("LLM_MODEL_MAX_IN_FLIGHT"))
+MAX_QUEUE = int(os.getenv("LLM_MAX_QUEUE", "32"))
+QUEUE_TIMEOUT_SECONDS = float(os.getenv("LLM_QUEUE_TIMEOUT_SECONDS", "10"))
+PROVIDER_RATE_PER_SECOND = parse_env_mapping(os.getenv("LLM_RATE_PER_SECOND", "gemini=5,openai=5,replicate=2"), float)
+PROVIDER_BURST = parse_env_mapping(os.getenv("LLM_BURST"), float)
+MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "3"))
+RETRY_BASE_SECONDS = float(os.getenv("LLM_RETRY_BASE_SECONDS", "0.5"))
+RETRY_MAX_SECONDS = float(os.getenv("LLM_RETRY_MAX_SECONDS", "20"))
+
+# Provider status codes that are worth retrying
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+class ProviderOverloadedError(Exception):
+    """
+    Raised when an LLM call is shed instead of being sent to the provider.
+
+    Carries the HTTP status code and Retry-After hint that should be
+    returned to our own client.
+    """
+
+    def __init__(self, message: str, status_code: int = 503, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """Async token bucket used to pace calls to a provider."""
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity or max(rate, 1.0)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, deadline: float) -> bool:
+        """
+        Take one token, waiting until the deadline at the latest.
+
+        Args:
+            deadline: time.monotonic() value after which to give up
+
+        Returns:
+            bool: True if a token was taken, False if the deadline would be missed
+        """
+        async with self._lock:
+            while True:
+                self._refill()
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return True
+                wait = (1 - self.tokens) / self.rate
+                if time.monotonic() + wait > deadline:
+                    return False
+                await asyncio.sleep(wait)
+
+
+class _Lane:
+    """Concurrency limit plus bounded wait queue for one provider or model."""
+
+    def __init__(self, name: str, limit: int):
+        self.name = name
+        self.limit = limit
+        self.semaphore = asyncio.Semaphore(limit)
+        self.waiting = 0
+        self.in_flight = 0
+        self.rejected = 0
+
+    async def acquire(self, deadline: float):
+        if not self.semaphore.locked() and not self.waiting:
+            await self.semaphore.acquire()
+            self.in_flight += 1
+            return
+        if self.waiting >= MAX_QUEUE:
+            self.rejected += 1
+            raise ProviderOverloadedError(
+                f"Too many pending requests for {self.name}",
+                status_code=503,
+                retry_after=QUEUE_TIMEOUT_SECONDS,
+            )
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(self.semaphore.acquire(), timeout=max(deadline - time.monotonic(), 0))
+        except asyncio.TimeoutError:
+            self.rejected += 1
+            raise ProviderOverloadedError(
+                f"Timed out waiting for a free {self.name} slot",
+                status_code=503,
+                retry_after=QUEUE_TIMEOUT_SECONDS,
+            )
+        finally:
+            self.waiting -= 1
+        self.in_flight += 1
+
+    def release(self):
+        self.in_flight -= 1
+        self.semaphore.release()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "limit": self.limit,
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            "rejected": self.rejected,
+        }
+
+
+def _status_of(exc: Exception) -> Optional[int]:
+    """Best-effort extraction of the HTTP status code from a provider SDK error."""
+    for attr in ("status_code", "code", "status"):
+        value = getattr(exc, attr, None)
+        if isinstance(value, int):
+            return value
+    return None
+
+
+def _retry_after_of(exc: Exception) -> Optional[float]:
+    """Read the Retry-After header (seconds or HTTP date) from a provider SDK error."""
+    headers = getattr(getattr(exc, "response", None), "headers", None)
+    if not headers:
+        return None
+    value = headers.get("retry-after") or headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        retry_at = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max((retry_at - datetime.now(timezone.utc)).total_seconds(), 0.0)
+
+
+class ProviderGateway:
+    """
+    Single entry point for outbound LLM calls.
+
+    Direct generators send each SDK call through it. The RAG, LangChain and
+    agent pipelines go through it once per run, as their LangChain clients
+    make several provider calls per run. Building the RAG index outside a
+    request (preload_sql_generator) is not limited.
+
+    Applies, in order: a bounded wait queue with a deadline, a max-in-flight
+    limit per provider and per model, token-bucket pacing, and retries that
+    honour Retry-After with jittered exponential backoff.
+    """
+
+    def __init__(self):
+        self._providers: Dict[str, _Lane] = {}
+        self._models: Dict[str, _Lane] = {}
+        self._buckets: Dict[str, TokenBucket] = {}
+
+    def _provider_lane(self, provider: str) -> _Lane:
+        if provider not in self._providers:
+            limit = PROVIDER_MAX_IN_FLIGHT.get(provider, DEFAULT_MAX_IN_FLIGHT)
+            self._providers[provider] = _Lane(provider, limit)
+        return self._providers[provider]
+
+    def _model_lane(self, model: str) -> Optional[_Lane]:
+        if model not in MODEL_MAX_IN_FLIGHT:
+            return None
+        if model not in self._models:
+            self._models[model] = _Lane(model, MODEL_MAX_IN_FLIGHT[model])
+        return self._models[model]
+
+    def _bucket(self, provider: str) -> Optional[TokenBucket]:
+        if provider not in PROVIDER_RATE_PER_SECOND:
+            return None
+        if provider not in self._buckets:
+            self._buckets[provider] = TokenBucket(PROVIDER_RATE_PER_SECOND[provider], PROVIDER_BURST.get(provider))
+        return self._buckets[provider]
+
+    async def call(self, provider: str, model: str, func: Callable, *args, **kwargs):
+        """
+        Run a blocking provider SDK call under the gateway's limits.
+
+        The call itself runs in a worker thread so the event loop is never
+        blocked on the provider.
+
+        Args:
+            provider: Provider name ("gemini", "openai", "replicate")
+            model: Model identifier, used for per-model limits
+            func: Blocking SDK function to call
+            *args, **kwargs: Passed through to func
+
+        Returns:
+            Whatever func returns
+
+        Raises:
+            ProviderOverloadedError: If the call was shed or the provider kept throttling
+        """
+        deadline = time.monotonic() + QUEUE_TIMEOUT_SECONDS
+        provider_lane = self._provider_lane(provider)
+        model_lane = self._model_lane(model)
+
+        await provider_lane.acquire(deadline)
+        try:
+            if model_lane:
+                await model_lane.acquire(deadline)
+            try:
+                return await self._call_with_retries(provider, func, deadline, *args, **kwargs)
+            finally:
+                if model_lane:
+                    model_lane.release()
+        finally:
+            provider_lane.release()
+
+    async def _call_with_retries(self, provider: str, func: Callable, deadline: float, *args, **kwargs):
+        bucket = self._bucket(provider)
+        attempt = 0
+        while True:
+            if bucket and not await bucket.acquire(deadline):
+                raise ProviderOverloadedError(
+                    f"Rate limit for {provider} exceeded",
+                    status_code=429,
+                    retry_after=1 / bucket.rate,
+                )
+            try:
+                return await asyncio.to_thread(func, *args, **kwargs)
+            except Exception as e:
+                status_code = _status_of(e)
+                if status_code not in RETRYABLE_STATUS_CODES:
+                    raise
+                retry_after = _retry_after_of(e)
+                if attempt >= MAX_RETRIES or (retry_after or 0) > RETRY_MAX_SECONDS:
+                    raise ProviderOverloadedError(
+                        f"{provider} is throttling requests: {e}",
+                        status_code=429 if status_code == 429 else 503,
+                        retry_after=retry_after,
+                    ) from e
+                # Full jitter, but never sooner than the provider asked for
+                backoff = random.uniform(0, min(RETRY_MAX_SECONDS, RETRY_BASE_SECONDS * 2 ** attempt))
+                await asyncio.sleep(max(backoff, retry_after or 0))
+                attempt += 1
+                # Retries get a fresh pacing window; queue deadline no longer applies
+                deadline = time.monotonic() + QUEUE_TIMEOUT_SECONDS
+
+    def stats(self) -> Dict[str, Any]:
+        """Snapshot of per-provider and per-model lane usage."""
+        return {
+            "providers": {name: lane.stats() for name, lane in self._providers.items()},
+            "models": {name: lane.stats() for name, lane in self._models.items()},
+        }
+
+
+# Process-wide gateway instance
+gateway = ProviderGateway()
@@ -0,0 +1,176 @@
+import asyncio
+import hashlib
+import logging
+import os
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from dotenv import load_dotenv
+
+from app.db.mongo_db_connection import get_database
+
+# Load environment variables
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Flush when this many records are buffered...
+QUERY_HISTORY_BATCH_SIZE = int(os.getenv("QUERY_HISTORY_BATCH_SIZE", "100"))
+# ...or when the oldest buffered record is this old
+QUERY_HISTORY_FLUSH_SECONDS = float(os.getenv("QUERY_HISTORY_FLUSH_SECONDS", "2"))
+# Records beyond this are dropped (and counted) if MongoDB falls behind
+QUERY_HISTORY_MAX_BUFFER = int(os.getenv("QUERY_HISTORY_MAX_BUFFER", "10000"))
+
+
+def sql_fingerprint(sql_query: Optional[str]) -> Optional[str]:
+    """Hash of the whitespace/case-normalised SQL, used to group identical queries"""
+    if not sql_query or not isinstance(sql_query, str):
+        return None
+    normalised = " ".join(sql_query.split()).rstrip(";").lower()
+    return hashlib.sha1(normalised.encode("utf-8")).hexdigest()
+
+
+def build_history_record(prompt: str, model: str, result: Optional[Dict[str, Any]],
+                         user_id: Optional[str], total_ms: float, error: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Build the history document for one /query request
+
+    Result rows are not stored, only what is needed for audits and tuning.
+    """
+    result = result or {}
+    timings = dict(result.get("timings") or {})
+    timings["total_ms"] = round(total_ms, 1)
+    return {
+        "user_id": user_id,
+        "prompt": prompt,
+        "model": model,
+        "generator": result.get("generator"),
+        "target": result.get("target"),
+        "sql_query": result.get("sql_query"),
+        "sql_hash": sql_fingerprint(result.get("sql_query")),
+        "success": bool(result.get("success")) and error is None,
+        "message": error or result.get("message"),
+        "rowcount": result.get("rowcount", 0),
+        "timings": timings,
+        "created_at": datetime.utcnow(),
+    }
+
+
+class QueryHistoryWriter:
+    """
+    Write-behind buffer for query history records
+
+    record() only appends to an in-memory list; a background task writes the
+    buffer to MongoDB with insert_many when it reaches
+    QUERY_HISTORY_BATCH_SIZE records or every QUERY_HISTORY_FLUSH_SECONDS.
+    """
+
+    def __init__(self):
+        self._buffer: List[Dict[str, Any]] = []
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+        self.dropped = 0
+        self.written = 0
+
+    def record(self, entry: Dict[str, Any]):
+        """Queue a record for the next flush (never blocks or touches the database)"""
+        if len(self._buffer) >= QUERY_HISTORY_MAX_BUFFER:
+            self.dropped += 1
+            return
+        self._buffer.append(entry)
+        if len(self._buffer) >= QUERY_HISTORY_BATCH_SIZE:
+            self._wakeup.set()
+
+    async def flush(self):
+        """Write everything buffered so far, in batches"""
+        while self._buffer:
+            batch = self._buffer[:QUERY_HISTORY_BATCH_SIZE]
+            del self._buffer[:QUERY_HISTORY_BATCH_SIZE]
+            db = get_database()
+            if db is None:
+                self.dropped += len(batch)
+                continue
+            try:
+                await db.query_history.insert_many(batch, ordered=False)
+                self.written += len(batch)
+            except Exception as e:
+                self.dropped += len(batch)
+                logger.error("Error writing %d query history records: %s", len(batch), e)
+
+    async def _run(self):
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=QUERY_HISTORY_FLUSH_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    def start(self):
+        """Start the background flusher (call from application startup)"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop the flusher and write whatever is still buffered"""
+        if self._task is not None:
+            # Let a flush in progress finish its insert_many: cancelling it would lose the batch it took
+            self._stopping = True
+            self._wakeup.set()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+            self._stopping = False
+        await self.flush()
+
+    def stats(self) -> Dict[str, int]:
+        return {"buffered": len(self._buffer), "written": self.written, "dropped": self.dropped}
+
+
+# Process-wide writer
+query_history = QueryHistoryWriter()
+
+
+async def slowest_queries(user_id: str, limit: int = 10, since: Optional[datetime] = None) -> List[Dict[str, Any]]:
+    """A user's recorded requests with the highest total time"""
+    db = get_database()
+    query = {"user_id": user_id}
+    if since:
+        query["created_at"] = {"$gte": since}
+    cursor = db.query_history.find(query, {"_id": 0}).sort("timings.total_ms", -1).limit(limit)
+    return await cursor.to_list(length=limit)
+
+
+async def most_frequent_sql(user_id: str, limit: int = 10, since: Optional[datetime] = None) -> List[Dict[str, Any]]:
+    """SQL generated for a user, grouped by fingerprint, most frequent first"""
+    db = get_database()
+    match = {"user_id": user_id, "sql_hash": {"$ne": None}}
+    if since:
+        match["created_at"] = {"$gte": since}
+    pipeline = [
+        {"$match": match},
+        {"$group": {
+            "_id": "$sql_hash",
+            "sql_query": {"$first": "$sql_query"},
+            "count": {"$sum": 1},
+            "avg_total_ms": {"$avg": "$timings.total_ms"},
+            "max_total_ms": {"$max": "$timings.total_ms"},
+            "failures": {"$sum": {"$cond": ["$success", 0, 1]}},
+            "last_seen": {"$max": "$created_at"},
+        }},
+        {"$sort": {"count": -1}},
+        {"$limit": limit},
+        {"$project": {"_id": 0, "sql_hash": "$_id", "sql_query": 1, "count": 1, "avg_total_ms": 1,
+                      "max_total_ms": 1, "failures": 1, "last_seen": 1}},
+    ]
+    return await db.query_history.aggregate(pipeline).to_list(length=limit)
+
+
+async def user_history(user_id: str, limit: int = 20) -> List[Dict[str, Any]]:
+    """A user's most recent requests"""
+    db = get_database()
+    cursor = db.query_history.find({"user_id": user_id}, {"_id": 0}).sort("created_at", -1).limit(limit)
+    return await cursor.to_list(length=limit)
@@ -0,0 +1,319 @@
+import asyncio
+import logging
+import os
+import pickle
+import time
+import uuid
+from collections import deque
+from datetime import datetime
+from typing import Any, Dict, Optional
+
+from dotenv import load_dotenv
+
+from app.services.provider_gateway import ProviderOverloadedError
+from app.services.query_history import build_history_record, query_history
+from app.services.query_pipeline import run_query
+from app.services.shared_cache import result_key, shared_cache
+
+# Load environment variables
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Jobs run concurrently in this worker process
+QUERY_JOB_WORKERS = int(os.getenv("QUERY_JOB_WORKERS", "4"))
+# Submissions beyond this many waiting jobs are rejected with 429
+QUERY_JOB_MAX_QUEUE = int(os.getenv("QUERY_JOB_MAX_QUEUE", "100"))
+# How long a finished job's result can be fetched
+QUERY_JOB_RESULT_TTL_SECONDS = float(os.getenv("QUERY_JOB_RESULT_TTL_SECONDS", "600"))
+# Comment line sent on idle event streams so proxies keep them open
+QUERY_JOB_SSE_KEEPALIVE_SECONDS = float(os.getenv("QUERY_JOB_SSE_KEEPALIVE_SECONDS", "15"))
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+# Seen by other workers when a result could not be shared with them: submit the query again
+RESULT_UNAVAILABLE = "result_unavailable"
+FINISHED = (SUCCEEDED, FAILED, RESULT_UNAVAILABLE)
+
+# Wait and run times kept for the percentiles on the status endpoint
+_TIMING_SAMPLES = 1000
+
+
+def _percentile(samples, fraction):
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    return round(ordered[min(int(len(ordered) * fraction), len(ordered) - 1)], 1)
+
+
+def public_view(job: Dict[str, Any]) -> Dict[str, Any]:
+    """A job as returned to clients: without its owner, and with UTC ISO timestamps"""
+    view = {key: value for key, value in job.items() if key != "user_id"}
+    for key in ("submitted_at", "started_at", "finished_at"):
+        if view[key] is not None:
+            view[key] = datetime.utcfromtimestamp(view[key]).isoformat() + "Z"
+    return view
+
+
+def _unavailable(job):
+    """A finished job as reported by workers that cannot read its result"""
+    return {**job, "status": RESULT_UNAVAILABLE, "result": None,
+            "error": "The result is too large to share between server processes; submit the query again"}
+
+
+class QueryJobQueue:
+    """
+    Runs /query requests in the background for clients that should not hold a connection open
+
+    submit() stores the job and returns at once; QUERY_JOB_WORKERS tasks
+    take jobs off a bounded queue and run them through run_query, whose
+    provider calls and database work run in threads, so a running job
+    never blocks polls, event streams or /query in this process. Every
+    state change is written to the shared cache under result:<job id> with
+    QUERY_JOB_RESULT_TTL_SECONDS, so a poll that the load balancer sends to
+    another worker process still finds the job. Rows of a result too large
+    for one cache entry are written as pages of their own. If even those do
+    not fit (or a page has been evicted), other workers report the job as
+    result_unavailable rather than as succeeded without rows. Subscribers
+    in this process are woken on each change.
+    """
+
+    def __init__(self):
+        self._queue: Optional[asyncio.Queue] = None
+        self._workers = []
+        # Jobs submitted to this process: id -> job, and id -> event set on each change
+        self._jobs: Dict[str, Dict[str, Any]] = {}
+        self._changed: Dict[str, asyncio.Event] = {}
+        self._running = 0
+        self.submitted = 0
+        self.succeeded = 0
+        self.failed = 0
+        self.rejected = 0
+        self._wait_ms = deque(maxlen=_TIMING_SAMPLES)
+        self._run_ms = deque(maxlen=_TIMING_SAMPLES)
+
+    def _save(self, job):
+        self._jobs[job["id"]] = job
+        if shared_cache:
+            self._share(job)
+        # Waiters hold the previous event; later waiters get a fresh one
+        event = self._changed.get(job["id"])
+        self._changed[job["id"]] = asyncio.Event()
+        if event is not None:
+            event.set()
+
+    def _share(self, job):
+        """Write a job for the other workers, paging the rows of a result too large for one entry"""
+        key = result_key(job["id"])
+        if shared_cache.set(key, job, ttl=QUERY_JOB_RESULT_TTL_SECONDS):
+            return
+        result = job["result"] or {}
+        pages = self._share_pages(job["id"], result["data"]) if result.get("data") else None
+        if pages is not None and shared_cache.set(
+            key, {**job, "result": {**result, "data": None}, "result_pages": pages}, ttl=QUERY_JOB_RESULT_TTL_SECONDS,
+        ):
+            return
+        shared_cache.set(key, _unavailable(job), ttl=QUERY_JOB_RESULT_TTL_SECONDS)
+
+    @staticmethod
+    def _share_pages(job_id, rows):
+        """Write rows as pages of about half an entry each; the number of pages, or None if one did not fit"""
+        try:
+            size = len(pickle.dumps(rows, protocol=pickle.HIGHEST_PROTOCOL))
+        except (pickle.PicklingError, TypeError, AttributeError):
+            return None
+        rows_per_page = max(1, int(len(rows) * shared_cache.max_entry_bytes / 2 / size))
+        pages = 0
+        for start in range(0, len(rows), rows_per_page):
+            if not shared_cache.set(result_key(f"{job_id}:{pages}"), rows[start:start + rows_per_page],
+                                    ttl=QUERY_JOB_RESULT_TTL_SECONDS):
+                return None
+            pages += 1
+        return pages
+
+    @staticmethod
+    def _join_pages(job):
+        """A paged job from the shared cache with its rows put back"""
+        job = dict(job)
+        pages = job.pop("result_pages")
+        rows = []
+        for page in range(pages):
+            chunk = shared_cache.get(result_key(f"{job['id']}:{page}"))
+            if chunk is None:
+                # Evicted under memory pressure before the job's TTL
+                return _unavailable(job)
+            rows.extend(chunk)
+        return {**job, "result": {**job["result"], "data": rows}}
+
+    def _expire(self):
+        """Forget finished jobs whose result has outlived its TTL"""
+        cutoff = time.time() - QUERY_JOB_RESULT_TTL_SECONDS
+        for job_id in [job_id for job_id, job in self._jobs.items()
+                       if job["status"] in FINISHED and job["finished_at"] < cutoff]:
+            del self._jobs[job_id]
+            self._changed.pop(job_id, None)
+
+    def submit(self, prompt: str, model: str, target: Optional[str] = None,
+               user_id: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Queue a query
+
+        Returns:
+            dict: The queued job
+
+        Raises:
+            ProviderOverloadedError: With status 429 if the queue is full
+        """
+        if self._queue is None:
+            raise RuntimeError("Query job queue is not started")
+        if self._queue.qsize() >= QUERY_JOB_MAX_QUEUE:
+            self.rejected += 1
+            # Roughly when a slot frees up, from the recent run times
+            run_seconds = (_percentile(self._run_ms, 0.5) or 1000) / 1000
+            raise ProviderOverloadedError(
+                "Too many queued query jobs, try again later", status_code=429,
+                retry_after=run_seconds * self._queue.qsize() / max(QUERY_JOB_WORKERS, 1),
+            )
+        self._expire()
+        job = {
+            "id": uuid.uuid4().hex,
+            "status": QUEUED,
+            "prompt": prompt,
+            "model": model,
+            "target": target,
+            "user_id": user_id,
+            "submitted_at": time.time(),
+            "started_at": None,
+            "finished_at": None,
+            "queue_ms": None,
+            "run_ms": None,
+            "result": None,
+            "error": None,
+        }
+        self._save(job)
+        self._queue.put_nowait(job["id"])
+        self.submitted += 1
+        return job
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """A job submitted to any worker process, or None if unknown or expired"""
+        job = self._jobs.get(job_id)
+        if job is None and shared_cache:
+            job = shared_cache.get(result_key(job_id))
+            if job is not None and "result_pages" in job:
+                job = self._join_pages(job)
+        return job
+
+    async def wait_for_change(self, job_id: str, status: str, timeout: float) -> Optional[Dict[str, Any]]:
+        """
+        Wait up to timeout seconds for a job to leave the given status
+
+        Jobs of this process wake the caller on the change; jobs of another
+        worker are re-read from the shared cache once a second.
+        """
+        event = self._changed.get(job_id)
+        job = self.get(job_id)
+        if job is None or job["status"] != status:
+            return job
+        if event is not None:
+            try:
+                await asyncio.wait_for(event.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        else:
+            await asyncio.sleep(min(timeout, 1.0))
+        return self.get(job_id)
+
+    async def _run_job(self, job):
+        started = time.time()
+        job = {**job, "status": RUNNING, "started_at": started,
+               "queue_ms": round((started - job["submitted_at"]) * 1000, 1)}
+        self._wait_ms.append(job["queue_ms"])
+        self._save(job)
+
+        result, error = None, None
+        try:
+            result = await run_query(job["prompt"], job["model"], job["target"])
+        except Exception as e:
+            # Raised errors (overloaded generators, unknown targets) become the job's error
+            logger.warning("Query job %s failed: %s", job["id"], e)
+            error = str(e)
+
+        finished = time.time()
+        run_ms = (finished - started) * 1000
+        self._run_ms.append(run_ms)
+        query_history.record(build_history_record(
+            job["prompt"], job["model"], result, job["user_id"], (finished - job["submitted_at"]) * 1000, error=error,
+        ))
+        succeeded = error is None and bool(result.get("success"))
+        if succeeded:
+            self.succeeded += 1
+        else:
+            self.failed += 1
+        self._save({**job, "status": SUCCEEDED if succeeded else FAILED, "finished_at": finished,
+                    "run_ms": round(run_ms, 1), "result": result, "error": error})
+
+    async def _expire_periodically(self):
+        """Forget expired jobs even when nothing is being submitted"""
+        while True:
+            await asyncio.sleep(max(QUERY_JOB_RESULT_TTL_SECONDS / 10, 1))
+            self._expire()
+
+    async def _worker(self):
+        while True:
+            job_id = await self._queue.get()
+            job = self._jobs.get(job_id)
+            try:
+                if job is not None:
+                    self._running += 1
+                    try:
+                        await self._run_job(job)
+                    finally:
+                        self._running -= 1
+            except Exception as e:
+                logger.error("Query job worker error: %s", e)
+            finally:
+                self._queue.task_done()
+
+    def start(self):
+        """Start the workers (call from application startup)"""
+        if self._queue is None:
+            self._queue = asyncio.Queue()
+            self._workers = [asyncio.create_task(self._worker()) for _ in range(QUERY_JOB_WORKERS)]
+            self._workers.append(asyncio.create_task(self._expire_periodically()))
+
+    async def stop(self):
+        """Stop the workers; jobs still queued or running are marked failed"""
+        for worker in self._workers:
+            worker.cancel()
+        for worker in self._workers:
+            try:
+                await worker
+            except asyncio.CancelledError:
+                pass
+        self._workers = []
+        self._queue = None
+        for job in list(self._jobs.values()):
+            if job["status"] not in FINISHED:
+                self._save({**job, "status": FAILED, "finished_at": time.time(), "error": "Server shut down"})
+
+    def stats(self) -> Dict[str, Any]:
+        """Queue depth, throughput and wait/run time percentiles of this worker process"""
+        return {
+            "workers": QUERY_JOB_WORKERS,
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "running": self._running,
+            "max_queue": QUERY_JOB_MAX_QUEUE,
+            "submitted": self.submitted,
+            "succeeded": self.succeeded,
+            "failed": self.failed,
+            "rejected": self.rejected,
+            "queue_wait_ms": {"p50": _percentile(self._wait_ms, 0.5), "p95": _percentile(self._wait_ms, 0.95)},
+            "run_ms": {"p50": _percentile(self._run_ms, 0.5), "p95": _percentile(self._run_ms, 0.95)},
+        }
+
+
+# Process-wide queue
+query_jobs = QueryJobQueue()
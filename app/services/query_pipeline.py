@@ -0,0 +1,348 @@
+import asyncio
+import functools
+import logging
+import os
+import time
+
+from dotenv import load_dotenv
+
+from app.services.sql_query_generation_llm import generate_sql_query_by_sqlCoder, generate_sql_query_by_gemini, generate_sql_query_by_openai
+from app.rag.generate_sql_query_by_rag import RAG_MODEL, generate_sql_query_by_rag
+from app.services.execute_query import execute_query
+from app.langchain.generate_and_execute_sql_query_by_langchain import (
+    LANGCHAIN_MODEL, generate_and_execute_sql_query_by_langchain,
+)
+from app.langchain.agent import AGENT_MODEL, generate_sql_query_and_execute_by_agent
+from app.services.circuit_breaker import get_breaker
+from app.services.provider_gateway import ProviderOverloadedError, gateway, parse_env_mapping
+from app.db.targets import get_target
+from app.services.shared_cache import (
+    SHARED_CACHE_RESULT_TTL_SECONDS, SHARED_CACHE_SQL_TTL_SECONDS, data_version, prompt_key, shared_cache, sql_key,
+)
+from app.services.sql_validator import format_errors, get_catalog, validate_sql
+from app.services.value_index import annotate_prompt
+
+# Load environment variables
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Generator to try next when a generator's circuit is open or its call fails
+GENERATOR_FALLBACKS = parse_env_mapping(
+    os.getenv(
+        "GENERATOR_FALLBACKS",
+        "sqlCoder=gemini,gemini=openAI,openAI=gemini,langchain=gemini,agent=openAI,rag=gemini",
+    ),
+    str,
+)
+# Extra generation attempts when the SQL fails local validation
+SQL_VALIDATION_RETRIES = int(os.getenv("SQL_VALIDATION_RETRIES", "1"))
+
+
+class GeneratorError(Exception):
+    """Raised when a generator fails to produce SQL (as opposed to the SQL failing to run)"""
+
+
+def _require_sql(sql_query):
+    """Generators return an error dict instead of SQL when the provider call fails"""
+    if isinstance(sql_query, dict):
+        raise GeneratorError(sql_query.get('error'))
+    return sql_query
+
+
+async def _generate_by_sqlcoder(prompt, target, schema=None):
+    return _require_sql(await generate_sql_query_by_sqlCoder(prompt, target, schema))
+
+async def _generate_by_gemini(prompt, target, schema=None):
+    return _require_sql(await generate_sql_query_by_gemini(prompt, target, schema))
+
+async def _generate_by_openai(prompt, target, schema=None):
+    return _require_sql(await generate_sql_query_by_openai(prompt, target, schema))
+
+# The RAG, LangChain and agent pipelines make their provider calls through
+# LangChain, so a whole run goes through the gateway as one call: it takes
+# one slot and one token of the provider. RAG errors propagate and are
+# retried by the gateway; the other two catch their own errors, so the
+# SDK's retries are kept for them.
+
+async def _generate_by_rag(prompt, target):
+    return _require_sql(await gateway.call("openai", RAG_MODEL, generate_sql_query_by_rag, prompt, target))
+
+async def _run_langchain(prompt, target):
+    result = await gateway.call(
+        "gemini", LANGCHAIN_MODEL, generate_and_execute_sql_query_by_langchain, prompt, target
+    )
+    # These pipelines report generation failures as an unsuccessful result without SQL
+    if not result['success'] and not result['sql_query']:
+        raise GeneratorError(result['message'])
+    return result
+
+async def _run_agent(prompt, target):
+    result = await gateway.call("openai", AGENT_MODEL, generate_sql_query_and_execute_by_agent, prompt, target)
+    if not result['success'] and not result['sql_query']:
+        raise GeneratorError(result['message'])
+    return result
+
+
+# Model name (as sent by the client) -> coroutine(prompt, target) returning SQL to execute
+SQL_GENERATORS = {
+    "sqlCoder": _generate_by_sqlcoder,
+    "gemini": _generate_by_gemini,
+    "openAI": _generate_by_openai,
+    "rag": _generate_by_rag,
+}
+
+# Model name -> coroutine that generates and executes in one go
+PIPELINES = {
+    "langchain": _run_langchain,
+    "agent": _run_agent,
+}
+
+GENERATORS = {**SQL_GENERATORS, **PIPELINES}
+
+# Generators that accept a replacement schema, used to refine previous SQL with a small prompt
+REFINERS = {
+    "sqlCoder": _generate_by_sqlcoder,
+    "gemini": _generate_by_gemini,
+    "openAI": _generate_by_openai,
+}
+
+# Create every breaker up front so the status endpoint lists them all
+for _name in GENERATORS:
+    get_breaker(_name)
+
+
+async def _generate_valid_sql(name, prompt, sql_query, target, generate):
+    """
+    Validate generated SQL, asking the same generator again with the errors if it is invalid
+
+    Returns:
+        tuple: (SQL, validation result) for the last attempt
+    """
+    # The first catalog of a target is read from the database
+    catalog = await asyncio.to_thread(get_catalog, target)
+    validation = validate_sql(sql_query, catalog)
+    for _ in range(SQL_VALIDATION_RETRIES):
+        if validation["valid"]:
+            break
+        logger.info(
+            "Generated SQL failed validation",
+            extra={"generator": name, "sql_query": sql_query, "validation_errors": validation["errors"]},
+        )
+        retry_prompt = (
+            f"{prompt}\n\nThis SQL query was rejected:\n{sql_query}\n"
+            f"Problems:\n{format_errors(validation['errors'])}\n"
+            "Write a corrected PostgreSQL SELECT query using only the tables and columns in the schema."
+        )
+        try:
+            sql_query = await generate(retry_prompt, target)
+        except Exception as e:
+            logger.warning("Generator %s failed to regenerate SQL: %s", name, e, extra={"generator": name})
+            break
+        validation = validate_sql(sql_query, catalog)
+    return sql_query, validation
+
+
+def _candidates(model, generators=GENERATORS):
+    """The requested generator followed by its fallback chain, without repeats, limited to generators"""
+    chain = []
+    while model in GENERATORS and model not in chain:
+        chain.append(model)
+        model = GENERATOR_FALLBACKS.get(model)
+    return [name for name in chain if name in generators]
+
+
+async def _serve(prompt, model, target, chain, generators):
+    """
+    Try each generator of the chain until one produces a result
+
+    Args:
+        generators: Generator name -> coroutine(prompt, target); SQL
+            generators return SQL, pipelines an execute_query-style result
+
+    Raises:
+        ProviderOverloadedError: If no generator in the chain could serve the request
+    """
+    version = await asyncio.to_thread(data_version, target) if shared_cache else None
+
+    last_error = None
+    for name in chain:
+        generate = generators[name]
+        cache = {}
+        start = time.monotonic()
+        cached_sql = None
+        if shared_cache and name not in PIPELINES:
+            cached_sql = shared_cache.get(prompt_key(prompt, name, target, version))
+            cache["sql"] = "hit" if cached_sql is not None else "miss"
+
+        if cached_sql is not None:
+            # Another request (possibly in another worker) already generated and validated it
+            output = cached_sql
+            generated = time.monotonic()
+        else:
+            breaker = get_breaker(name)
+            if not breaker.allow_request():
+                continue
+            # Only generation counts towards the breaker, not running the SQL
+            failed = None
+            try:
+                output = await generate(prompt, target)
+                failed = False
+            except Exception as e:
+                failed = True
+                logger.warning("Generator %s failed: %s", name, e, extra={"generator": name})
+                last_error = e
+                continue
+            finally:
+                generated = time.monotonic()
+                if failed is None:
+                    # Cancelled (client gone, shutdown): no outcome, but a half-open probe must be released
+                    breaker.cancel()
+                else:
+                    breaker.record(failed=failed, latency=generated - start)
+
+        if name not in PIPELINES:
+            if cached_sql is not None:
+                validation = {"valid": True, "sql": cached_sql, "errors": []}
+            else:
+                output, validation = await _generate_valid_sql(name, prompt, output, target, generate)
+                if shared_cache and validation["valid"]:
+                    shared_cache.set(
+                        prompt_key(prompt, name, target, version), validation["sql"], ttl=SHARED_CACHE_SQL_TTL_SECONDS
+                    )
+            validated = time.monotonic()
+            if validation["valid"]:
+                result = shared_cache.get(sql_key(validation["sql"], target, version)) if shared_cache else None
+                if shared_cache:
+                    cache["result"] = "hit" if result is not None else "miss"
+                if result is None:
+                    # Validated as a read-only SELECT, so a replica can serve it; psycopg2
+                    # blocks, so it runs in a thread to keep the event loop serving others
+                    result = await asyncio.to_thread(execute_query, validation["sql"], target, read_only=True)
+                    if shared_cache and result['success']:
+                        shared_cache.set(
+                            sql_key(validation["sql"], target, version), result, ttl=SHARED_CACHE_RESULT_TTL_SECONDS
+                        )
+            else:
+                # Invalid SQL never reaches the database
+                result = {
+                    'success': False,
+                    'data': None,
+                    'sql_query': output,
+                    'answer': '',
+                    'message': "Generated SQL failed validation:\n" + format_errors(validation["errors"]),
+                    'rowcount': 0,
+                    'validation_errors': validation["errors"],
+                }
+            timings = {
+                "generation_ms": round((generated - start) * 1000, 1),
+                "validation_ms": round((validated - generated) * 1000, 1),
+                "execution_ms": round((time.monotonic() - validated) * 1000, 1),
+            }
+        else:
+            # Pipelines generate and execute in one call
+            result = output
+            timings = {"pipeline_ms": round((generated - start) * 1000, 1)}
+        result['generator'] = name
+        result['target'] = target
+        result['timings'] = timings
+        if cache:
+            result['cache'] = cache
+        return result
+
+    if isinstance(last_error, ProviderOverloadedError):
+        raise last_error
+    raise ProviderOverloadedError(
+        f"No healthy SQL generator available for {model}: {last_error}" if last_error
+        else f"No healthy SQL generator available for {model}",
+        status_code=503,
+    )
+
+
+async def run_query(prompt, model, target=None):
+    """
+    Generate SQL for a prompt with the requested model and execute it.
+
+    Each generator sits behind a circuit breaker. If the requested
+    generator's circuit is open, or the call fails, the next generator in
+    its fallback chain is tried. Before generation, literal values the
+    question mentions are resolved against the value index and appended to
+    the prompt. SQL from the SQL generators is validated locally against the
+    schema catalog; invalid SQL is regenerated once with the errors and is
+    never executed. Validated SQL per (prompt, generator) and successful
+    results per statement are kept in the shared cache, so a question any
+    worker has answered skips generation, and a repeated statement skips
+    the database until its result expires.
+
+    Args:
+        prompt: Natural language question
+        model: Requested generator; unknown names use the RAG generator
+        target: Database target (study) to query; None for the default target
+
+    Returns:
+        dict: The execute_query-style result, plus 'generator' naming the
+        generator that actually served the request and 'timings' with the
+        milliseconds spent generating, validating and executing, and 'target'
+        naming the database target queried. Results rejected by validation
+        are unsuccessful and carry 'validation_errors'. With the shared
+        cache enabled, 'cache' says whether the SQL and the result were
+        cache hits.
+
+    Raises:
+        UnknownTargetError: If the target is not configured
+        ProviderOverloadedError: If no generator in the chain could serve the request
+    """
+    if model not in GENERATORS:
+        model = "rag"
+
+    target = get_target(target).name
+    # The first lookup of a target loads its value index from the database
+    prompt = await asyncio.to_thread(annotate_prompt, prompt, target)
+    return await _serve(prompt, model, target, _candidates(model), GENERATORS)
+
+
+def build_refinement_prompt(question, previous_question, previous_sql):
+    """Prompt asking for the previous query changed to answer a follow-up question"""
+    return (
+        f"Previous question: {previous_question}\n"
+        f"Previous SQL query: {previous_sql}\n"
+        f"Follow-up question: {question}\n"
+        "Modify the previous SQL query so it answers the follow-up question, keeping its filters, "
+        "joins and grouping unless the follow-up changes them."
+    )
+
+
+async def refine_query(question, previous_question, previous_sql, model, target=None):
+    """
+    Answer a follow-up question by modifying the SQL of the previous one
+
+    The prompt holds the previous question and SQL and describes only the
+    tables that SQL reads, instead of the whole schema, so it is a fraction
+    of the size of a fresh question's prompt. Only the generators that take
+    a schema (SQLCoder, Gemini, OpenAI) can refine; other models use the
+    first of these in their fallback chain. Validation, breakers, caching
+    and execution are the same as for run_query.
+
+    Returns:
+        dict: As for run_query, with 'refined' set to True
+
+    Raises:
+        UnknownTargetError: If the target is not configured
+        ProviderOverloadedError: If no generator in the chain could serve the request
+    """
+    if model not in GENERATORS:
+        model = "rag"
+    target = get_target(target)
+    catalog = await asyncio.to_thread(get_catalog, target.name)
+    tables = validate_sql(previous_sql, catalog)["tables"]
+    # None before the first profile: the generators then use the full fallback schema
+    schema = await asyncio.to_thread(target.schema_prompt, tables=tables) if tables else None
+    target = target.name
+
+    refiners = {name: functools.partial(refine, schema=schema) for name, refine in REFINERS.items()}
+    prompt = await asyncio.to_thread(
+        annotate_prompt, build_refinement_prompt(question, previous_question, previous_sql), target
+    )
+    result = await _serve(prompt, model, target, _candidates(model, refiners), refiners)
+    result['refined'] = True
+    return result
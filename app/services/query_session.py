@@ -0,0 +1,273 @@
+import logging
+import os
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+import pandas as pd
+from dotenv import load_dotenv
+from langchain_core.runnables import RunnableConfig
+from langgraph.checkpoint.memory import MemorySaver
+from langgraph.graph import START, StateGraph
+from typing_extensions import TypedDict
+
+from app.db.targets import get_target
+from app.services.query_pipeline import refine_query, run_query
+from app.services.result_refinement import apply_plan, describe_plan, plan_refinement, to_frame, to_records
+from app.services.shared_cache import SHARED_CACHE_RESULT_TTL_SECONDS, result_key, shared_cache
+
+# Load environment variables
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Sessions idle for longer than this are dropped with their checkpoints
+QUERY_SESSION_IDLE_SECONDS = float(os.getenv("QUERY_SESSION_IDLE_SECONDS", "1800"))
+# Turns kept in a session's history (only the last SQL is needed for refinement)
+QUERY_SESSION_MAX_TURNS = int(os.getenv("QUERY_SESSION_MAX_TURNS", "20"))
+# Larger results are not kept for in-memory refinement (follow-ups on them go to SQL)
+QUERY_SESSION_FRAME_MAX_ROWS = int(os.getenv("QUERY_SESSION_FRAME_MAX_ROWS", "100000"))
+# Rows kept for in-memory refinement across all sessions; the least recently used results go first
+QUERY_SESSION_MAX_KEPT_ROWS = int(os.getenv("QUERY_SESSION_MAX_KEPT_ROWS", "1000000"))
+
+
+class UnknownSessionError(Exception):
+    """Raised when a session id is unknown or the session has expired"""
+
+
+class SessionState(TypedDict, total=False):
+    # Input of a turn
+    question: str
+    model: str
+    target: Optional[str]
+    new_topic: bool
+    # Carried between turns
+    last_question: Optional[str]
+    last_sql: Optional[str]
+    last_result_key: Optional[str]
+    turns: List[Dict[str, Any]]
+
+
+async def answer(state: SessionState, config: RunnableConfig):
+    """
+    Run a question, as a refinement of the last successful result when there is one
+
+    A follow-up that only filters, sorts, limits, projects or aggregates
+    the previous result is answered from that result in memory; other
+    follow-ups refine the previous SQL. The result and the rows to refine
+    next go to config["configurable"]["output"], not into the state, so
+    rows are never written to the checkpoint.
+    """
+    session_id = config["configurable"]["thread_id"]
+    output = config["configurable"]["output"]
+    turns = state.get("turns") or []
+    target = get_target(state.get("target")).name
+    # Refining SQL of another study would read the wrong tables
+    same_target = bool(turns) and turns[-1]["target"] == target
+    refine = bool(state.get("last_sql")) and not state.get("new_topic") and same_target
+
+    result = None
+    frame = None
+    previous = config["configurable"].get("previous")
+    if refine and previous is not None:
+        start = time.monotonic()
+        frame = previous if isinstance(previous, pd.DataFrame) else to_frame(previous)
+        # Keep the converted frame even if this follow-up needs SQL
+        output["frame"] = frame
+        plan = plan_refinement(state["question"], frame)
+        if plan is not None:
+            frame = apply_plan(frame, plan)
+            data = to_records(frame)
+            description = describe_plan(plan)
+            result = {
+                'success': True,
+                'data': data,
+                'sql_query': state["last_sql"],
+                'answer': '',
+                'message': f"Refined the previous result in memory ({description}). Returned {len(data)} rows.",
+                'rowcount': len(data),
+                'generator': "result_refinement",
+                'target': target,
+                'timings': {"refinement_ms": round((time.monotonic() - start) * 1000, 1)},
+                'refined': True,
+                'refinement': description,
+            }
+        else:
+            frame = None
+    if result is None and refine:
+        result = await refine_query(state["question"], state["last_question"], state["last_sql"], state["model"], target)
+        if not result['success'] and result.get('validation_errors'):
+            # The follow-up needs more than the refined tables: ask it as a new question
+            logger.info("Refinement failed validation, running the follow-up as a new question",
+                        extra={"session_id": session_id})
+            result = None
+    if result is None:
+        result = await run_query(state["question"], state["model"], target)
+    result.setdefault('refined', False)
+    if frame is not None:
+        output["frame"] = frame
+    elif result['success'] and result.get('data') is not None:
+        # Converted to a frame only if a follow-up needs it
+        output["frame"] = result['data'] if len(result['data']) <= QUERY_SESSION_FRAME_MAX_ROWS else None
+
+    turn = len(turns) + 1
+    handle = None
+    if shared_cache and result['success']:
+        # Rows stay out of the checkpoint; the session keeps a handle to them
+        handle = result_key(f"session:{session_id}:{turn}")
+        if not shared_cache.set(handle, result, ttl=SHARED_CACHE_RESULT_TTL_SECONDS):
+            handle = None
+    result['result_key'] = handle
+
+    output["result"] = result
+    update = {
+        "turns": (turns + [{
+            "turn": turn,
+            "question": state["question"],
+            "target": result.get("target"),
+            "sql_query": result.get("sql_query"),
+            "success": result.get("success"),
+            "rowcount": result.get("rowcount"),
+            "refined": result["refined"],
+        }])[-QUERY_SESSION_MAX_TURNS:],
+    }
+    if result.get('refinement'):
+        # Same SQL, narrower question: a later SQL refinement should know both
+        update.update(last_question=f"{state['last_question']}; then: {state['question']}", last_result_key=handle)
+    elif result['success'] and result.get('sql_query'):
+        update.update(last_question=state["question"], last_sql=result['sql_query'], last_result_key=handle)
+    return update
+
+
+_graph_builder = StateGraph(SessionState)
+_graph_builder.add_node("answer", answer)
+_graph_builder.add_edge(START, "answer")
+
+
+class QuerySessions:
+    """
+    Conversational query sessions
+
+    Each session is a langgraph thread: the checkpointer keeps the last
+    question, the last SQL, a handle to the last result in the shared
+    cache and a short history between turns, so a follow-up is sent to the
+    LLM as a refinement of the previous SQL rather than as a new question.
+    Checkpoints are in memory, so a session lives in the worker process
+    that created it (WebSocket connections stay on one worker).
+
+    The session's last result is kept alongside, as rows until a follow-up
+    needs them and then as a pandas frame, for follow-ups that can be
+    answered without the LLM or the database. Kept results are bounded by
+    QUERY_SESSION_MAX_KEPT_ROWS over all sessions, least recently used
+    first out; a session whose result was dropped refines its SQL instead.
+    Idle sessions are expired whenever a session is opened or asked.
+    """
+
+    def __init__(self):
+        self.checkpointer = MemorySaver()
+        self.graph = _graph_builder.compile(checkpointer=self.checkpointer)
+        # Session id -> (owner user id, last used)
+        self._sessions: Dict[str, tuple] = {}
+        # Session id -> last result (rows or frame), least recently used first
+        self._results: "OrderedDict[str, Any]" = OrderedDict()
+        self.turns = 0
+        self.refined = 0
+        self.refined_in_memory = 0
+
+    def _expire(self):
+        cutoff = time.monotonic() - QUERY_SESSION_IDLE_SECONDS
+        for session_id in [session_id for session_id, (_, used) in self._sessions.items() if used < cutoff]:
+            self.close(session_id)
+
+    def _keep_result(self, session_id, result):
+        """Keep a session's last result (None drops it), evicting other sessions' results over the row budget"""
+        self._results.pop(session_id, None)
+        if result is None:
+            return
+        self._results[session_id] = result
+        kept_rows = sum(len(kept) for kept in self._results.values())
+        while kept_rows > QUERY_SESSION_MAX_KEPT_ROWS and len(self._results) > 1:
+            _, evicted = self._results.popitem(last=False)
+            kept_rows -= len(evicted)
+
+    def open(self, session_id: Optional[str] = None, user_id: Optional[str] = None) -> Optional[str]:
+        """
+        Start a session, or resume one of the same user by id
+
+        Returns:
+            str: The session id, or None if session_id is unknown, expired or another user's
+        """
+        self._expire()
+        if session_id is not None:
+            owner = self._sessions.get(session_id)
+            if owner is None or owner[0] != user_id:
+                return None
+        else:
+            session_id = uuid.uuid4().hex
+        self._sessions[session_id] = (user_id, time.monotonic())
+        return session_id
+
+    async def ask(self, session_id: str, question: str, model: str, target: Optional[str] = None,
+                  new_topic: bool = False) -> Dict[str, Any]:
+        """
+        Answer a question in a session
+
+        Returns:
+            dict: As for run_query, plus 'refined' (whether the previous
+            result or SQL was refined), 'refinement' (the in-memory
+            operations, when the previous result was refined without SQL),
+            'turn' and 'result_key' (shared cache key of the rows, None if
+            they were not cached)
+
+        Raises:
+            UnknownSessionError: If the session is unknown or has expired
+        """
+        self._expire()
+        if session_id not in self._sessions:
+            raise UnknownSessionError(f"Unknown or expired session '{session_id}'")
+        user_id, _ = self._sessions[session_id]
+        self._sessions[session_id] = (user_id, time.monotonic())
+        if session_id in self._results:
+            self._results.move_to_end(session_id)
+        output = {}
+        state = await self.graph.ainvoke(
+            {"question": question, "model": model, "target": target, "new_topic": new_topic},
+            config={"configurable": {"thread_id": session_id, "output": output,
+                                     "previous": self._results.get(session_id)}},
+        )
+        result = output["result"]
+        if "frame" in output:
+            self._keep_result(session_id, output["frame"])
+        result['turn'] = state["turns"][-1]["turn"]
+        self.turns += 1
+        if result['refined']:
+            self.refined += 1
+        if result.get('refinement'):
+            self.refined_in_memory += 1
+        return result
+
+    def history(self, session_id: str) -> List[Dict[str, Any]]:
+        """Questions and SQL of a session's recent turns"""
+        snapshot = self.graph.get_state({"configurable": {"thread_id": session_id}})
+        return snapshot.values.get("turns", []) if snapshot else []
+
+    def close(self, session_id: str):
+        """Drop a session and its checkpoints"""
+        self._sessions.pop(session_id, None)
+        self._results.pop(session_id, None)
+        self.checkpointer.delete_thread(session_id)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "sessions": len(self._sessions),
+            "turns": self.turns,
+            "refined": self.refined,
+            "refined_in_memory": self.refined_in_memory,
+            "results_kept": len(self._results),
+            "rows_kept": sum(len(result) for result in self._results.values()),
+        }
+
+
+# Process-wide sessions
+query_sessions = QuerySessions()
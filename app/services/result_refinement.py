@@ -0,0 +1,310 @@
+import re
+from decimal import Decimal
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+# Words that commonly stand for single-letter codes in the data (e.g. gender 'F'/'M')
+VALUE_SYNONYMS = {
+    "female": "F", "females": "F", "women": "F", "woman": "F",
+    "male": "M", "males": "M", "men": "M", "man": "M",
+}
+
+# Leading and trailing words that carry no meaning in a follow-up
+_LEADING_FILLER = re.compile(
+    r"^(?:(?:and|then|now|also|please|ok|okay|just|only|can you|could you|show me|show|give me|list|keep|filter(?: to)?|"
+    r"limit (?:it |them |that )?to|restrict (?:it |them )?to|of (?:these|those|them)|of the results?|the)\s+)+"
+)
+_TRAILING_FILLER = re.compile(r"(?:\s+(?:please|instead|only|too|ones|rows|results|records|entries|of them))+$")
+_CLAUSE_SPLIT = re.compile(r"\s*(?:,|;|\bthen\b|\band then\b|\band\b)\s*")
+
+_NUMBER = r"-?\d+(?:\.\d+)?"
+_DATE = r"\d{4}-\d{2}-\d{2}"
+_COMPARISONS = {
+    ">=": ">=", "<=": "<=", ">": ">", "<": "<", "=": "==",
+    "at least": ">=", "at most": "<=", "no more than": "<=", "no less than": ">=",
+    "greater than": ">", "more than": ">", "over": ">", "above": ">", "after": ">",
+    "less than": "<", "fewer than": "<", "under": "<", "below": "<", "before": "<",
+    "equal to": "==", "equals": "==", "is": "==",
+}
+_COMPARISON_PATTERN = "|".join(sorted((re.escape(word) for word in _COMPARISONS), key=len, reverse=True))
+_AGGREGATES = {
+    "average": "mean", "avg": "mean", "mean": "mean", "sum": "sum", "total": "sum",
+    "max": "max", "maximum": "max", "highest": "max", "min": "min", "minimum": "min", "lowest": "min",
+}
+_AGGREGATE_PATTERN = "|".join(sorted(_AGGREGATES, key=len, reverse=True))
+
+# Distinct values of a text column considered for value filters
+_MAX_DISTINCT_VALUES = 1000
+
+
+def to_frame(rows: List[Dict[str, Any]]) -> pd.DataFrame:
+    """Columnar frame of execute_query rows, with NUMERIC (Decimal) columns as floats"""
+    frame = pd.DataFrame.from_records(rows)
+    for column in frame.columns:
+        if frame[column].dtype == object:
+            present = frame[column].dropna()
+            if len(present) and isinstance(present.iloc[0], Decimal):
+                frame[column] = pd.to_numeric(frame[column], errors="coerce")
+    return frame
+
+
+def to_records(frame: pd.DataFrame) -> List[Dict[str, Any]]:
+    """Rows in the execute_query format: plain Python values, None for missing"""
+    frame = frame.astype(object).where(frame.notna(), None)
+    return frame.to_dict("records")
+
+
+def _words(text):
+    return text.replace("_", " ").lower().split()
+
+
+def _match_column(phrase, frame) -> Optional[str]:
+    """The column a phrase names: exactly, or the one column containing all its words"""
+    words = _words(phrase.strip())
+    if not words:
+        return None
+    for column in frame.columns:
+        if _words(str(column)) == words:
+            return column
+    containing = [column for column in frame.columns if all(word in _words(str(column)) for word in words)]
+    return containing[0] if len(containing) == 1 else None
+
+
+def _match_value(phrase, frame):
+    """
+    (column, value) for a phrase naming a value of one text column
+
+    Case-insensitive, tolerant of plurals ("severe ones", "nauseas") and of
+    the VALUE_SYNONYMS codes. A value found in more than one column is
+    ambiguous and not matched.
+    """
+    phrase = " ".join(phrase.lower().split())
+    candidates = {phrase, phrase.rstrip("s"), phrase[:-2] if phrase.endswith("es") else phrase}
+    if phrase in VALUE_SYNONYMS:
+        candidates.add(VALUE_SYNONYMS[phrase].lower())
+    matches = []
+    for column in frame.columns:
+        series = frame[column]
+        if not pd.api.types.is_string_dtype(series):
+            continue
+        distinct = series.dropna().unique()
+        if len(distinct) > _MAX_DISTINCT_VALUES or not all(isinstance(value, str) for value in distinct):
+            continue
+        by_lower = {value.lower(): value for value in distinct}
+        for candidate in candidates:
+            if candidate in by_lower:
+                matches.append((column, by_lower[candidate]))
+                break
+    return matches[0] if len(matches) == 1 else None
+
+
+def _numeric_columns(frame):
+    return [column for column in frame.columns if pd.api.types.is_numeric_dtype(frame[column])
+            and not pd.api.types.is_bool_dtype(frame[column])]
+
+
+def _parse_clause(clause, frame) -> Optional[List[Dict[str, Any]]]:
+    """Operations for one clause of a follow-up, or None if any part of it is not understood"""
+    clause = _TRAILING_FILLER.sub("", _LEADING_FILLER.sub("", clause.strip()))
+    if not clause:
+        return []
+
+    # Sorting: "sort by date desc", "order by n descending", "highest n first"
+    match = re.fullmatch(
+        r"(?:sort|order|sorted|ordered|rank|ranked)(?: (?:it|them|that|the results?))? by (?P<column>.+?)"
+        r"(?: (?P<direction>asc|ascending|desc|descending|increasing|decreasing|(?:highest|largest|most recent|newest)"
+        r" first|(?:lowest|smallest|oldest) first))?",
+        clause,
+    )
+    if match:
+        column = _match_column(match["column"], frame)
+        if column is None:
+            return None
+        direction = match["direction"] or "asc"
+        descending = direction.startswith(("desc", "decreasing", "highest", "largest", "most", "newest"))
+        return [{"op": "sort", "column": column, "ascending": not descending}]
+    match = re.fullmatch(r"(?P<which>highest|largest|most|newest|latest|lowest|smallest|least|oldest|earliest)"
+                         r" (?P<column>.+?) first", clause)
+    if match:
+        column = _match_column(match["column"], frame)
+        if column is None:
+            return None
+        ascending = match["which"] in ("lowest", "smallest", "least", "oldest", "earliest")
+        return [{"op": "sort", "column": column, "ascending": ascending}]
+
+    # Row limits: "top 10", "first 5 rows", "bottom 3 by n", "last 20"
+    match = re.fullmatch(r"(?P<which>top|first|bottom|last|limit(?: to)?) (?P<n>\d+)(?: \w+)?(?: by (?P<column>.+))?",
+                         clause)
+    if match:
+        operations = []
+        if match["column"]:
+            column = _match_column(match["column"], frame)
+            if column is None:
+                return None
+            operations.append({"op": "sort", "column": column, "ascending": match["which"] in ("bottom", "last")})
+            operations.append({"op": "head", "n": int(match["n"])})
+        elif match["which"] in ("bottom", "last"):
+            operations.append({"op": "tail", "n": int(match["n"])})
+        else:
+            operations.append({"op": "head", "n": int(match["n"])})
+        return operations
+
+    # Counts and aggregates: "how many", "count by arm", "average value by visit"
+    if re.fullmatch(r"(?:how many|count)(?: (?:are there|is that|of them|rows|total))?", clause):
+        return [{"op": "count", "by": None}]
+    match = re.fullmatch(r"(?:how many|count|number)(?: \w+)? (?:by|per|for each) (?P<by>.+)", clause)
+    if match:
+        by = _match_column(match["by"], frame)
+        return None if by is None else [{"op": "count", "by": by}]
+    match = re.fullmatch(rf"(?:the |what is the )?(?P<function>{_AGGREGATE_PATTERN})(?: of)?(?: the)? (?P<column>.+?)"
+                         r"(?: (?:by|per|for each) (?P<by>.+))?", clause)
+    if match:
+        column = _match_column(match["column"], frame)
+        by = _match_column(match["by"], frame) if match["by"] else None
+        if column is None or column not in _numeric_columns(frame) or (match["by"] and by is None):
+            return None
+        return [{"op": "aggregate", "function": _AGGREGATES[match["function"]], "column": column, "by": by}]
+
+    # Comparisons: "value over 40", "n >= 10", "enroll date after 2024-02-01", "above 100"
+    match = re.fullmatch(rf"(?:(?:where|with|whose) )?(?:(?P<column>.+?) )?(?:is )?(?P<op>{_COMPARISON_PATTERN})"
+                         rf" (?:than )?(?P<operand>{_DATE}|{_NUMBER})", clause)
+    if match:
+        if match["column"]:
+            column = _match_column(match["column"], frame)
+        else:
+            # Without a column only an unambiguous one will do
+            numeric = _numeric_columns(frame)
+            column = numeric[0] if len(numeric) == 1 and not re.fullmatch(_DATE, match["operand"]) else None
+        if column is None:
+            return None
+        operand = match["operand"]
+        if re.fullmatch(_DATE, operand):
+            operand = pd.Timestamp(operand)
+        elif column not in _numeric_columns(frame):
+            return None
+        else:
+            operand = float(operand)
+        return [{"op": "compare", "column": column, "operator": _COMPARISONS[match["op"]], "operand": operand}]
+
+    # Value filters: "the severe ones", "females", "mild or moderate", "arm is Drug X", "except nausea"
+    match = re.fullmatch(r"(?P<negate>not |except |excluding |exclude |without |no )?(?P<values>.+)", clause)
+    negate = bool(match["negate"])
+    values_text = match["values"]
+    column_match = re.fullmatch(r"(?:(?:where|with|whose) )?(?P<column>.+?) (?:is|=|equals|of) (?P<values>.+)",
+                                values_text)
+    named_column = None
+    if column_match:
+        named_column = _match_column(column_match["column"], frame)
+        if named_column is not None:
+            values_text = column_match["values"]
+    found = []
+    for phrase in re.split(r"\s+or\s+|\s*/\s*", values_text):
+        value = _match_value(re.sub(r"^(?:the|a|an)\s+", "", phrase), frame)
+        if value is None or (named_column is not None and value[0] != named_column):
+            break
+        found.append(value)
+    else:
+        columns = {column for column, _ in found}
+        if found and len(columns) == 1:
+            return [{"op": "filter", "column": found[0][0], "values": [value for _, value in found], "negate": negate}]
+
+    # A bare list of columns: "just subject id and arm"
+    columns = [_match_column(part, frame) for part in re.split(r"\s*,\s*|\s+and\s+", clause)]
+    if columns and all(columns):
+        return [{"op": "select", "columns": columns}]
+    return None
+
+
+def plan_refinement(question: str, frame: pd.DataFrame) -> Optional[List[Dict[str, Any]]]:
+    """
+    Operations over the previous result that answer a follow-up, if it can be answered in memory
+
+    Every clause of the follow-up must be understood; anything else (a new
+    table, an unknown value, a vague request) returns None so the caller
+    falls back to SQL.
+
+    Returns:
+        list: Operations for apply_plan, or None
+    """
+    text = " ".join(question.lower().strip().rstrip("?.!").split())
+    if not text or frame is None or frame.empty:
+        return None
+    # Column lists are joined with "and" too, so try the whole text as one clause first
+    operations = _parse_clause(text, frame)
+    if operations is None:
+        operations = []
+        for clause in _CLAUSE_SPLIT.split(text):
+            parsed = _parse_clause(clause, frame)
+            if parsed is None:
+                return None
+            operations.extend(parsed)
+    return operations or None
+
+
+def apply_plan(frame: pd.DataFrame, operations: List[Dict[str, Any]]) -> pd.DataFrame:
+    """Run the operations of a plan over a frame, vectorized"""
+    for operation in operations:
+        op = operation["op"]
+        if op == "sort":
+            frame = frame.sort_values(operation["column"], ascending=operation["ascending"], kind="stable",
+                                      na_position="last")
+        elif op == "head":
+            frame = frame.head(operation["n"])
+        elif op == "tail":
+            frame = frame.tail(operation["n"])
+        elif op == "filter":
+            mask = frame[operation["column"]].isin(operation["values"]).to_numpy()
+            frame = frame[~mask if operation["negate"] else mask]
+        elif op == "compare":
+            column = frame[operation["column"]]
+            operand = operation["operand"]
+            if isinstance(operand, pd.Timestamp):
+                column = pd.to_datetime(column, errors="coerce")
+            values = column.to_numpy()
+            with np.errstate(invalid="ignore"):
+                mask = {
+                    ">": values > operand, ">=": values >= operand, "<": values < operand,
+                    "<=": values <= operand, "==": values == operand,
+                }[operation["operator"]]
+            frame = frame[np.asarray(mask, dtype=bool)]
+        elif op == "select":
+            frame = frame[operation["columns"]]
+        elif op == "count":
+            if operation["by"] is None:
+                frame = pd.DataFrame({"count": [len(frame)]})
+            else:
+                frame = frame.groupby(operation["by"], sort=True, dropna=False).size().reset_index(name="count")
+        elif op == "aggregate":
+            function, column = operation["function"], operation["column"]
+            name = f"{function}_{column}"
+            if operation["by"] is None:
+                frame = pd.DataFrame({name: [frame[column].agg(function)]})
+            else:
+                frame = frame.groupby(operation["by"], sort=True, dropna=False)[column].agg(function) \
+                    .reset_index(name=name)
+    return frame.reset_index(drop=True)
+
+
+def describe_plan(operations: List[Dict[str, Any]]) -> str:
+    """Readable summary of a plan, e.g. "filter severity in ['Severe']; sort by n desc; first 10" """
+    parts = []
+    for operation in operations:
+        op = operation["op"]
+        if op == "sort":
+            parts.append(f"sort by {operation['column']} {'asc' if operation['ascending'] else 'desc'}")
+        elif op in ("head", "tail"):
+            parts.append(f"{'first' if op == 'head' else 'last'} {operation['n']}")
+        elif op == "filter":
+            parts.append(f"filter {operation['column']} {'not in' if operation['negate'] else 'in'} {operation['values']}")
+        elif op == "compare":
+            parts.append(f"filter {operation['column']} {operation['operator']} {operation['operand']}")
+        elif op == "select":
+            parts.append(f"columns {', '.join(operation['columns'])}")
+        elif op == "count":
+            parts.append("count" + (f" by {operation['by']}" if operation["by"] else ""))
+        elif op == "aggregate":
+            parts.append(f"{operation['function']} of {operation['column']}"
+                         + (f" by {operation['by']}" if operation["by"] else ""))
+    return "; ".join(parts)
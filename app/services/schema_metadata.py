@@ -0,0 +1,118 @@
+import json
+import logging
+import os
+
+from dotenv import load_dotenv
+
+from app.services.schema_profiler import METADATA_FORMAT_VERSION
+
+# Load environment variables
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_DATABASE = os.getenv("DB_NAME", "clinical_study_db")
+
+# Descriptions that cannot be profiled from the data
+TABLE_PURPOSES = {
+    "subjects": "Contains demographic and enrollment information for each study participant (subject).",
+    "aes": "Records adverse events (AEs) experienced by subjects during the study, including event type, severity, dates, and relation to treatment.",
+    "labs": "Stores laboratory test results for subjects at various visits, including test name, measured value, and reference range.",
+    "tumor_response": "Contains tumor response evaluations for subjects at scheduled assessment visits, capturing response category and assessor.",
+}
+
+SCHEMA_NOTES = """## PostgreSQL Implementation Notes:
+    - Database uses PostgreSQL syntax and data types
+    - Boolean values are represented as TRUE/FALSE (not 1/0)
+    - Text comparisons are case-sensitive by default (use ILIKE for case-insensitive)
+    - Date format follows ISO standard: 'YYYY-MM-DD'
+    - Use double quotes for identifiers only when necessary (e.g., mixed case or reserved words)
+    - Use single quotes for string literals
+
+## Response Code Meanings:
+    - CR: Complete Response (complete disappearance of all target lesions)
+    - PR: Partial Response (at least 30% decrease in the sum of diameters of target lesions)
+    - SD: Stable Disease (neither sufficient shrinkage to qualify for PR nor sufficient increase to qualify for PD)
+    - PD: Progressive Disease (at least 20% increase in the sum of diameters of target lesions)
+    - NE: Not Evaluable (assessment could not be performed)
+"""
+
+
+def read_metadata_file(path):
+    """Read a metadata artifact (uncached), or None if its format version is not supported"""
+    with open(path, "r", encoding="utf-8") as f:
+        metadata = json.load(f)
+    if metadata.get("format_version") != METADATA_FORMAT_VERSION:
+        logger.warning("Ignoring schema metadata at %s: unsupported format version", path)
+        return None
+    return metadata
+
+
+def _format_values(values, limit=20):
+    shown = ", ".join(f"'{value}'" for value in values[:limit])
+    return shown + (", ..." if len(values) > limit else "")
+
+
+def _describe_column(column, meta, info):
+    parts = [f"- {column} ({meta['type']})"]
+    details = []
+    if meta.get("comment"):
+        details.append(meta["comment"])
+    if column in info["primary_key"]:
+        details.append("Primary Key")
+    for fk in info["foreign_keys"]:
+        if fk["column"] == column:
+            details.append(f"Foreign Key to {fk['references_table']}({fk['references_column']})")
+    if meta.get("values"):
+        details.append(f"values: {_format_values(meta['values'])}")
+    elif meta.get("min") is not None and meta["data_type"] not in ("character varying", "character", "text"):
+        details.append(f"range {meta['min']} to {meta['max']}")
+    if meta.get("null_rate"):
+        details.append(f"{meta['null_rate']:.0%} NULL")
+    elif not meta["nullable"]:
+        details.append("NOT NULL")
+    return parts[0] + (": " + "; ".join(details) if details else "")
+
+
+def render_schema_prompt(metadata, tables=None):
+    """
+    Render profiled metadata as the schema description used in LLM prompts
+
+    Args:
+        metadata: Artifact returned by DatabaseTarget.metadata()
+        tables: Only describe these tables (and the joins between them); None for all
+
+    Returns:
+        str: Schema description in the same layout as the hand-written TABLE_METADATA
+    """
+    lines = ["# Clinical Trial Database Schema Metadata for PostgreSQL", ""]
+    joins = []
+    for table, info in metadata["tables"].items():
+        if tables is not None and table not in tables:
+            continue
+        lines.append(f"## Table: {table}")
+        if table in TABLE_PURPOSES:
+            lines += ["    Purpose:", f"    {TABLE_PURPOSES[table]}"]
+        lines.append(f"    Row count: {info['row_count']}")
+        if info["primary_key"]:
+            lines.append(f"    Primary Key(s): {', '.join(info['primary_key'])}")
+        if info["foreign_keys"]:
+            lines.append("    Foreign Keys:")
+            for fk in info["foreign_keys"]:
+                lines.append(f"    - {fk['column']} references {fk['references_table']}({fk['references_column']})")
+                if tables is not None and fk["references_table"] not in tables:
+                    continue
+                joins.append(f"    - {fk['references_table']}.{fk['references_column']} = {table}.{fk['column']}")
+        lines.append("    Columns:")
+        for column, meta in info["columns"].items():
+            lines.append("    " + _describe_column(column, meta, info))
+        if info["sample_rows"]:
+            lines.append("    Sample Data:")
+            for row in info["sample_rows"]:
+                lines.append("    - (" + ", ".join("NULL" if value is None else f"'{value}'" for value in row) + ")")
+        lines.append("")
+
+    if joins:
+        lines += ["## Important Join Conditions:"] + joins + [""]
+    lines.append(SCHEMA_NOTES)
+    return "\n".join(lines)
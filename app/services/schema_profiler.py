@@ -0,0 +1,225 @@
+import hashlib
+import json
+import os
+from datetime import datetime, timezone
+
+# Bump when the artifact layout changes so readers can reject old files
+METADATA_FORMAT_VERSION = 1
+
+# Columns with at most this many distinct values have their values listed
+PROFILE_DISTINCT_LIMIT = int(os.getenv("PROFILE_DISTINCT_LIMIT", "100"))
+
+# Rows of sample data kept per table
+PROFILE_SAMPLE_ROWS = int(os.getenv("PROFILE_SAMPLE_ROWS", "3"))
+
+# Columns whose distinct values feed the value index used to ground literals in
+# questions; they are listed in full (up to VALUE_INDEX_MAX_VALUES) regardless
+# of PROFILE_DISTINCT_LIMIT
+VALUE_INDEX_COLUMNS = [
+    column.strip()
+    for column in os.getenv(
+        "VALUE_INDEX_COLUMNS", "ae_term,severity,site_id,arm,lab_test,visit,response,assessed_by"
+    ).split(",")
+    if column.strip()
+]
+VALUE_INDEX_MAX_VALUES = int(os.getenv("VALUE_INDEX_MAX_VALUES", "10000"))
+
+# Where metadata artifacts are written, one file per database
+SCHEMA_METADATA_DIR = os.getenv("SCHEMA_METADATA_DIR", "app/constant/schema_cache")
+
+# Data types that are candidates for a distinct-value list
+CATEGORICAL_TYPES = {"character varying", "character", "text", "boolean"}
+
+# Data types that have no min()/max() aggregate
+UNORDERED_TYPES = {"boolean", "json", "jsonb"}
+
+CATALOG_SQL = """
+SELECT c.table_name, c.column_name, c.data_type, c.character_maximum_length,
+       c.is_nullable = 'YES', col_description(format('%%I.%%I', c.table_schema, c.table_name)::regclass, c.ordinal_position)
+FROM information_schema.columns c
+JOIN information_schema.tables t
+  ON t.table_schema = c.table_schema AND t.table_name = c.table_name
+WHERE c.table_schema = %s AND t.table_type = 'BASE TABLE'
+ORDER BY c.table_name, c.ordinal_position
+"""
+
+PRIMARY_KEYS_SQL = """
+SELECT tc.table_name, kcu.column_name
+FROM information_schema.table_constraints tc
+JOIN information_schema.key_column_usage kcu
+  ON kcu.constraint_schema = tc.constraint_schema AND kcu.constraint_name = tc.constraint_name
+WHERE tc.table_schema = %s AND tc.constraint_type = 'PRIMARY KEY'
+ORDER BY tc.table_name, kcu.ordinal_position
+"""
+
+FOREIGN_KEYS_SQL = """
+SELECT tc.table_name, kcu.column_name, ccu.table_name, ccu.column_name
+FROM information_schema.table_constraints tc
+JOIN information_schema.key_column_usage kcu
+  ON kcu.constraint_schema = tc.constraint_schema AND kcu.constraint_name = tc.constraint_name
+JOIN information_schema.constraint_column_usage ccu
+  ON ccu.constraint_schema = tc.constraint_schema AND ccu.constraint_name = tc.constraint_name
+WHERE tc.table_schema = %s AND tc.constraint_type = 'FOREIGN KEY'
+ORDER BY tc.table_name, kcu.column_name
+"""
+
+
+def _quote(identifier):
+    return '"' + identifier.replace('"', '""') + '"'
+
+
+def _read_catalog(cursor, schema):
+    """Tables, columns, keys and comments from information_schema"""
+    tables = {}
+    cursor.execute(CATALOG_SQL, (schema,))
+    for table, column, data_type, max_length, nullable, comment in cursor.fetchall():
+        column_type = f"{data_type}({max_length})" if max_length else data_type
+        tables.setdefault(table, {"columns": {}, "primary_key": [], "foreign_keys": []})
+        tables[table]["columns"][column] = {
+            "type": column_type,
+            "data_type": data_type,
+            "nullable": nullable,
+            "comment": comment,
+        }
+
+    cursor.execute(PRIMARY_KEYS_SQL, (schema,))
+    for table, column in cursor.fetchall():
+        if table in tables:
+            tables[table]["primary_key"].append(column)
+
+    cursor.execute(FOREIGN_KEYS_SQL, (schema,))
+    for table, column, ref_table, ref_column in cursor.fetchall():
+        if table in tables:
+            tables[table]["foreign_keys"].append({
+                "column": column,
+                "references_table": ref_table,
+                "references_column": ref_column,
+            })
+    return tables
+
+
+def _profile_table(cursor, schema, table, info):
+    """
+    Gather row count and per-column statistics with one aggregate query
+
+    Every column gets its non-null count, distinct count and (where the type
+    is ordered) min/max. Categorical columns also get their sorted distinct
+    values, which are kept only when the column is low-cardinality.
+    """
+    key_columns = set(info["primary_key"]) | {fk["column"] for fk in info["foreign_keys"]}
+    select_list = ["count(*)"]
+    layout = []
+    for column, meta in info["columns"].items():
+        quoted = _quote(column)
+        fields = ["non_null", "distinct"]
+        select_list += [f"count({quoted})", f"count(DISTINCT {quoted})"]
+        if meta["data_type"] not in UNORDERED_TYPES:
+            fields += ["min", "max"]
+            select_list += [f"min({quoted})::text", f"max({quoted})::text"]
+        if meta["data_type"] in CATEGORICAL_TYPES and column not in key_columns:
+            fields.append("values")
+            select_list.append(
+                f"(array_agg(DISTINCT {quoted}::text ORDER BY {quoted}::text))[1:{PROFILE_DISTINCT_LIMIT + 1}]"
+            )
+        layout.append((column, fields))
+
+    cursor.execute(f"SELECT {', '.join(select_list)} FROM {_quote(schema)}.{_quote(table)}")
+    row = list(cursor.fetchone())
+    row_count = row.pop(0)
+
+    for column, fields in layout:
+        stats = dict(zip(fields, row[:len(fields)]))
+        del row[:len(fields)]
+        meta = info["columns"][column]
+        meta["null_rate"] = round(1 - stats["non_null"] / row_count, 4) if row_count else 0.0
+        meta["distinct_count"] = stats["distinct"]
+        if "min" in stats:
+            meta["min"] = stats["min"]
+            meta["max"] = stats["max"]
+        if "values" in stats and stats["distinct"] <= PROFILE_DISTINCT_LIMIT:
+            meta["values"] = [value for value in stats["values"] if value is not None]
+
+    cursor.execute(f"SELECT * FROM {_quote(schema)}.{_quote(table)} LIMIT {PROFILE_SAMPLE_ROWS}")
+    info["row_count"] = row_count
+    info["sample_rows"] = [[None if value is None else str(value) for value in sample] for sample in cursor.fetchall()]
+
+
+def _index_values(cursor, schema, tables):
+    """Distinct values of the VALUE_INDEX_COLUMNS present in each table"""
+    values = {}
+    for table, info in tables.items():
+        for column in info["columns"]:
+            if column not in VALUE_INDEX_COLUMNS:
+                continue
+            quoted = _quote(column)
+            cursor.execute(
+                f"SELECT DISTINCT {quoted}::text FROM {_quote(schema)}.{_quote(table)} "
+                f"WHERE {quoted} IS NOT NULL ORDER BY 1 LIMIT {VALUE_INDEX_MAX_VALUES}"
+            )
+            values.setdefault(table, {})[column] = [row[0] for row in cursor.fetchall()]
+    return values
+
+
+def profile_database(conn, database, schema="public", load_summary=None):
+    """
+    Build the schema metadata artifact for a database
+
+    Args:
+        conn: psycopg2 connection to the database
+        database: Database name recorded in the artifact (and its file name)
+        schema: Schema to profile
+        load_summary: Optional changed-table summary of the load that triggered
+            the profile; its timestamp becomes the artifact's data version
+
+    Returns:
+        dict: Metadata with the catalog, per-column statistics and the
+        distinct values of the value-index columns
+    """
+    with conn.cursor() as cursor:
+        tables = _read_catalog(cursor, schema)
+        for table, info in tables.items():
+            _profile_table(cursor, schema, table, info)
+        values = _index_values(cursor, schema, tables)
+    conn.rollback()
+
+    content_hash = hashlib.sha256(json.dumps([tables, values], sort_keys=True).encode("utf-8")).hexdigest()
+    return {
+        "format_version": METADATA_FORMAT_VERSION,
+        "version": content_hash[:16],
+        "database": database,
+        "schema": schema,
+        "generated_at": datetime.now(timezone.utc).isoformat(),
+        "data_version": (load_summary or {}).get("loaded_at"),
+        "tables": tables,
+        # Literal values for the value index, by table and column
+        "values": values,
+    }
+
+
+def metadata_path(database, directory=SCHEMA_METADATA_DIR):
+    """Path of the metadata artifact for a database"""
+    return os.path.join(directory, f"{database}.json")
+
+
+def write_schema_metadata(metadata, directory=SCHEMA_METADATA_DIR):
+    """
+    Atomically write a metadata artifact so readers never see a partial file
+
+    Returns:
+        str: Path of the written artifact
+    """
+    os.makedirs(directory, exist_ok=True)
+    path = metadata_path(metadata["database"], directory)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(metadata, f, indent=2)
+    os.replace(tmp_path, path)
+    return path
+
+
+def refresh_schema_metadata(conn, database, load_summary=None):
+    """Profile a database and write its metadata artifact (run after each load)"""
+    metadata = profile_database(conn, database, load_summary=load_summary)
+    path = write_schema_metadata(metadata)
+    print(f"Schema metadata version {metadata['version']} written to {path}")
+    return metadata
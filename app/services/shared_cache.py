@@ -0,0 +1,334 @@
+import hashlib
+import logging
+import os
+import pickle
+import stat
+import struct
+import tempfile
+import threading
+import time
+import uuid
+from typing import Any, Optional
+
+from dotenv import load_dotenv
+
+from app.db.targets import get_target
+
+# Load environment variables
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+SHARED_CACHE_ENABLED = os.getenv("SHARED_CACHE_ENABLED", "true").lower() == "true"
+# Entries live here as one file each; /dev/shm keeps them in memory (tmpfs) where it exists
+SHARED_CACHE_DIR = os.getenv(
+    "SHARED_CACHE_DIR",
+    os.path.join("/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir(), "sql-query-cache"),
+)
+# Total size of all entries before the least recently used are evicted
+SHARED_CACHE_MAX_MB = float(os.getenv("SHARED_CACHE_MAX_MB", "256"))
+# Larger values (e.g. huge result sets) are not cached
+SHARED_CACHE_MAX_ENTRY_MB = float(os.getenv("SHARED_CACHE_MAX_ENTRY_MB", "16"))
+# How long generated SQL (prompt entries) and query results stay valid
+SHARED_CACHE_SQL_TTL_SECONDS = float(os.getenv("SHARED_CACHE_SQL_TTL_SECONDS", "86400"))
+SHARED_CACHE_RESULT_TTL_SECONDS = float(os.getenv("SHARED_CACHE_RESULT_TTL_SECONDS", "300"))
+
+# A sweep lock older than this was left behind by a dead process
+_SWEEP_LOCK_STALE_SECONDS = 60
+# Sweeps evict down to this fraction of the budget, so one sweep covers many writes
+_SWEEP_TARGET_FRACTION = 0.9
+# Entry files start with expires_at (0 for never), so sweeps read it without unpickling
+_HEADER = struct.Struct("<d")
+
+
+def _digest(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def normalize_sql(sql):
+    """
+    Whitespace-insensitive form of a statement for cache keys
+
+    Case is kept: lower-casing would also merge string literals that differ
+    only in case, which select different rows.
+    """
+    return " ".join(sql.split()).rstrip(";").strip()
+
+
+def data_version(target=None):
+    """Version of a target's profiled metadata, so entries from before a re-profile are not reused"""
+    metadata = get_target(target).metadata()
+    return metadata["version"] if metadata else "none"
+
+
+def prompt_key(prompt, model, target, version):
+    """Key of the SQL a generator produced for a prompt"""
+    return f"prompt:{target}:{version}:{_digest(model + chr(0) + prompt)}"
+
+
+def sql_key(sql, target, version):
+    """Key of the result of running a statement"""
+    return f"sql:{target}:{version}:{_digest(normalize_sql(sql))}"
+
+
+def result_key(result_id):
+    """Key of a stored result looked up by id (e.g. a finished job)"""
+    return f"result:{result_id}"
+
+
+class SharedCache:
+    """
+    Key-value cache shared by the worker processes on a host
+
+    Each entry is a file named by the hash of its key: an expires_at header
+    followed by the pickled (key, value). Entries are unpickled, so the
+    directory must be private to the user running the workers; it is
+    created with mode 0700 and refused if another user owns it. Writes go to a temporary file that is renamed into place, so
+    readers in other processes see the old entry or the new one, never a
+    partial write. A hit touches the file's mtime, which makes mtime the
+    LRU order: when the directory grows past SHARED_CACHE_MAX_MB, a sweep
+    (run by whichever process wrote enough to notice, under a lock file)
+    removes expired entries and then the least recently used ones.
+    """
+
+    def __init__(self, directory, max_bytes, max_entry_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes
+        self._lock = threading.Lock()
+        self._written_since_sweep = 0
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.skipped = 0
+        self.evicted = 0
+        self.errors = 0
+        self._check_directory()
+
+    def _check_directory(self):
+        """
+        Create the directory, or check an existing one, as private to this user
+
+        Raises:
+            PermissionError: If it is not a directory owned by this user
+        """
+        os.makedirs(self.directory, mode=0o700, exist_ok=True)
+        info = os.lstat(self.directory)
+        if not stat.S_ISDIR(info.st_mode) or info.st_uid != os.getuid():
+            raise PermissionError(f"Shared cache directory {self.directory} is not a directory owned by this user")
+        if info.st_mode & 0o077:
+            # Left open by an earlier version or a permissive umask; entries written since cannot be trusted
+            os.chmod(self.directory, 0o700)
+            self.clear()
+
+    def clear(self):
+        """Remove every entry"""
+        for _, _, path in self._entries():
+            self._remove(path)
+
+    def _path(self, key):
+        digest = _digest(key)
+        return os.path.join(self.directory, digest[:2], digest)
+
+    def get(self, key, default=None) -> Any:
+        """The cached value, or default if it is missing or expired"""
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                (expires_at,) = _HEADER.unpack(f.read(_HEADER.size))
+                if expires_at and expires_at < time.time():
+                    # Expired: not worth unpickling; the sweep removes the file
+                    self.misses += 1
+                    return default
+                stored_key, value = pickle.load(f)
+        except FileNotFoundError:
+            self.misses += 1
+            return default
+        except (OSError, pickle.UnpicklingError, EOFError, ValueError, struct.error) as e:
+            logger.debug("Unreadable shared cache entry %s: %s", path, e)
+            self.errors += 1
+            self.misses += 1
+            return default
+        # A hash collision is a miss
+        if stored_key != key:
+            self.misses += 1
+            return default
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        self.hits += 1
+        return value
+
+    def set(self, key, value, ttl: Optional[float] = None) -> bool:
+        """
+        Store a value for every worker
+
+        Returns:
+            bool: False if the value was too large or could not be written
+        """
+        expires_at = time.time() + ttl if ttl else 0
+        try:
+            payload = _HEADER.pack(expires_at) + pickle.dumps((key, value), protocol=pickle.HIGHEST_PROTOCOL)
+        except (pickle.PicklingError, TypeError, AttributeError) as e:
+            logger.debug("Value for %s cannot be cached: %s", key, e)
+            self.skipped += 1
+            return False
+        if len(payload) > self.max_entry_bytes:
+            self.skipped += 1
+            return False
+
+        path = self._path(key)
+        tmp_path = os.path.join(os.path.dirname(path), f".{uuid.uuid4().hex}.tmp")
+        try:
+            os.makedirs(os.path.dirname(path), mode=0o700, exist_ok=True)
+            with open(tmp_path, "wb") as f:
+                f.write(payload)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning("Could not write shared cache entry: %s", e)
+            self.errors += 1
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            return False
+        self.writes += 1
+
+        with self._lock:
+            self._written_since_sweep += len(payload)
+            # Sweep about ten times per budget's worth of writes
+            sweep = self._written_since_sweep >= self.max_bytes * (1 - _SWEEP_TARGET_FRACTION)
+            if sweep:
+                self._written_since_sweep = 0
+        if sweep:
+            self.sweep()
+        return True
+
+    def delete(self, key):
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
+
+    def _entries(self):
+        """(mtime, size, path) of every entry file"""
+        entries = []
+        try:
+            shards = list(os.scandir(self.directory))
+        except OSError:
+            return entries
+        for shard in shards:
+            if not shard.is_dir():
+                continue
+            try:
+                for entry in os.scandir(shard.path):
+                    if entry.name.startswith("."):
+                        continue
+                    try:
+                        stat = entry.stat()
+                    except OSError:
+                        continue
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+            except OSError:
+                continue
+        return entries
+
+    def _acquire_sweep_lock(self, lock_path):
+        try:
+            os.close(os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+            return True
+        except FileExistsError:
+            try:
+                if time.time() - os.stat(lock_path).st_mtime > _SWEEP_LOCK_STALE_SECONDS:
+                    os.remove(lock_path)
+            except OSError:
+                pass
+            return False
+        except OSError:
+            return False
+
+    def sweep(self):
+        """Remove expired entries, then the least recently used until under budget"""
+        lock_path = os.path.join(self.directory, ".sweep.lock")
+        # Another worker is already sweeping
+        if not self._acquire_sweep_lock(lock_path):
+            return 0
+        removed = 0
+        try:
+            entries = self._entries()
+            total = sum(size for _, size, _ in entries)
+            if total <= self.max_bytes:
+                return 0
+            now = time.time()
+            kept = []
+            for mtime, size, path in entries:
+                try:
+                    with open(path, "rb") as f:
+                        (expires_at,) = _HEADER.unpack(f.read(_HEADER.size))
+                except (OSError, struct.error):
+                    # Unreadable or truncated: remove it
+                    expires_at = -1
+                if expires_at and expires_at < now:
+                    if self._remove(path):
+                        total -= size
+                        removed += 1
+                else:
+                    kept.append((mtime, size, path))
+            goal = self.max_bytes * _SWEEP_TARGET_FRACTION
+            for mtime, size, path in sorted(kept):
+                if total <= goal:
+                    break
+                if self._remove(path):
+                    total -= size
+                    removed += 1
+        finally:
+            try:
+                os.remove(lock_path)
+            except OSError:
+                pass
+        self.evicted += removed
+        return removed
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+            return True
+        except OSError:
+            return False
+
+    def stats(self):
+        """Hit rate of this worker and the size of the shared store"""
+        entries = self._entries()
+        lookups = self.hits + self.misses
+        return {
+            "directory": self.directory,
+            "entries": len(entries),
+            "bytes": sum(size for _, size, _ in entries),
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else None,
+            "writes": self.writes,
+            "skipped": self.skipped,
+            "evicted": self.evicted,
+            "errors": self.errors,
+        }
+
+
+def _open_shared_cache():
+    try:
+        return SharedCache(
+            SHARED_CACHE_DIR,
+            int(SHARED_CACHE_MAX_MB * 1024 * 1024),
+            int(SHARED_CACHE_MAX_ENTRY_MB * 1024 * 1024),
+        )
+    except OSError as e:
+        # Run without the cache rather than unpickle files another user could write
+        logger.error("Shared cache disabled: %s", e)
+        return None
+
+
+# Process-wide cache; every worker opens the same directory
+shared_cache = _open_shared_cache() if SHARED_CACHE_ENABLED else None
@@ -1,8 +1,14 @@
 import replicate
 from dotenv import load_dotenv
+import logging
 import os
 load_dotenv()
 
+from app.services.provider_gateway import gateway, ProviderOverloadedError
+from app.db.targets import get_target
+
+logger = logging.getLogger(__name__)
+
 # TABLE_METADATA = """"
 #     I have a database designed for managing clinical trial data. Please use the following schema details and descriptions to generate accurate SQL queries.
 
@@ -247,18 +253,26 @@ SYSTEM_INTRUCTION = """
 
 
 
-async def generate_sql_query_by_sqlCoder(prompt):
+SQLCODER_MODEL = "nateraw/defog-sqlcoder-7b-2:ced935b577fb52644d933f77e2ff8902744e4c58a2f50023b3a1db80b7a75806"
+
+def _run_sqlcoder(**kwargs):
+    """Run SQLCoder on Replicate and join the streamed output into one string."""
+    return "".join(replicate.run(SQLCODER_MODEL, **kwargs))
+
+async def generate_sql_query_by_sqlCoder(prompt, target=None, schema=None):
 
     try:
-        output = replicate.run(
-            "nateraw/defog-sqlcoder-7b-2:ced935b577fb52644d933f77e2ff8902744e4c58a2f50023b3a1db80b7a75806",
+        sql_query = await gateway.call(
+            "replicate",
+            SQLCODER_MODEL,
+            _run_sqlcoder,
             input={
                 "top_k": 50,
                 "top_p": 0.9,
                 "question": prompt,
                 "temperature": 0,
                 "max_new_tokens": 512,
-                "table_metadata": TABLE_METADATA,
+                "table_metadata": schema or get_target(target).schema_prompt(fallback=TABLE_METADATA),
                 # "table_metadata": "-- PostgreSQL Clinical Study Database Schema Metadata\n-- Database: clinical_study_db\n\n/*\nSCHEMA OVERVIEW:\nThis database stores clinical trial data including subject demographics, adverse events,\nlaboratory results, and tumor response assessments using RECIST criteria.\n\nENTITY RELATIONSHIPS:\n1. One-to-Many: A single subject can have multiple adverse events\n   subjects(subject_id) ----< aes(subject_id)\n\n2. One-to-Many: A single subject can have multiple lab results \n   subjects(subject_id) ----< labs(subject_id)\n\n3. One-to-Many: A single subject can have multiple tumor response assessments\n   subjects(subject_id) ----< tumor_response(subject_id)\n\nIMPORTANT NOTE ON POSTGRESQL CASE INSENSITIVITY:\n- This schema uses unquoted identifiers which PostgreSQL converts to lowercase\n- All table and column names will be treated as lowercase during queries\n- This means 'Subject_ID', 'SUBJECT_ID', and 'subject_id' are all equivalent\n- For consistency, it's recommended to use lowercase in all queries\n*/\n\n-- Table: subjects\n-- Stores subject demographic and enrollment information\n-- This is the primary entity table with relationships to all other tables\nCREATE TABLE IF NOT EXISTS subjects (\n  subject_id INT NOT NULL,           -- Unique identifier for each subject\n  site_id VARCHAR(10) NULL,          -- Clinical site identifier\n  arm VARCHAR(45) NULL,              -- Treatment arm (e.g., 'Drug X', 'Standard of Care')\n  dob DATE NULL,                     -- Date of birth\n  gender CHAR(1) NULL,               -- Gender ('F', 'M')\n  enroll_date DATE NULL,             -- Study enrollment date\n  PRIMARY KEY (subject_id)\n);\n\n-- Table: aes\n-- Stores Adverse Event information for subjects\n-- Relationship: Many adverse events can belong to one subject (Many-to-One)\nCREATE TABLE IF NOT EXISTS aes (\n  ae_id SERIAL NOT NULL,             -- Unique identifier for each adverse event\n  subject_id INT NOT NULL,           -- Foreign key to subjects.subject_id\n  ae_term VARCHAR(255) NULL,         -- Description of the adverse event\n  severity VARCHAR(45) NULL,         -- Severity ('Mild', 'Moderate', 'Severe', 'Life-threatening')\n  start_date DATE NULL,              -- Date when adverse event started\n  end_date DATE NULL,                -- Date when adverse event ended (NULL if ongoing)\n  related BOOLEAN NULL,              -- Whether related to treatment (TRUE/FALSE)\n  PRIMARY KEY (ae_id),\n  CONSTRAINT fk_aes_subjects\n    FOREIGN KEY (subject_id)\n    REFERENCES subjects (subject_id)\n);\n\nCREATE INDEX fk_aes_subjects_idx ON aes (subject_id);\n\n-- Table: labs\n-- Stores laboratory test results for subjects\n-- Relationship: Many lab results can belong to one subject (Many-to-One)\nCREATE TABLE IF NOT EXISTS labs (\n  lab_id SERIAL NOT NULL,            -- Unique identifier for each lab result\n  subject_id INT NOT NULL,           -- Foreign key to subjects.subject_id\n  visit VARCHAR(45) NULL,            -- Visit identifier (e.g., 'Baseline', 'Week 1')\n  lab_test VARCHAR(45) NULL,         -- Type of lab test (e.g., 'Hemoglobin', 'WBC', 'ALT')\n  value FLOAT NULL,                  -- Measured value\n  units VARCHAR(45) NULL,            -- Units of measurement (e.g., 'g/dL', 'U/L')\n  normal_range VARCHAR(45) NULL,     -- Reference range (e.g., '12-16', '0-40')\n  PRIMARY KEY (lab_id),\n  CONSTRAINT fk_labs_subjects\n    FOREIGN KEY (subject_id)\n    REFERENCES subjects (subject_id)\n);\n\nCREATE INDEX fk_labs_subjects_idx ON labs (subject_id);\n\n-- Table: tumor_response\n-- Stores tumor response assessments (RECIST) for subjects\n-- Relationship: Many tumor responses can belong to one subject (Many-to-One)\nCREATE TABLE IF NOT EXISTS tumor_response (\n  response_id SERIAL NOT NULL,       -- Unique identifier for each response assessment\n  subject_id INT NOT NULL,           -- Foreign key to subjects.subject_id\n  visit VARCHAR(45) NULL,            -- Visit identifier (e.g., 'Week 8', 'Week 16')\n  response VARCHAR(10) NULL,         -- RECIST response ('CR', 'PR', 'SD', 'PD', 'NE')\n                                     -- CR=Complete Response, PR=Partial Response\n                                     -- SD=Stable Disease, PD=Progressive Disease, NE=Not Evaluable\n  assessed_by VARCHAR(45) NULL,      -- Who assessed ('Investigator', 'Independent')\n  PRIMARY KEY (response_id),\n  CONSTRAINT fk_tumor_response_subjects\n    FOREIGN KEY (subject_id)\n    REFERENCES subjects (subject_id)\n);\n\nCREATE INDEX fk_tumor_response_subjects_idx ON tumor_response (subject_id);\n",
                 "prompt_template": "### Task\nGenerate a SQL query to answer [QUESTION]{question}[/QUESTION]\n\n### Instructions\n- If you cannot answer the question with the available database schema, return 'I do not know'\n\n### Database Schema\nThe query will run on a database with the following schema:\n{table_metadata}\n\n### Answer\nGiven the database schema, here is the SQL query that answers [QUESTION]{question}[/QUESTION]\n[SQL]",
                 "presence_penalty": 0,
@@ -266,15 +280,12 @@ async def generate_sql_query_by_sqlCoder(prompt):
             }
         )
 
-        # Collect all output from the generator
-        sql_query = ""
-        for item in output:
-            sql_query += item
-
         return sql_query
-            
+
+    except ProviderOverloadedError:
+        raise
     except Exception as e:
-        print('Error calling the API:')
+        logger.exception("Error calling the SQLCoder API")
         raise e
 
 
@@ -289,14 +300,19 @@ from google.genai import types
 
 api_key = os.getenv("GEMINI_API_KEY")
 gemini_client = genai.Client(api_key=api_key)
+GEMINI_MODEL = "models/gemini-2.5-flash-preview-04-17"
 
-async def generate_sql_query_by_gemini(prompt):
+async def generate_sql_query_by_gemini(prompt, target=None, schema=None):
 
-    prompt = TABLE_METADATA+ " \n Natural Language Query : " +prompt
+    # A caller-provided schema (e.g. only the tables a follow-up refines) replaces the full one
+    prompt = (schema or get_target(target).schema_prompt(fallback=TABLE_METADATA))+ " \n Natural Language Query : " +prompt
 
     try:
-        response = gemini_client.models.generate_content(
-            model="models/gemini-2.5-flash-preview-04-17", 
+        response = await gateway.call(
+            "gemini",
+            GEMINI_MODEL,
+            gemini_client.models.generate_content,
+            model=GEMINI_MODEL,
             contents=prompt,
             config=types.GenerateContentConfig(
                 system_instruction=SYSTEM_INTRUCTION,
@@ -304,9 +320,11 @@ async def generate_sql_query_by_gemini(prompt):
             )
         )
         
-        print(response.text)     
+        logger.debug("Gemini SQL response", extra={"response_text": response.text})
         return response.text
     
+    except ProviderOverloadedError:
+        raise
     except Exception as e:
         return {
             "error": str(e),
@@ -325,24 +343,32 @@ async def generate_sql_query_by_gemini(prompt):
 
 
 from openai import OpenAI
-openai_client = OpenAI()
+# No SDK retries: the gateway retries, honouring Retry-After
+openai_client = OpenAI(max_retries=0)
+OPENAI_MODEL = "gpt-4.1"
 
 
-async def generate_sql_query_by_openai(prompt):
+async def generate_sql_query_by_openai(prompt, target=None, schema=None):
 
-    prompt = TABLE_METADATA+ " \n Natural Language Query : " +prompt
+    # A caller-provided schema (e.g. only the tables a follow-up refines) replaces the full one
+    prompt = (schema or get_target(target).schema_prompt(fallback=TABLE_METADATA))+ " \n Natural Language Query : " +prompt
     try:
         
-        response = openai_client.responses.create(
-            model="gpt-4.1",
+        response = await gateway.call(
+            "openai",
+            OPENAI_MODEL,
+            openai_client.responses.create,
+            model=OPENAI_MODEL,
             instructions=SYSTEM_INTRUCTION,
             input=prompt,
             temperature=0
         )
 
-        print(response.output_text)
+        logger.debug("OpenAI SQL response", extra={"response_text": response.output_text})
         return response.output_text
     
+    except ProviderOverloadedError:
+        raise
     except Exception as e:
         return {
             "error": str(e),
@@ -0,0 +1,501 @@
+import difflib
+import re
+from collections import namedtuple
+from typing import Dict, List, Optional, Set
+
+from app.db.targets import get_target
+
+# Used until the profiler has written a metadata artifact (mirrors CREATE_TABLES_SQL)
+STATIC_CATALOG = {
+    "subjects": {"subject_id", "site_id", "arm", "dob", "gender", "enroll_date"},
+    "aes": {"ae_id", "subject_id", "ae_term", "severity", "start_date", "end_date", "related"},
+    "labs": {"lab_id", "subject_id", "visit", "lab_test", "value", "units", "normal_range"},
+    "tumor_response": {"response_id", "subject_id", "visit", "response", "assessed_by"},
+}
+
+# Statements and clauses that write, lock or change the session
+FORBIDDEN_KEYWORDS = {
+    "insert", "update", "delete", "merge", "upsert", "create", "drop", "alter", "truncate", "grant",
+    "revoke", "copy", "call", "do", "vacuum", "analyze", "lock", "reindex", "cluster", "comment",
+    "refresh", "set", "reset", "execute", "prepare", "deallocate", "listen", "notify", "into",
+}
+
+# Functions that write, sleep, touch files or the server, or run SQL passed as a string
+FORBIDDEN_FUNCTIONS = {
+    "setval", "nextval", "currval", "lastval", "set_config", "ts_stat", "loread", "lowrite",
+    "txid_current",
+}
+# Prefixes of function families that are all forbidden (pg_sleep, pg_read_file, lo_import, dblink_exec, ...)
+FORBIDDEN_FUNCTION_PREFIXES = ("pg_", "lo_", "dblink", "binary_upgrade_")
+# Suffixes of the *_to_xml family, which runs queries given as strings (query_to_xml('delete ...'))
+FORBIDDEN_FUNCTION_SUFFIXES = ("_to_xml", "_to_xmlschema", "_to_xml_and_xmlschema")
+
+
+def is_forbidden_function(name):
+    """True if a function may have side effects or run SQL hidden in a string"""
+    name = name.lower()
+    return (
+        name in FORBIDDEN_FUNCTIONS
+        or name.startswith(FORBIDDEN_FUNCTION_PREFIXES)
+        or name.endswith(FORBIDDEN_FUNCTION_SUFFIXES)
+    )
+
+
+# Words that are never column references
+KEYWORDS = FORBIDDEN_KEYWORDS | {
+    "select", "from", "where", "and", "or", "not", "as", "on", "using", "join", "inner", "left", "right",
+    "full", "outer", "cross", "natural", "lateral", "only", "group", "by", "order", "having", "limit",
+    "offset", "fetch", "first", "next", "row", "rows", "only", "union", "intersect", "except", "all",
+    "distinct", "with", "recursive", "materialized", "case", "when", "then", "else", "end", "in",
+    "is", "null", "true", "false", "unknown", "like", "ilike", "similar", "to", "between", "symmetric",
+    "exists", "any", "some", "asc", "desc", "nulls", "last", "over", "partition", "range", "groups",
+    "preceding", "following", "unbounded", "current", "exclude", "ties", "others", "no", "filter",
+    "within", "window", "values", "cast", "interval", "escape", "collate", "at", "time", "zone",
+    "current_date", "current_time", "current_timestamp", "localtime", "localtimestamp",
+    "current_user", "session_user", "user", "array", "rollup", "cube", "grouping", "sets",
+    "for", "share", "of", "nowait", "skip", "locked", "leading", "trailing", "both", "placing",
+    "year", "month", "day", "hour", "minute", "second", "millisecond", "microsecond", "epoch",
+    "dow", "isodow", "doy", "week", "quarter", "decade", "century", "millennium", "isoyear",
+    "int", "integer", "smallint", "bigint", "numeric", "decimal", "real", "float", "double",
+    "precision", "text", "varchar", "char", "character", "varying", "boolean", "bool", "date",
+    "timestamp", "timestamptz", "without", "json", "jsonb", "uuid", "bytea", "serial",
+}
+
+# Keywords that end the FROM list of the current query level
+_CLAUSE_KEYWORDS = {
+    "where", "group", "having", "order", "limit", "offset", "fetch", "union", "intersect", "except",
+    "window", "for", "on", "using", "returning",
+}
+
+_TOKEN_PATTERN = re.compile(r"""
+    (?P<space>\s+)
+  | (?P<line_comment>--[^\n]*)
+  | (?P<block_comment>/\*.*?\*/)
+  | (?P<string>[eEbBxXnN]?'(?:[^']|'')*')
+  | (?P<dollar>\$(?P<tag>[A-Za-z_]\w*)?\$.*?\$(?P=tag)?\$)
+  | (?P<quoted>"(?:[^"]|"")+")
+  | (?P<number>(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?)
+  | (?P<param>\$\d+|%\([A-Za-z_]\w*\)s|%s)
+  | (?P<ident>[A-Za-z_][\w$]*)
+  | (?P<op>::|<=|>=|<>|!=|\|\||->>|->|\#>>|\#>|[-+*/%<>=~!@\#^&|`?(),;.\[\]:])
+""", re.VERBOSE | re.DOTALL)
+
+Token = namedtuple("Token", "kind value position")
+
+_OPERAND_END_KINDS = {"string", "number", "quoted", "param"}
+
+
+def _error(code, message, position=None, suggestion=None):
+    error = {"code": code, "message": message, "position": position}
+    if suggestion:
+        error["suggestion"] = suggestion
+    return error
+
+
+def extract_sql(text):
+    """Strip markdown code fences and surrounding whitespace from generated SQL"""
+    text = text.strip()
+    fenced = re.search(r"```(?:sql)?\s*(.*?)```", text, re.DOTALL | re.IGNORECASE)
+    if fenced:
+        text = fenced.group(1).strip()
+    return text
+
+
+def tokenize(sql):
+    """
+    Split SQL into tokens, dropping whitespace and comments
+
+    Unquoted identifiers are lower-cased (as PostgreSQL folds them); quoted
+    identifiers keep their case without the quotes.
+
+    Raises:
+        ValueError: On an unterminated string, identifier or comment
+    """
+    tokens = []
+    position = 0
+    length = len(sql)
+    while position < length:
+        match = _TOKEN_PATTERN.match(sql, position)
+        if match is None:
+            char = sql[position]
+            if char in "'\"":
+                raise ValueError(f"Unterminated {'string' if char == chr(39) else 'quoted identifier'} at position {position}")
+            if sql.startswith("/*", position):
+                raise ValueError(f"Unterminated comment at position {position}")
+            raise ValueError(f"Unexpected character {char!r} at position {position}")
+        kind = "dollar" if match.group("dollar") is not None else match.lastgroup
+        value = match.group()
+        if kind in ("space", "line_comment", "block_comment"):
+            pass
+        elif kind == "ident":
+            tokens.append(Token("ident", value.lower(), position))
+        elif kind == "quoted":
+            tokens.append(Token("quoted", value[1:-1].replace('""', '"'), position))
+        elif kind == "dollar":
+            tokens.append(Token("string", value, position))
+        else:
+            tokens.append(Token(kind, value, position))
+        position = match.end()
+    return tokens
+
+
+def _is_word(token):
+    return token is not None and token.kind in ("ident", "quoted")
+
+
+def _is_name(token):
+    """An identifier usable as a table, column or alias name"""
+    return token is not None and (token.kind == "quoted" or (token.kind == "ident" and token.value not in KEYWORDS))
+
+
+class _Analyzer:
+    """One pass over the tokens collecting sources, aliases and column references"""
+
+    def __init__(self, tokens, catalog):
+        self.tokens = tokens
+        self.catalog = catalog
+        self.errors = []
+        self.consumed = set()
+        # Alias or table name -> catalog table, or None for derived tables/CTEs/functions
+        self.sources: Dict[str, Optional[str]] = {}
+        self.tables: Set[str] = set()
+        self.ctes: Set[str] = set()
+        self.output_names: Set[str] = set()
+        self.matching = {}
+
+    def token(self, index):
+        return self.tokens[index] if 0 <= index < len(self.tokens) else None
+
+    def is_op(self, index, value):
+        token = self.token(index)
+        return token is not None and token.kind == "op" and token.value == value
+
+    def is_keyword(self, index, *values):
+        token = self.token(index)
+        return token is not None and token.kind == "ident" and token.value in values
+
+    def match_parentheses(self):
+        stack = []
+        for index, token in enumerate(self.tokens):
+            if token.kind != "op":
+                continue
+            if token.value == "(":
+                stack.append(index)
+            elif token.value == ")":
+                if not stack:
+                    self.errors.append(_error("unbalanced_parentheses", "Unexpected ')'", token.position))
+                    return False
+                self.matching[stack.pop()] = index
+        if stack:
+            self.errors.append(_error("unbalanced_parentheses", "Unclosed '('", self.tokens[stack[-1]].position))
+            return False
+        return True
+
+    def parse_alias(self, index):
+        """Optional [AS] alias [(column, ...)] at index; returns (alias, next index)"""
+        if self.is_keyword(index, "as"):
+            self.consumed.add(index)
+            index += 1
+        if not _is_name(self.token(index)):
+            return None, index
+        alias = self.token(index).value
+        self.consumed.add(index)
+        index += 1
+        if self.is_op(index, "(") and index in self.matching:
+            for inner in range(index + 1, self.matching[index]):
+                if _is_word(self.token(inner)):
+                    self.output_names.add(self.token(inner).value)
+                    self.consumed.add(inner)
+            index = self.matching[index] + 1
+        return alias, index
+
+    def parse_source(self, index):
+        """A FROM/JOIN item: table, (subquery) or function call, with its alias"""
+        while self.is_keyword(index, "lateral", "only"):
+            index += 1
+        token = self.token(index)
+        if token is None:
+            return index
+        if self.is_op(index, "("):
+            alias, _ = self.parse_alias(self.matching.get(index, index) + 1)
+            if alias:
+                self.sources[alias] = None
+            # The subquery's own tokens are analysed by the main loop
+            return index + 1
+        if not _is_word(token):
+            return index
+
+        names = [index]
+        while self.is_op(names[-1] + 1, ".") and _is_word(self.token(names[-1] + 2)):
+            names.append(names[-1] + 2)
+        self.consumed.update(range(index, names[-1] + 1))
+        after = names[-1] + 1
+
+        if self.is_op(after, "("):
+            # Set-returning function such as generate_series(...) or unnest(...)
+            self.consumed.discard(names[-1])
+            alias, _ = self.parse_alias(self.matching.get(after, after) + 1)
+            if alias:
+                self.sources[alias] = None
+            return after
+
+        table = self.token(names[-1]).value
+        schema = self.token(names[0]).value if len(names) > 1 else None
+        if schema not in (None, "public"):
+            self.errors.append(_error("unknown_table", f"Schema '{schema}' is not available", token.position))
+        elif table in self.ctes:
+            self.sources[table] = None
+        elif table in self.catalog:
+            self.tables.add(table)
+            self.sources[table] = table
+        else:
+            self.errors.append(_error(
+                "unknown_table", f"Unknown table '{table}'", token.position,
+                _suggest(table, list(self.catalog) + list(self.ctes)),
+            ))
+            self.sources[table] = None
+        alias, after = self.parse_alias(after)
+        if alias:
+            self.sources[alias] = self.sources[table]
+        return after
+
+    def parse_ctes(self, index):
+        """WITH [RECURSIVE] name [(columns)] AS [NOT] [MATERIALIZED] (...), ..."""
+        index += 1
+        if self.is_keyword(index, "recursive"):
+            index += 1
+        while _is_word(self.token(index)):
+            self.ctes.add(self.token(index).value)
+            self.consumed.add(index)
+            index += 1
+            if self.is_op(index, "(") and index in self.matching:
+                for inner in range(index + 1, self.matching[index]):
+                    if _is_word(self.token(inner)):
+                        self.output_names.add(self.token(inner).value)
+                        self.consumed.add(inner)
+                index = self.matching[index] + 1
+            while self.is_keyword(index, "as", "not", "materialized"):
+                index += 1
+            if not self.is_op(index, "(") or index not in self.matching:
+                break
+            index = self.matching[index] + 1
+            if not self.is_op(index, ","):
+                break
+            index += 1
+
+    def analyse(self):
+        if not self.match_parentheses():
+            return
+        # Pre-pass: CTE names are visible everywhere in the statement
+        for index, token in enumerate(self.tokens):
+            if token.kind == "ident" and token.value == "with":
+                self.parse_ctes(index)
+
+        # Kind of each open parenthesis, and FROM-list state per depth
+        paren_kinds = []
+        in_from_list = {}
+        index = 0
+        while index < len(self.tokens):
+            token = self.tokens[index]
+            depth = len(paren_kinds)
+            if token.kind == "op" and token.value == "(":
+                previous = self.token(index - 1)
+                if self.is_keyword(index + 1, "select", "with", "values"):
+                    paren_kinds.append("query")
+                elif _is_word(previous) and not (previous.kind == "ident" and previous.value in ("in", "exists", "any", "all", "some", "as", "on", "using")):
+                    paren_kinds.append("call")
+                else:
+                    paren_kinds.append("group")
+            elif token.kind == "op" and token.value == ")":
+                in_from_list.pop(depth, None)
+                if paren_kinds:
+                    paren_kinds.pop()
+            elif token.kind == "ident" and token.value in ("from", "join"):
+                in_call = paren_kinds and paren_kinds[-1] == "call"
+                distinct_from = token.value == "from" and self.is_keyword(index - 1, "distinct")
+                if not in_call and not distinct_from:
+                    in_from_list[depth] = True
+                    index = self.parse_source(index + 1)
+                    continue
+            elif token.kind == "ident" and token.value in _CLAUSE_KEYWORDS:
+                in_from_list.pop(depth, None)
+            elif token.kind == "op" and token.value == "," and in_from_list.get(depth):
+                index = self.parse_source(index + 1)
+                continue
+            index += 1
+
+        self.collect_output_names()
+        self.check_columns()
+
+    def collect_output_names(self):
+        """Names introduced by AS, or by an alias directly after an expression"""
+        for index, token in enumerate(self.tokens):
+            if index in self.consumed or not _is_name(token):
+                continue
+            previous = self.token(index - 1)
+            if previous is None:
+                continue
+            explicit = previous.kind == "ident" and previous.value == "as"
+            implicit = (
+                previous.kind in _OPERAND_END_KINDS
+                or (previous.kind == "op" and previous.value in (")", "*") and not self.is_op(index - 2, "."))
+                or (_is_name(previous) and not self.is_op(index - 2, ".") and not self.is_op(index - 2, "::"))
+            )
+            if (explicit or implicit) and not self.is_op(index + 1, "(") and not self.is_op(index + 1, "."):
+                self.output_names.add(token.value)
+                self.consumed.add(index)
+
+    def check_columns(self):
+        known_columns = set()
+        for table in self.tables:
+            known_columns |= self.catalog[table]
+
+        for index, token in enumerate(self.tokens):
+            if index in self.consumed or not _is_word(token):
+                continue
+            if token.kind == "ident" and token.value in KEYWORDS:
+                continue
+            if self.is_op(index + 1, "("):
+                # Function call
+                continue
+            if self.is_op(index - 1, "::") or self.is_op(index - 1, "."):
+                continue
+
+            if self.is_op(index + 1, ".") and (_is_word(self.token(index + 2)) or self.is_op(index + 2, "*")):
+                self.check_qualified(token, self.token(index + 2))
+                continue
+
+            name = token.value
+            if name in known_columns or name in self.output_names or name in self.sources:
+                continue
+            if not self.tables and not self.sources:
+                # No table to resolve against (e.g. SELECT 1)
+                self.errors.append(_error("unknown_column", f"Unknown column '{name}'", token.position))
+                continue
+            suggestion = _suggest(name, sorted(known_columns))
+            message = f"Unknown column '{name}'"
+            if token.kind == "quoted" and not suggestion:
+                message += " (string literals need single quotes)"
+            elif token.kind == "quoted" and suggestion == name.lower():
+                message += " (quoted identifiers are case-sensitive)"
+            self.errors.append(_error("unknown_column", message, token.position, suggestion))
+
+    def check_qualified(self, qualifier, column):
+        alias = qualifier.value
+        if alias not in self.sources:
+            self.errors.append(_error(
+                "unknown_table", f"Unknown table or alias '{alias}'", qualifier.position,
+                _suggest(alias, list(self.sources)),
+            ))
+            return
+        table = self.sources[alias]
+        if table is None or column.kind == "op":
+            return
+        if column.value not in self.catalog[table]:
+            message = f"Unknown column '{column.value}' in table '{table}'"
+            suggestion = _suggest(column.value, sorted(self.catalog[table]))
+            if column.kind == "quoted" and suggestion == column.value.lower():
+                message += " (quoted identifiers are case-sensitive)"
+            self.errors.append(_error("unknown_column", message, column.position, suggestion))
+
+
+def _suggest(name, candidates):
+    lowered = name.lower()
+    if lowered in candidates:
+        return lowered
+    close = difflib.get_close_matches(lowered, candidates, n=1, cutoff=0.6)
+    return close[0] if close else None
+
+
+def get_catalog(target=None) -> Dict[str, Set[str]]:
+    """Table -> column names from a target's profiled metadata, or STATIC_CATALOG before the first profile"""
+    target = get_target(target)
+    metadata = target.metadata()
+    if metadata is None:
+        return STATIC_CATALOG
+    return target.cached(
+        "catalog", metadata["version"],
+        lambda: {table: set(info["columns"]) for table, info in metadata["tables"].items()},
+    )
+
+
+def validate_sql(sql, catalog=None) -> Dict:
+    """
+    Check that SQL is a single read-only query over known tables and columns
+
+    Runs locally (no database round-trip): the statement is tokenized, DML,
+    DDL, multiple statements and calls to functions with side effects are
+    rejected, and every table and column reference is resolved against the
+    catalog.
+
+    Args:
+        sql: Statement to check (markdown code fences are stripped)
+        catalog: Table -> column names; defaults to get_catalog()
+
+    Returns:
+        dict: 'valid' (bool), 'sql' (the statement without fences or a
+        trailing semicolon), 'tables' (catalog tables referenced) and
+        'errors' (list of dicts with 'code', 'message', 'position' and,
+        where one is close, a 'suggestion')
+    """
+    catalog = catalog if catalog is not None else get_catalog()
+    result = {"valid": False, "sql": None, "tables": [], "errors": []}
+    if not isinstance(sql, str):
+        result["errors"].append(_error("empty", "No SQL statement"))
+        return result
+
+    sql = extract_sql(sql)
+    try:
+        tokens = tokenize(sql)
+    except ValueError as e:
+        result["errors"].append(_error("syntax_error", str(e)))
+        return result
+    while tokens and tokens[-1].kind == "op" and tokens[-1].value == ";":
+        tokens.pop()
+    if not tokens:
+        result["errors"].append(_error("empty", "No SQL statement"))
+        return result
+    result["sql"] = re.sub(r"[\s;]+$", "", sql)
+
+    for token in tokens:
+        if token.kind == "op" and token.value == ";":
+            result["errors"].append(_error("multiple_statements", "Only a single statement is allowed", token.position))
+            return result
+
+    first = next((token for token in tokens if not (token.kind == "op" and token.value == "(")), None)
+    if first is None or first.kind != "ident" or first.value not in ("select", "with", "values"):
+        result["errors"].append(_error("not_select", "Only SELECT queries are allowed", tokens[0].position))
+        return result
+
+    for index, token in enumerate(tokens):
+        if token.kind == "ident" and token.value in FORBIDDEN_KEYWORDS and not (
+            index > 0 and tokens[index - 1].kind == "op" and tokens[index - 1].value in (".", "::")
+        ):
+            result["errors"].append(_error(
+                "not_read_only", f"'{token.value.upper()}' is not allowed in a read-only query", token.position
+            ))
+        elif _is_word(token) and index + 1 < len(tokens) and tokens[index + 1].kind == "op" \
+                and tokens[index + 1].value == "(" and is_forbidden_function(token.value):
+            result["errors"].append(_error(
+                "not_read_only", f"Function '{token.value}' is not allowed in a read-only query", token.position
+            ))
+    if result["errors"]:
+        return result
+
+    analyzer = _Analyzer(tokens, catalog)
+    analyzer.analyse()
+    result["tables"] = sorted(analyzer.tables)
+    result["errors"] = analyzer.errors
+    result["valid"] = not analyzer.errors
+    return result
+
+
+def format_errors(errors: List[Dict]) -> str:
+    """Validation errors as text, e.g. for a regeneration prompt or an HTTP error"""
+    lines = []
+    for error in errors:
+        line = f"- {error['message']}"
+        if error.get("suggestion"):
+            line += f" (did you mean '{error['suggestion']}'?)"
+        lines.append(line)
+    return "\n".join(lines)
@@ -0,0 +1,197 @@
+import atexit
+import contextvars
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+from datetime import datetime, timezone
+
+from dotenv import load_dotenv
+
+from app.services.provider_gateway import parse_env_mapping
+
+# Load environment variables
+load_dotenv()
+
+# Root level, and per-logger overrides, e.g. "app.rag=DEBUG,app.db=WARNING"
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_LEVELS = parse_env_mapping(os.getenv("LOG_LEVELS", ""), lambda level: level.upper())
+# Longest string kept per field, and most items kept per list/dict field
+LOG_MAX_FIELD_CHARS = int(os.getenv("LOG_MAX_FIELD_CHARS", "1000"))
+LOG_MAX_FIELD_ITEMS = int(os.getenv("LOG_MAX_FIELD_ITEMS", "20"))
+# Fraction of high-volume events kept, e.g. "query.result=0.01"
+LOG_SAMPLE_RATES = parse_env_mapping(os.getenv("LOG_SAMPLE_RATES", "query.result=0.01"), float)
+# Records waiting to be written; beyond this they are dropped instead of blocking
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+
+# Id of the HTTP request being served, set by RequestIdMiddleware
+request_id_var = contextvars.ContextVar("request_id", default=None)
+
+# Attributes every LogRecord has; anything else was passed as a field
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+_listener = None
+
+
+def truncate(value, max_chars=None, max_items=None):
+    """
+    Shrink a value for logging
+
+    Long strings are cut, and lists/dicts keep their first items plus a
+    marker with how many were left out. Nested values are handled the same
+    way, so a result set is never serialized in full.
+    """
+    max_chars = max_chars or LOG_MAX_FIELD_CHARS
+    max_items = max_items or LOG_MAX_FIELD_ITEMS
+    if isinstance(value, str):
+        if len(value) > max_chars:
+            return value[:max_chars] + f"...[{len(value) - max_chars} more chars]"
+        return value
+    if isinstance(value, (int, float, bool)) or value is None:
+        return value
+    if isinstance(value, dict):
+        items = list(value.items())
+        shrunk = {str(k): truncate(v, max_chars, max_items) for k, v in items[:max_items]}
+        if len(items) > max_items:
+            shrunk["..."] = f"{len(items) - max_items} more keys"
+        return shrunk
+    if isinstance(value, (list, tuple, set)):
+        items = list(value)
+        shrunk = [truncate(v, max_chars, max_items) for v in items[:max_items]]
+        if len(items) > max_items:
+            shrunk.append(f"...[{len(items) - max_items} more items]")
+        return shrunk
+    return truncate(str(value), max_chars, max_items)
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: timestamp, level, logger, message, request id and fields"""
+
+    def format(self, record):
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        request_id = getattr(record, "request_id", None)
+        if request_id:
+            entry["request_id"] = request_id
+        # Fields were already truncated by NonBlockingQueueHandler.prepare()
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRIBUTES and key != "request_id":
+                entry[key] = value
+        if record.exc_info:
+            entry["exception"] = truncate(self.formatException(record.exc_info))
+        return json.dumps(entry, default=str)
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """
+    Hand records to the listener thread without formatting them
+
+    The stock QueueHandler formats in the calling thread; here the calling
+    thread only attaches the request id and truncates the extra fields, and
+    a full queue drops the record rather than stalling the request.
+    Truncating copies the fields, so the listener never serializes an
+    object the caller has since changed, and the queue never holds a whole
+    result set.
+    """
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        record.request_id = request_id_var.get()
+        for key, value in list(record.__dict__.items()):
+            if key not in _RECORD_ATTRIBUTES and key != "request_id":
+                record.__dict__[key] = truncate(value)
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def should_sample(event):
+    """Whether to keep an occurrence of a high-volume event (LOG_SAMPLE_RATES)"""
+    rate = LOG_SAMPLE_RATES.get(event, 1.0)
+    return rate >= 1.0 or random.random() < rate
+
+
+def log_event(logger, event, level=logging.INFO, message=None, **fields):
+    """
+    Log a structured event, subject to the logger's level and the event's sample rate
+
+    The level and sampling checks come first so that dropped events cost
+    neither a LogRecord nor any formatting.
+    """
+    if not logger.isEnabledFor(level) or not should_sample(event):
+        return
+    logger.log(level, message or event, extra={"event": event, **fields})
+
+
+def configure_logging():
+    """
+    Route all logging through the JSON queue handler (idempotent)
+
+    Call once at application startup, before the first request.
+    """
+    global _listener
+    if _listener is not None:
+        return
+
+    stream_handler = logging.StreamHandler(sys.stdout)
+    stream_handler.setFormatter(JsonFormatter())
+    log_queue = queue.Queue(LOG_QUEUE_SIZE)
+    _listener = logging.handlers.QueueListener(log_queue, stream_handler, respect_handler_level=True)
+
+    root = logging.getLogger()
+    root.handlers = [NonBlockingQueueHandler(log_queue)]
+    root.setLevel(LOG_LEVEL)
+    for name, level in LOG_LEVELS.items():
+        logging.getLogger(name).setLevel(level)
+
+    _listener.start()
+    atexit.register(_listener.stop)
+
+
+class RequestIdMiddleware:
+    """
+    ASGI middleware giving every HTTP request an id for its log records
+
+    Uses the client's X-Request-ID header when present and echoes the id
+    back in the response.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        request_id = None
+        for name, value in scope["headers"]:
+            if name == b"x-request-id":
+                request_id = value.decode("latin-1")[:64]
+                break
+        request_id = request_id or os.urandom(8).hex()
+
+        async def send_with_request_id(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = list(message.get("headers", [])) + [(b"x-request-id", request_id.encode("latin-1"))]
+            await send(message)
+
+        token = request_id_var.set(request_id)
+        try:
+            await self.app(scope, receive, send_with_request_id)
+        finally:
+            request_id_var.reset(token)
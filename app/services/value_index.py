@@ -0,0 +1,195 @@
+import os
+import re
+from typing import Dict, List, Optional
+
+from dotenv import load_dotenv
+
+from app.db.targets import get_target
+
+# Load environment variables
+load_dotenv()
+
+# Minimum trigram similarity (Dice coefficient) for a fuzzy match
+VALUE_INDEX_MIN_SIMILARITY = float(os.getenv("VALUE_INDEX_MIN_SIMILARITY", "0.7"))
+# Mentions shorter than this are only matched exactly
+VALUE_INDEX_MIN_FUZZY_CHARS = int(os.getenv("VALUE_INDEX_MIN_FUZZY_CHARS", "5"))
+
+_WORD_PATTERN = re.compile(r"[\w][\w\-./]*")
+
+
+def normalize(text):
+    """Case- and whitespace-insensitive form used for matching"""
+    return " ".join(text.lower().split())
+
+
+def trigrams(text):
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class _TrieNode:
+    __slots__ = ("children", "values")
+
+    def __init__(self):
+        self.children = {}
+        self.values = []
+
+
+class ValueIndex:
+    """
+    Index of literal database values for grounding questions
+
+    A character trie over the normalized values finds exact (case- and
+    spacing-insensitive) mentions in one pass over the question, preferring
+    the longest match at each position. Words left unmatched are looked up
+    in a trigram inverted index to catch misspellings and variants.
+    """
+
+    def __init__(self, values: Dict[str, Dict[str, List[str]]]):
+        # Entry id -> (value, table, column)
+        self.entries = []
+        self._root = _TrieNode()
+        self._trigrams: Dict[str, List[int]] = {}
+        self._entry_trigrams = []
+        self.max_words = 1
+
+        for table, columns in values.items():
+            for column, column_values in columns.items():
+                for value in column_values:
+                    self._add(value, table, column)
+
+    def _add(self, value, table, column):
+        entry_id = len(self.entries)
+        self.entries.append((value, table, column))
+        key = normalize(value)
+        if not key:
+            self._entry_trigrams.append(set())
+            return
+        self.max_words = max(self.max_words, len(key.split()))
+
+        node = self._root
+        for char in key:
+            node = node.children.setdefault(char, _TrieNode())
+        node.values.append(entry_id)
+
+        grams = trigrams(key)
+        self._entry_trigrams.append(grams)
+        for gram in grams:
+            self._trigrams.setdefault(gram, []).append(entry_id)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def _exact_matches(self, text, words, original_words):
+        """Longest trie match starting at each word, ending on a word boundary"""
+        matches = []
+        covered = set()
+        for index, match in enumerate(words):
+            if index in covered:
+                continue
+            node, best = self._root, None
+            position = match.start()
+            while position < len(text) and text[position] in node.children:
+                node = node.children[text[position]]
+                position += 1
+                at_boundary = position == len(text) or not (text[position].isalnum() or text[position] == "_")
+                if node.values and at_boundary:
+                    best = (position, node.values)
+            if best is None:
+                continue
+            end, entry_ids = best
+            mention = text[match.start():end]
+            for entry_id in entry_ids:
+                value = self.entries[entry_id][0]
+                # Very short codes (e.g. response "PD") must match case as well
+                if len(value) < 3 and value not in original_words:
+                    continue
+                matches.append((mention, entry_id, 1.0))
+            covered.update(i for i, word in enumerate(words) if match.start() <= word.start() < end)
+        return matches, covered
+
+    def _fuzzy_matches(self, words, covered):
+        """Closest value by trigram similarity for spans of words not matched exactly"""
+        matches = []
+        for size in range(self.max_words, 0, -1):
+            for start in range(len(words) - size + 1):
+                span = range(start, start + size)
+                if any(i in covered for i in span):
+                    continue
+                mention = " ".join(words[i].group() for i in span)
+                if len(mention) < VALUE_INDEX_MIN_FUZZY_CHARS:
+                    continue
+                grams = trigrams(mention)
+                counts: Dict[int, int] = {}
+                for gram in grams:
+                    for entry_id in self._trigrams.get(gram, ()):
+                        counts[entry_id] = counts.get(entry_id, 0) + 1
+                best_id, best_score = None, 0.0
+                for entry_id, shared in counts.items():
+                    score = 2 * shared / (len(grams) + len(self._entry_trigrams[entry_id]))
+                    if score > best_score:
+                        best_id, best_score = entry_id, score
+                if best_id is not None and best_score >= VALUE_INDEX_MIN_SIMILARITY:
+                    matches.append((mention, best_id, round(best_score, 3)))
+                    covered.update(span)
+        return matches
+
+    def resolve(self, question: str) -> List[Dict]:
+        """
+        Find mentions of database values in a question
+
+        Returns:
+            list: One dict per mention with the mention text, the exact
+            database value, its table and column, and a similarity score
+            (1.0 for exact matches)
+        """
+        text = normalize(question)
+        words = list(_WORD_PATTERN.finditer(text))
+        original_words = {match.group() for match in _WORD_PATTERN.finditer(question)}
+        exact, covered = self._exact_matches(text, words, original_words)
+        fuzzy = self._fuzzy_matches(words, covered)
+
+        resolved = []
+        seen = set()
+        for mention, entry_id, score in exact + fuzzy:
+            value, table, column = self.entries[entry_id]
+            if (value, table, column) in seen:
+                continue
+            seen.add((value, table, column))
+            resolved.append({"mention": mention, "value": value, "table": table, "column": column, "score": score})
+        return resolved
+
+
+def get_value_index(target=None) -> Optional[ValueIndex]:
+    """
+    The value index for a database target, rebuilt when the profiled metadata changes
+
+    Returns:
+        ValueIndex: Index over the values in the metadata artifact, or None
+        if no artifact exists yet
+    """
+    target = get_target(target)
+    metadata = target.metadata()
+    if metadata is None:
+        return None
+    return target.cached("value_index", metadata["version"], lambda: ValueIndex(metadata.get("values") or {}))
+
+
+def annotate_prompt(prompt, target=None):
+    """
+    Append the exact database values a question refers to
+
+    Returns:
+        str: The prompt, followed by the resolved literals if any were found
+    """
+    index = get_value_index(target)
+    if index is None:
+        return prompt
+    matches = index.resolve(prompt)
+    if not matches:
+        return prompt
+    lines = [
+        f"- \"{match['mention']}\" refers to {match['table']}.{match['column']} = '{match['value']}'"
+        for match in matches
+    ]
+    return prompt + "\n\nDatabase values mentioned in the question (use these exact literals):\n" + "\n".join(lines)
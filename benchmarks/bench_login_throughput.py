@@ -0,0 +1,71 @@
+"""
+Login throughput benchmark: bcrypt on the event loop vs. in the password pool.
+
+Simulates a burst of concurrent logins (password verification only, no
+MongoDB) while a ticker task measures how long the event loop is stalled,
+which is what every other request on the worker experiences.
+
+Usage:
+    python benchmarks/bench_login_throughput.py [--logins 64] [--rounds 12]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+async def _ticker(stop, lags, interval=0.01):
+    """Record how late each tick fires; lateness is time the loop was blocked"""
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        lags.append(time.perf_counter() - start - interval)
+
+
+async def _run(label, verify, logins):
+    stop = asyncio.Event()
+    lags = []
+    ticker = asyncio.create_task(_ticker(stop, lags))
+    await asyncio.sleep(0.05)
+
+    start = time.perf_counter()
+    await asyncio.gather(*[verify() for _ in range(logins)])
+    elapsed = time.perf_counter() - start
+
+    stop.set()
+    await ticker
+    print(f"{label:<22} {logins / elapsed:>8.1f} logins/s   "
+          f"max loop stall {max(lags) * 1000:>8.1f} ms   "
+          f"p50 stall {sorted(lags)[len(lags) // 2] * 1000:>6.1f} ms")
+
+
+async def main(logins):
+    from app.auth import auth
+
+    password = "correct horse battery staple"
+    hashed = auth.pwd_context.hash(password)
+
+    async def inline_verify():
+        # What the login handler used to do: verify inside the async handler
+        auth.pwd_context.verify(password, hashed)
+
+    async def pooled_verify():
+        await auth.verify_and_update_password(password, hashed)
+
+    print(f"bcrypt rounds={auth.BCRYPT_ROUNDS}, pool workers={auth.PASSWORD_HASH_WORKERS}, logins={logins}")
+    await _run("inline (event loop)", inline_verify, logins)
+    await _run("password pool", pooled_verify, logins)
+    print(auth.password_hashing_stats())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--logins", type=int, default=64)
+    parser.add_argument("--rounds", type=int, default=None, help="Override BCRYPT_ROUNDS")
+    args = parser.parse_args()
+    if args.rounds:
+        os.environ["BCRYPT_ROUNDS"] = str(args.rounds)
+    asyncio.run(main(args.logins))
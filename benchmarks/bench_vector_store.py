@@ -0,0 +1,115 @@
+"""
+Vector store benchmark: NumpyVectorStore vs. Chroma for schema-sized corpora.
+
+Uses deterministic pseudo-random embeddings (no API calls), so only the
+store is measured: build time, similarity and MMR retrieval latency (the
+RAG retriever uses MMR with k=40) and memory added by the store.
+
+Usage:
+    python benchmarks/bench_vector_store.py [--docs 8 200 5000] [--dim 1536] [--queries 200]
+"""
+import argparse
+import gc
+import hashlib
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+
+from app.rag.numpy_vector_store import NumpyVectorStore
+
+
+class HashEmbeddings(Embeddings):
+    """Same text -> same unit vector, without a model"""
+
+    def __init__(self, dim):
+        self.dim = dim
+
+    def _vector(self, text):
+        seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+        vector = np.random.default_rng(seed).standard_normal(self.dim).astype(np.float32)
+        return (vector / np.linalg.norm(vector)).tolist()
+
+    def embed_documents(self, texts):
+        return [self._vector(text) for text in texts]
+
+    def embed_query(self, text):
+        return self._vector(text)
+
+
+def _rss_mb():
+    """Resident memory of this process (Linux /proc; nan elsewhere)"""
+    try:
+        with open("/proc/self/statm") as f:
+            resident_pages = int(f.read().split()[1])
+    except (OSError, IndexError, ValueError):
+        return float("nan")
+    return resident_pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+
+
+def _bench(label, build, documents, queries):
+    gc.collect()
+    rss_before = _rss_mb()
+    start = time.perf_counter()
+    store = build(documents)
+    build_ms = (time.perf_counter() - start) * 1000
+    rss_after = _rss_mb()
+
+    latencies = {}
+    for name, search in (
+        ("similarity k=4", lambda q: store.similarity_search(q, k=4)),
+        ("mmr k=40", lambda q: store.max_marginal_relevance_search(q, k=min(40, len(documents)))),
+    ):
+        search(queries[0])
+        timings = []
+        for query in queries:
+            start = time.perf_counter()
+            search(query)
+            timings.append((time.perf_counter() - start) * 1000)
+        timings.sort()
+        latencies[name] = (timings[len(timings) // 2], timings[int(len(timings) * 0.99) - 1])
+
+    print(f"  {label:<8} build {build_ms:>8.1f} ms   +RSS {rss_after - rss_before:>7.1f} MB   " + "   ".join(
+        f"{name} p50 {p50:.3f} ms p99 {p99:.3f} ms" for name, (p50, p99) in latencies.items()
+    ))
+    return store
+
+
+def main(doc_counts, dim, query_count):
+    embedding = HashEmbeddings(dim)
+    queries = [f"question {i}" for i in range(query_count)]
+    try:
+        from langchain_community.vectorstores import Chroma
+    except ImportError:
+        Chroma = None
+        print("chromadb / langchain_community not installed: benchmarking NumpyVectorStore only")
+
+    for count in doc_counts:
+        documents = [Document(page_content=f"schema chunk {i}") for i in range(count)]
+        print(f"{count} documents, dim {dim}")
+        _bench("numpy", lambda docs: NumpyVectorStore.from_documents(docs, embedding), documents, queries)
+        if Chroma is not None:
+            directory = tempfile.mkdtemp(prefix="bench-chroma-")
+            try:
+                _bench("chroma", lambda docs: Chroma.from_documents(
+                    docs, embedding, persist_directory=directory, collection_name=f"bench_{count}"
+                ), documents, queries)
+            finally:
+                shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--docs", type=int, nargs="+", default=[8, 200, 5000])
+    parser.add_argument("--dim", type=int, default=1536)
+    parser.add_argument("--queries", type=int, default=200)
+    args = parser.parse_args()
+    main(args.docs, args.dim, args.queries)
@@ -1,31 +1,56 @@
-from fastapi import FastAPI
+import asyncio
+import math
+import os
+import time
+
+from fastapi import Depends, FastAPI, Request
+from fastapi.responses import JSONResponse
 from pydantic import BaseModel
-from typing import List
+from typing import List, Optional
 from fastapi.middleware.cors import CORSMiddleware
 from dotenv import load_dotenv
 load_dotenv()
 
-from app.services.sql_query_generation_llm import generate_sql_query_by_sqlCoder, generate_sql_query_by_gemini, generate_sql_query_by_openai
-from app.rag.generate_sql_query_by_rag import generate_sql_query_by_rag
+import logging
+
+from app.services.structured_logging import configure_logging, log_event, RequestIdMiddleware
+from app.middleware.compression import CompressionMiddleware
+configure_logging()
+
 from app.services.execute_query import execute_query
 from app.services.gemini_ai import generate_response
-from app.langchain.generate_and_execute_sql_query_by_langchain import generate_and_execute_sql_query_by_langchain
-from app.langchain.agent import generate_sql_query_and_execute_by_agent
+from app.services.query_pipeline import run_query
+from app.rag.generate_sql_query_by_rag import preload_sql_generator
+from app.services.provider_gateway import ProviderOverloadedError
+from app.db.targets import UnknownTargetError, targets
+from app.services.query_history import build_history_record, query_history
+from app.services.query_jobs import query_jobs
+from app.auth.auth import get_optional_current_user
+from app.model.user import UserResponse
 
-from app.routes import user
+from app.routes import user, status, export, query_history as query_history_routes, query_jobs as query_jobs_routes, query_session as query_session_routes
 
 from app.db.mongo_db_connection import connect_to_mongodb, close_mongodb_connection
 
 
+logger = logging.getLogger(__name__)
+
+# Build the RAG generator, filling the embedding cache, in the background at startup
+RAG_PRELOAD = os.getenv("RAG_PRELOAD", "false").lower() == "true"
 
 app = FastAPI()
 
+app.add_middleware(RequestIdMiddleware)
+app.add_middleware(CompressionMiddleware)
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # Pagination headers of GET /user/
+    expose_headers=["X-Next-Cursor", "X-Total-Count", "X-Request-ID"],
 )
 
 
@@ -33,10 +58,37 @@ app.add_middleware(
 @app.on_event("startup")
 async def startup_db_client():
     await connect_to_mongodb()
+    query_history.start()
+    query_jobs.start()
+    if RAG_PRELOAD:
+        asyncio.get_running_loop().run_in_executor(None, preload_sql_generator)
 
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    # Finish with jobs first: they write history
+    await query_jobs.stop()
+    # Write buffered history before the client goes away
+    await query_history.stop()
     await close_mongodb_connection()
+    targets.close_all()
+
+
+@app.exception_handler(ProviderOverloadedError)
+async def provider_overloaded_handler(request: Request, exc: ProviderOverloadedError):
+    """Shed load with 429/503 instead of letting requests pile up on a throttled provider"""
+    headers = {}
+    if exc.retry_after is not None:
+        headers["Retry-After"] = str(math.ceil(exc.retry_after))
+    return JSONResponse(
+        status_code=exc.status_code,
+        content={"detail": str(exc)},
+        headers=headers,
+    )
+
+
+@app.exception_handler(UnknownTargetError)
+async def unknown_target_handler(request: Request, exc: UnknownTargetError):
+    return JSONResponse(status_code=400, content={"detail": str(exc)})
 
 
 @app.get("/")   
@@ -46,38 +98,45 @@ async def root():
 class PromptRequest(BaseModel):
     prompt: str
     model: str
+    # Study database to query (see DB_TARGETS); None for the default database
+    target: Optional[str] = None
 
 @app.post("/query", tags=["Query"])
-async def handle_query(request: PromptRequest):
+async def handle_query(request: PromptRequest, current_user: Optional[UserResponse] = Depends(get_optional_current_user)):
     prompt = request.prompt
     model = request.model
-    print("PROMPT", prompt)
-    print("MODEL", model)
-
-    if model == "sqlCoder":
-        sql_query = await generate_sql_query_by_sqlCoder(prompt)
-        result = execute_query(sql_query)
-    elif model == "gemini":
-        sql_query = await generate_sql_query_by_gemini(prompt)
-        result = execute_query(sql_query)
-    elif model == "openAI":
-        sql_query = await generate_sql_query_by_openai(prompt)
-        result = execute_query(sql_query)
-    elif model == "langchain":
-        result = generate_and_execute_sql_query_by_langchain(prompt)
-    
-    elif model == "agent":
-        result = generate_sql_query_and_execute_by_agent(prompt)
-    else:
-        sql_query = generate_sql_query_by_rag(prompt)
-        result = execute_query(sql_query)
-    
-    print("RESULT", result)
+    user_id = str(current_user.id) if current_user else None
+    log_event(logger, "query.received", prompt=prompt, model=model, target=request.target, user_id=user_id)
+
+    start = time.monotonic()
+    try:
+        result = await run_query(prompt, model, request.target)
+    except ProviderOverloadedError as e:
+        query_history.record(build_history_record(
+            prompt, model, None, user_id, (time.monotonic() - start) * 1000, error=str(e)
+        ))
+        raise
+    query_history.record(build_history_record(
+        prompt, model, result, user_id, (time.monotonic() - start) * 1000
+    ))
+
+    log_event(
+        logger, "query.completed",
+        generator=result.get("generator"), target=result.get("target"), success=result.get("success"),
+        rowcount=result.get("rowcount"), timings=result.get("timings"), sql_query=result.get("sql_query"),
+    )
+    # Full result (rows included, truncated) only for a sample of requests at DEBUG
+    log_event(logger, "query.result", logging.DEBUG, result=result)
     return {"data": result}
 
 
 
 app.include_router(user.router, prefix="/user", tags=["User"])
+app.include_router(status.router, prefix="/status", tags=["Status"])
+app.include_router(query_history_routes.router, prefix="/history", tags=["History"])
+app.include_router(export.router, prefix="/export", tags=["Export"])
+app.include_router(query_jobs_routes.router, prefix="/query/jobs", tags=["Query"])
+app.include_router(query_session_routes.router, prefix="/query", tags=["Query"])
 
 
 # print(execute_query("""SELECT "Arm", COUNT(*) as subject_count FROM subjects GROUP BY "Arm"; """))
@@ -1,8 +1,14 @@
 import psycopg2
 import pandas as pd
+import argparse
+import json
 import os
-from io import StringIO
 import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+from app.services.schema_profiler import metadata_path, refresh_schema_metadata
 
 def set_environment_variables():
     """Set PostgreSQL environment variables if not already set"""
@@ -122,6 +128,62 @@ CREATE TABLE IF NOT EXISTS tumor_response (
 CREATE INDEX IF NOT EXISTS fk_tumor_response_subjects_idx ON tumor_response (subject_id);
 """
 
+# Bulk-load mode: the same tables without keys, constraints or indexes.
+# These are added by build_post_load_objects() once the data is in.
+BULK_CREATE_TABLES_SQL = """
+CREATE TABLE IF NOT EXISTS subjects (
+  subject_id INT NOT NULL,
+  site_id VARCHAR(10) NULL,
+  arm VARCHAR(45) NULL,
+  dob DATE NULL,
+  gender CHAR(1) NULL,
+  enroll_date DATE NULL
+);
+
+CREATE TABLE IF NOT EXISTS aes (
+  ae_id SERIAL NOT NULL,
+  subject_id INT NOT NULL,
+  ae_term VARCHAR(255) NULL,
+  severity VARCHAR(45) NULL,
+  start_date DATE NULL,
+  end_date DATE NULL,
+  related BOOLEAN NULL
+);
+
+CREATE TABLE IF NOT EXISTS labs (
+  lab_id SERIAL NOT NULL,
+  subject_id INT NOT NULL,
+  visit VARCHAR(45) NULL,
+  lab_test VARCHAR(45) NULL,
+  value FLOAT NULL,
+  units VARCHAR(45) NULL,
+  normal_range VARCHAR(45) NULL
+);
+
+CREATE TABLE IF NOT EXISTS tumor_response (
+  response_id SERIAL NOT NULL,
+  subject_id INT NOT NULL,
+  visit VARCHAR(45) NULL,
+  response VARCHAR(10) NULL,
+  assessed_by VARCHAR(45) NULL
+);
+"""
+
+# Primary key column per table (added after the load in bulk-load mode)
+PRIMARY_KEYS = {
+    'subjects': 'subject_id',
+    'aes': 'ae_id',
+    'labs': 'lab_id',
+    'tumor_response': 'response_id',
+}
+
+# Foreign key constraint and its supporting index per child table
+FOREIGN_KEYS = {
+    'aes': ('fk_aes_subjects', 'fk_aes_subjects_idx'),
+    'labs': ('fk_labs_subjects', 'fk_labs_subjects_idx'),
+    'tumor_response': ('fk_tumor_response_subjects', 'fk_tumor_response_subjects_idx'),
+}
+
 def create_database(conn):
     """Create the clinical_study_db database if it doesn't exist"""
     try:
@@ -156,14 +218,14 @@ def create_database(conn):
         print(f"Error creating database: {e}")
         return conn  # Return the original connection if there was an error
 
-def create_tables(conn):
+def create_tables(conn, create_tables_sql=CREATE_TABLES_SQL):
     """Create the database tables"""
     try:
         cursor = conn.cursor()
         
         # Split the SQL into individual statements
         table_statements = [
-            stmt.strip() for stmt in CREATE_TABLES_SQL.split(';')
+            stmt.strip() for stmt in create_tables_sql.split(';')
             if stmt.strip() and not stmt.strip().startswith('CREATE DATABASE')
         ]
         
@@ -180,72 +242,535 @@ def create_tables(conn):
     finally:
         cursor.close()
 
-def upload_csv_to_table(conn, file_path, table_name, columns=None):
+# Columns loaded from each CSV, in table load order
+TABLE_COLUMNS = {
+    'subjects': ['subject_id', 'site_id', 'arm', 'dob', 'gender', 'enroll_date'],
+    'aes': ['subject_id', 'ae_term', 'severity', 'start_date', 'end_date', 'related'],
+    'labs': ['subject_id', 'visit', 'lab_test', 'value', 'units', 'normal_range'],
+    'tumor_response': ['subject_id', 'visit', 'response', 'assessed_by'],
+}
+
+# Date columns to normalise to YYYY-MM-DD, with the pandas error mode to use
+DATE_COLUMNS = {
+    'subjects': {'dob': 'raise', 'enroll_date': 'raise'},
+    # end_date is empty for ongoing events
+    'aes': {'start_date': 'raise', 'end_date': 'coerce'},
+}
+
+# Rows per pandas chunk and number of tables loaded in parallel
+CSV_CHUNK_ROWS = int(os.getenv('CSV_CHUNK_ROWS', '100000'))
+LOAD_WORKERS = int(os.getenv('LOAD_WORKERS', '3'))
+
+# Bytes handed to COPY per read
+COPY_BUFFER_SIZE = 1024 * 1024
+
+def transform_chunk(df, table_name, columns=None):
+    """Select the target columns and normalise date columns of one CSV chunk"""
+    if columns:
+        df = df[columns].copy()
+    for column, errors in DATE_COLUMNS.get(table_name, {}).items():
+        if column in df.columns:
+            df[column] = pd.to_datetime(df[column], errors=errors).dt.strftime('%Y-%m-%d')
+    return df
+
+class CSVChunkStream:
     """
-    Upload data from a CSV file to a database table using pandas and copy_from
-    
+    Read-only file-like object that feeds COPY FROM STDIN one CSV chunk at a time.
+
+    Only one transformed chunk is held in memory, so peak memory is bounded by
+    the chunk size instead of the file size.
+    """
+
+    def __init__(self, file_path, table_name, columns=None, chunk_size=CSV_CHUNK_ROWS):
+        self.table_name = table_name
+        self.columns = columns
+        self.rows = 0
+        self._chunks = pd.read_csv(file_path, usecols=columns, chunksize=chunk_size)
+        self._buffer = ''
+        self._pos = 0
+        self._exhausted = False
+
+    def _next_chunk(self):
+        try:
+            chunk = next(self._chunks)
+        except StopIteration:
+            self._exhausted = True
+            return
+        chunk = transform_chunk(chunk, self.table_name, self.columns)
+        self.rows += len(chunk)
+        self._buffer = chunk.to_csv(index=False, header=False, na_rep='NULL')
+        self._pos = 0
+
+    def read(self, size=-1):
+        while self._pos >= len(self._buffer) and not self._exhausted:
+            self._next_chunk()
+        if self._pos >= len(self._buffer):
+            return ''
+        if size is None or size < 0:
+            end = len(self._buffer)
+        else:
+            end = self._pos + size
+        data = self._buffer[self._pos:end]
+        self._pos += len(data)
+        return data
+
+def copy_csv(cursor, file_path, table_name, target_table, columns=None, chunk_size=CSV_CHUNK_ROWS):
+    """
+    COPY a CSV file into target_table chunk by chunk, without committing
+
+    Args:
+        cursor: Database cursor
+        file_path: Path to the CSV file
+        table_name: Logical table the CSV belongs to (selects the transforms)
+        target_table: Table to copy into (the table itself or a staging table)
+        columns: List of column names (if None, use all columns from CSV)
+        chunk_size: Number of CSV rows transformed at a time
+
+    Returns:
+        int: Number of rows copied
+    """
+    stream = CSVChunkStream(file_path, table_name, columns, chunk_size)
+    columns_str = ', '.join(columns or pd.read_csv(file_path, nrows=0).columns)
+    cursor.copy_expert(
+        f"COPY {target_table} ({columns_str}) FROM STDIN WITH CSV NULL 'NULL'",
+        stream,
+        size=COPY_BUFFER_SIZE
+    )
+    return stream.rows
+
+def stream_csv_to_table(conn, file_path, table_name, columns=None, chunk_size=CSV_CHUNK_ROWS):
+    """
+    Stream a CSV file into a table with COPY FROM STDIN, chunk by chunk
+
     Args:
         conn: Database connection
         file_path: Path to the CSV file
         table_name: Name of the target table
         columns: List of column names (if None, use all columns from CSV)
+        chunk_size: Number of CSV rows transformed at a time
+
+    Returns:
+        dict: Load statistics ('rows', 'seconds', 'rows_per_second'), or None on failure
     """
+    cursor = None
     try:
-        # Read CSV file
         if not os.path.exists(file_path):
             print(f"Error: File not found - {file_path}")
-            return False
-        
-        print(f"Reading {file_path}...")
-        df = pd.read_csv(file_path)
-        
-        # If columns are specified, use only those columns
-        if columns:
-            df = df[columns]
-        
-        # Handle date columns properly for each table
-        if table_name == 'subjects':
-            if 'dob' in df.columns:
-                df['dob'] = pd.to_datetime(df['dob']).dt.strftime('%Y-%m-%d')
-            if 'enroll_date' in df.columns:
-                df['enroll_date'] = pd.to_datetime(df['enroll_date']).dt.strftime('%Y-%m-%d')
-        
-        if table_name == 'aes':
-            if 'start_date' in df.columns:
-                df['start_date'] = pd.to_datetime(df['start_date']).dt.strftime('%Y-%m-%d')
-            if 'end_date' in df.columns:
-                # Handle NaN values in end_date
-                df['end_date'] = pd.to_datetime(df['end_date'], errors='coerce').dt.strftime('%Y-%m-%d')
-                df['end_date'].fillna('', inplace=True)
-        
-        # Convert dataframe to CSV string (in-memory)
-        csv_buffer = StringIO()
-        df.to_csv(csv_buffer, index=False, header=False, na_rep='NULL')
-        csv_buffer.seek(0)
-        
-        # Create a cursor and execute COPY command
+            return None
+
+        print(f"Streaming {file_path} into {table_name}...")
+        start = time.perf_counter()
         cursor = conn.cursor()
-        
-        # Get column names for COPY command
-        columns_str = ', '.join(df.columns)
-        
-        # Copy data from buffer to table
-        cursor.copy_expert(f"COPY {table_name} ({columns_str}) FROM STDIN WITH CSV NULL 'NULL'", csv_buffer)
-        
+        rows = copy_csv(cursor, file_path, table_name, table_name, columns, chunk_size)
         conn.commit()
-        print(f"Successfully uploaded data to {table_name} table!")
-        return True
-        
+
+        seconds = time.perf_counter() - start
+        stats = {
+            'rows': rows,
+            'seconds': round(seconds, 3),
+            'rows_per_second': round(rows / seconds) if seconds else rows,
+        }
+        print(f"Successfully uploaded {stats['rows']} rows to {table_name} "
+              f"in {stats['seconds']}s ({stats['rows_per_second']} rows/s)")
+        return stats
+
     except Exception as e:
         print(f"Error uploading data to {table_name}: {e}")
         conn.rollback()
-        return False
+        return None
     finally:
-        if 'cursor' in locals():
+        if cursor:
             cursor.close()
 
+def upload_csv_to_table(conn, file_path, table_name, columns=None):
+    """
+    Upload data from a CSV file to a database table using a streaming COPY
+
+    Args:
+        conn: Database connection
+        file_path: Path to the CSV file
+        table_name: Name of the target table
+        columns: List of column names (if None, use all columns from CSV)
+    """
+    return stream_csv_to_table(conn, file_path, table_name, columns) is not None
+
+def _load_table_on_new_connection(file_path, table_name, columns):
+    """Load one table on its own connection (psycopg2 connections are not shared between threads)"""
+    conn = create_connection()
+    try:
+        return stream_csv_to_table(conn, file_path, table_name, columns)
+    finally:
+        conn.close()
+
+def load_tables(conn, csv_files, workers=LOAD_WORKERS, subjects_first=True):
+    """
+    Load all tables: subjects first, then the child tables in parallel
+
+    The child tables only reference subjects, so once subjects is committed
+    they can be copied concurrently on separate connections.
+
+    Args:
+        conn: Database connection used for the subjects load
+        csv_files: Mapping of table name to CSV path
+        workers: Number of child tables loaded at the same time
+        subjects_first: Set to False when no foreign keys exist yet, to load
+            every table in parallel
+
+    Returns:
+        dict: Load statistics per table (None for tables that failed)
+    """
+    report = {}
+    if subjects_first:
+        report['subjects'] = stream_csv_to_table(conn, csv_files['subjects'], 'subjects', TABLE_COLUMNS['subjects'])
+        if report['subjects'] is None:
+            print("Skipping dependent tables because subjects failed to load.")
+            return report
+
+    parallel_tables = [table for table in TABLE_COLUMNS if table not in report]
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            table: executor.submit(_load_table_on_new_connection, csv_files[table], table, TABLE_COLUMNS[table])
+            for table in parallel_tables
+        }
+        for table, future in futures.items():
+            report[table] = future.result()
+
+    return report
+
+def print_load_report(report):
+    """Print rows per second for each table"""
+    print("\nLoad report:")
+    for table, stats in report.items():
+        if stats is None:
+            print(f"  {table:<16} FAILED")
+        else:
+            print(f"  {table:<16} {stats['rows']:>10} rows  {stats['seconds']:>9}s  {stats['rows_per_second']:>10} rows/s")
+
+def _run_on_new_connection(statements):
+    """Run DDL statements in autocommit mode on a dedicated connection"""
+    conn = create_connection()
+    conn.autocommit = True
+    try:
+        with conn.cursor() as cursor:
+            for statement in statements:
+                cursor.execute(statement)
+    finally:
+        conn.close()
+
+def _run_in_parallel(batches, workers):
+    """Run each batch of statements on its own connection, all batches at the same time"""
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for future in [executor.submit(_run_on_new_connection, batch) for batch in batches]:
+            future.result()
+
+def _constraint_exists(cursor, name):
+    cursor.execute("SELECT 1 FROM pg_constraint WHERE conname = %s", (name,))
+    return cursor.fetchone() is not None
+
+def build_post_load_objects(conn, workers=LOAD_WORKERS):
+    """
+    Add keys, indexes and foreign keys to bulk-loaded tables, then ANALYZE them
+
+    Each table's indexes are built with one scan per index, and all tables
+    are indexed in parallel on separate connections. Foreign keys are added
+    NOT VALID and then validated in parallel, which checks each child table
+    once instead of row by row during the load.
+
+    Args:
+        conn: Database connection
+        workers: Number of tables processed at the same time
+
+    Returns:
+        dict: Seconds spent in each phase
+    """
+    timings = {}
+
+    # Primary keys are attached to a unique index built up front
+    start = time.perf_counter()
+    index_batches = []
+    for table, key in PRIMARY_KEYS.items():
+        batch = [f"CREATE UNIQUE INDEX IF NOT EXISTS {table}_pkey ON {table} ({key})"]
+        if table in FOREIGN_KEYS:
+            batch.append(f"CREATE INDEX IF NOT EXISTS {FOREIGN_KEYS[table][1]} ON {table} (subject_id)")
+        index_batches.append(batch)
+    _run_in_parallel(index_batches, workers)
+    timings['indexes'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    with conn.cursor() as cursor:
+        for table in PRIMARY_KEYS:
+            if not _constraint_exists(cursor, f"{table}_pkey"):
+                cursor.execute(f"ALTER TABLE {table} ADD CONSTRAINT {table}_pkey PRIMARY KEY USING INDEX {table}_pkey")
+        for table, (constraint, _) in FOREIGN_KEYS.items():
+            if not _constraint_exists(cursor, constraint):
+                cursor.execute(
+                    f"ALTER TABLE {table} ADD CONSTRAINT {constraint} "
+                    f"FOREIGN KEY (subject_id) REFERENCES subjects (subject_id) NOT VALID"
+                )
+    conn.commit()
+    _run_in_parallel(
+        [[f"ALTER TABLE {table} VALIDATE CONSTRAINT {constraint}"] for table, (constraint, _) in FOREIGN_KEYS.items()],
+        workers
+    )
+    timings['constraints'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    _run_in_parallel([[f"ANALYZE {table}"] for table in TABLE_COLUMNS], workers)
+    timings['analyze'] = time.perf_counter() - start
+
+    return timings
+
+def bulk_load(conn, csv_files):
+    """
+    Load into bare tables, then build keys, indexes and constraints and ANALYZE
+
+    Args:
+        conn: Database connection
+        csv_files: Mapping of table name to CSV path
+
+    Returns:
+        tuple: (load statistics per table, seconds per phase), or (report, None)
+        if a table failed to load
+    """
+    timings = {}
+
+    start = time.perf_counter()
+    create_tables(conn, BULK_CREATE_TABLES_SQL)
+    timings['create_tables'] = time.perf_counter() - start
+
+    # No foreign keys yet, so every table can be copied at once
+    start = time.perf_counter()
+    report = load_tables(conn, csv_files, workers=len(TABLE_COLUMNS), subjects_first=False)
+    timings['load'] = time.perf_counter() - start
+    if any(stats is None for stats in report.values()):
+        print("Skipping index and constraint build because a table failed to load.")
+        return report, None
+
+    try:
+        timings.update(build_post_load_objects(conn))
+    except psycopg2.Error as e:
+        print(f"Error building indexes and constraints: {e}")
+        conn.rollback()
+        return report, None
+
+    return report, {phase: round(seconds, 3) for phase, seconds in timings.items()}
+
+def print_phase_timings(timings):
+    """Print seconds spent in each load phase"""
+    print("\nPhase timings:")
+    for phase, seconds in timings.items():
+        print(f"  {phase:<16} {seconds:>9}s")
+    print(f"  {'total':<16} {round(sum(timings.values()), 3):>9}s")
+
+# Business keys used to match incoming rows to existing rows in incremental mode
+TABLE_KEYS = {
+    'subjects': ['subject_id'],
+    'aes': ['subject_id', 'ae_term', 'start_date'],
+    'labs': ['subject_id', 'visit', 'lab_test'],
+    'tumor_response': ['subject_id', 'visit', 'assessed_by'],
+}
+
+# Where the changed-table summary of each load is written
+LOAD_SUMMARY_PATH = os.getenv('LOAD_SUMMARY_PATH', 'load_summary.json')
+
+def _fingerprint(alias, columns):
+    """SQL expression hashing a set of columns of one row (NULL-safe)"""
+    return f"md5(ROW({', '.join(f'{alias}.{column}' for column in columns)})::text)"
+
+def stage_table(cursor, file_path, table_name):
+    """
+    Copy a CSV into a fingerprinted temp table
+
+    Every staged row gets a key_hash over its business key and a row_hash
+    over the remaining columns. Whole-row duplicates are collapsed to one,
+    so each key is merged at most once. Rows that share a business key but
+    differ elsewhere cannot be merged by key without losing one of them, so
+    they fail the load instead.
+
+    Returns:
+        tuple: (fingerprinted staging table name, rows copied, duplicate rows dropped)
+
+    Raises:
+        ValueError: If rows with the same business key differ in other columns
+    """
+    columns = TABLE_COLUMNS[table_name]
+    keys = TABLE_KEYS[table_name]
+    values = [column for column in columns if column not in keys]
+    raw_table = f"stage_{table_name}_raw"
+    staged_table = f"stage_{table_name}"
+
+    cursor.execute(
+        f"CREATE TEMP TABLE {raw_table} ON COMMIT DROP AS "
+        f"SELECT {', '.join(columns)} FROM {table_name} WITH NO DATA"
+    )
+    rows = copy_csv(cursor, file_path, table_name, raw_table, columns)
+
+    cursor.execute(f"""
+        CREATE TEMP TABLE {staged_table} ON COMMIT DROP AS
+        SELECT DISTINCT ON (key_hash, row_hash) *
+        FROM (
+            SELECT s.*, {_fingerprint('s', keys)} AS key_hash, {_fingerprint('s', values)} AS row_hash
+            FROM {raw_table} s
+        ) fingerprinted
+        ORDER BY key_hash, row_hash
+    """)
+    distinct_rows = cursor.rowcount
+    cursor.execute(f"SELECT count(DISTINCT key_hash) FROM {staged_table}")
+    conflicts = distinct_rows - cursor.fetchone()[0]
+    if conflicts:
+        raise ValueError(
+            f"{conflicts} rows of {table_name} repeat a business key ({', '.join(keys)}) with different values; "
+            f"load them with --mode full"
+        )
+    duplicates = rows - distinct_rows
+    if duplicates:
+        print(f"Warning: {duplicates} duplicate rows in {file_path} were loaded once")
+    cursor.execute(f"CREATE INDEX ON {staged_table} (key_hash)")
+    cursor.execute(f"ANALYZE {staged_table}")
+    return staged_table, rows, duplicates
+
+def merge_table(cursor, table_name, staged_table):
+    """
+    Apply inserts and updates from a staging table with set-based statements
+
+    Returns:
+        dict: Number of rows inserted and updated
+    """
+    columns = TABLE_COLUMNS[table_name]
+    keys = TABLE_KEYS[table_name]
+    values = [column for column in columns if column not in keys]
+
+    updated = 0
+    if values:
+        assignments = ', '.join(f"{column} = s.{column}" for column in values)
+        cursor.execute(f"""
+            UPDATE {table_name} AS t SET {assignments}
+            FROM {staged_table} s
+            WHERE {_fingerprint('t', keys)} = s.key_hash
+              AND {_fingerprint('t', values)} <> s.row_hash
+        """)
+        updated = cursor.rowcount
+
+    cursor.execute(f"""
+        INSERT INTO {table_name} ({', '.join(columns)})
+        SELECT {', '.join(f's.{column}' for column in columns)}
+        FROM {staged_table} s
+        WHERE NOT EXISTS (
+            SELECT 1 FROM {table_name} t WHERE {_fingerprint('t', keys)} = s.key_hash
+        )
+    """)
+    return {'inserted': cursor.rowcount, 'updated': updated}
+
+def delete_missing_rows(cursor, table_name, staged_table):
+    """Delete rows whose business key is no longer in the extract"""
+    cursor.execute(f"""
+        DELETE FROM {table_name} t
+        WHERE NOT EXISTS (
+            SELECT 1 FROM {staged_table} s WHERE s.key_hash = {_fingerprint('t', TABLE_KEYS[table_name])}
+        )
+    """)
+    return cursor.rowcount
+
+def incremental_load(conn, csv_files):
+    """
+    Apply a refreshed extract as inserts, updates and deletes in one transaction
+
+    All CSVs are staged first. Inserts and updates are applied parent
+    table first and deletes child tables first, so foreign keys hold at
+    every step.
+
+    Args:
+        conn: Database connection
+        csv_files: Mapping of table name to CSV path
+
+    Returns:
+        dict: Rows staged, inserted, updated and deleted per table, or None on failure
+    """
+    tables = list(TABLE_COLUMNS)
+    report = {}
+    cursor = conn.cursor()
+    try:
+        staged = {}
+        for table in tables:
+            start = time.perf_counter()
+            staged[table], rows, duplicates = stage_table(cursor, csv_files[table], table)
+            report[table] = {'staged': rows, 'duplicates': duplicates, 'seconds': time.perf_counter() - start}
+
+        for table in tables:
+            start = time.perf_counter()
+            report[table].update(merge_table(cursor, table, staged[table]))
+            report[table]['seconds'] += time.perf_counter() - start
+
+        for table in reversed(tables):
+            start = time.perf_counter()
+            report[table]['deleted'] = delete_missing_rows(cursor, table, staged[table])
+            report[table]['seconds'] += time.perf_counter() - start
+
+        conn.commit()
+    except Exception as e:
+        print(f"Error during incremental load: {e}")
+        conn.rollback()
+        return None
+    finally:
+        cursor.close()
+
+    for stats in report.values():
+        stats['seconds'] = round(stats['seconds'], 3)
+    return report
+
+def write_load_summary(mode, changes, path=LOAD_SUMMARY_PATH):
+    """
+    Write the changed-table summary that downstream caches invalidate on
+
+    Args:
+        mode: Load mode that produced the changes
+        changes: Mapping of table name to its change counts
+        path: Where to write the summary (replaced atomically)
+
+    Returns:
+        dict: The summary that was written
+    """
+    changed_tables = [
+        table for table, stats in changes.items()
+        if stats and (stats.get('inserted') or stats.get('updated') or stats.get('deleted'))
+    ]
+    summary = {
+        'mode': mode,
+        'loaded_at': datetime.now(timezone.utc).isoformat(),
+        'database': os.environ.get('PGDATABASE'),
+        'changed_tables': changed_tables,
+        'tables': changes,
+    }
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(summary, f, indent=2)
+    os.replace(tmp_path, path)
+    print(f"Changed tables: {', '.join(changed_tables) or 'none'} (summary written to {path})")
+    return summary
+
+def parse_args():
+    """Parse command line options"""
+    parser = argparse.ArgumentParser(description="Load the clinical study CSV extracts into PostgreSQL")
+    parser.add_argument(
+        '--mode',
+        choices=['full', 'incremental', 'bulk'],
+        default='full',
+        help="full: initial COPY load; incremental: merge a refreshed extract into existing tables; "
+             "bulk: initial load into bare tables, then build indexes and constraints and ANALYZE"
+    )
+    return parser.parse_args()
+
+def print_incremental_report(report):
+    """Print staged, duplicate and changed rows for each table"""
+    print("\nIncremental load report:")
+    for table, stats in report.items():
+        print(f"  {table:<16} {stats['staged']:>10} staged  {stats['duplicates']:>6} duplicate  "
+              f"{stats['inserted']:>8} inserted  "
+              f"{stats['updated']:>8} updated  {stats['deleted']:>8} deleted  {stats['seconds']:>9}s")
+
 def main():
     """Main function to execute the database operations"""
+    args = parse_args()
     
     # Define CSV file paths with hardcoded paths
     csv_files = {
@@ -267,43 +792,32 @@ def main():
     # Create clinical_study_db database
     conn = create_database(conn)
     
-    # Create tables
-    create_tables(conn)
-    
-    # Upload data from CSV files to tables
-    # Note: Order matters due to foreign key constraints
-    
-    # 1. First upload subjects table (as other tables reference it)
-    upload_csv_to_table(
-        conn, 
-        csv_files['subjects'], 
-        'subjects', 
-        ['subject_id', 'site_id', 'arm', 'dob', 'gender', 'enroll_date']
-    )
-    
-    # 2. Upload AEs table
-    upload_csv_to_table(
-        conn, 
-        csv_files['aes'], 
-        'aes', 
-        ['subject_id', 'ae_term', 'severity', 'start_date', 'end_date', 'related']
-    )
-    
-    # 3. Upload Labs table
-    upload_csv_to_table(
-        conn, 
-        csv_files['labs'], 
-        'labs', 
-        ['subject_id', 'visit', 'lab_test', 'value', 'units', 'normal_range']
-    )
-    
-    # 4. Upload Tumor Response table
-    upload_csv_to_table(
-        conn, 
-        csv_files['tumor_response'], 
-        'tumor_response', 
-        ['subject_id', 'visit', 'response', 'assessed_by']
-    )
+    if args.mode == 'bulk':
+        report, timings = bulk_load(conn, csv_files)
+        print_load_report(report)
+        if timings is None:
+            conn.close()
+            sys.exit(1)
+        print_phase_timings(timings)
+        changes = {table: {'inserted': stats['rows']} for table, stats in report.items()}
+    elif args.mode == 'incremental':
+        create_tables(conn)
+        changes = incremental_load(conn, csv_files)
+        if changes is None:
+            conn.close()
+            sys.exit(1)
+        print_incremental_report(changes)
+    else:
+        create_tables(conn)
+        # Upload data from CSV files to tables
+        # Note: subjects is loaded first due to foreign key constraints
+        report = load_tables(conn, csv_files)
+        print_load_report(report)
+        changes = {table: {'inserted': stats['rows']} if stats else None for table, stats in report.items()}
+
+    summary = write_load_summary(args.mode, changes)
+    if summary['changed_tables'] or not os.path.exists(metadata_path(os.environ['PGDATABASE'])):
+        refresh_schema_metadata(conn, os.environ['PGDATABASE'], summary)
     
     # Close connection
     conn.close()